@@ -0,0 +1,135 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import time
+import threading
+import requests
+
+from .logger import get_logger
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+
+    """ Request rejected by the open circuit breaker
+    """
+
+
+class CircuitBreaker:
+
+    """ Circuit breaker which stops requests to the unavailable server
+        and lets single probe requests through after the reset time
+    """
+
+    def __init__(self, configuration=None):
+        """ constructor
+
+        :param configuration: dictionary with the ingestor configuration
+        :type configuration: :obj:`dict` <:obj:`str`, `any`>
+        """
+        #: (:obj:`dict` <:obj:`str`, `any`>) ingestor configuration
+        self.__config = configuration or {}
+
+        #: (:obj:`int`) number of consecutive failures opening the circuit
+        self.__failures_number = 5
+        #: (:obj:`float`) time in s after which a probe request is allowed
+        self.__reset_time = 30.0
+
+        if "circuit_breaker_failures_number" in self.__config.keys():
+            try:
+                self.__failures_number = max(
+                    1, int(self.__config["circuit_breaker_failures_number"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "circuit_breaker_reset_time" in self.__config.keys():
+            try:
+                self.__reset_time = float(
+                    self.__config["circuit_breaker_reset_time"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:obj:`int`) number of consecutive failures
+        self.__failures = 0
+        #: (:obj:`float`) time when the circuit was opened or None
+        self.__opened = None
+        #: (:obj:`bool`) probe request in flight flag
+        self.__probing = False
+        #: (:class:`threading.Lock`) breaker lock
+        self.__lock = threading.Lock()
+
+    def closed(self):
+        """ checks if requests are passed without restrictions
+
+        :returns: closed circuit flag
+        :rtype: :obj:`bool`
+        """
+        with self.__lock:
+            return self.__opened is None
+
+    def allow(self):
+        """ checks if the request can be sent
+
+        :returns: request allowed flag
+        :rtype: :obj:`bool`
+        """
+        with self.__lock:
+            if self.__opened is None:
+                return True
+            if self.__probing or \
+               time.time() - self.__opened < self.__reset_time:
+                return False
+            # half-open circuit lets a single probe request through
+            self.__probing = True
+            return True
+
+    def record(self, status=None, error=False):
+        """ records the result of the request
+
+        :param status: response status code
+        :type status: :obj:`int`
+        :param error: request error flag
+        :type error: :obj:`bool`
+        """
+        failure = error or (status is not None and status >= 500)
+        with self.__lock:
+            probing = self.__probing
+            self.__probing = False
+            if not failure:
+                if self.__opened is not None:
+                    get_logger().info(
+                        'CircuitBreaker: SciCat is available again')
+                self.__failures = 0
+                self.__opened = None
+                return
+            self.__failures += 1
+            if probing or (self.__opened is None and
+                           self.__failures >= self.__failures_number):
+                if self.__opened is None:
+                    get_logger().warning(
+                        'CircuitBreaker: SciCat is unavailable after %s '
+                        'failed requests' % self.__failures)
+                self.__opened = time.time()
+
+
+#: (:obj:`list` <:obj:`str`>) configuration variables of the breaker
+BREAKER_CONFIG_KEYS = [
+    "circuit_breaker",
+    "circuit_breaker_failures_number",
+    "circuit_breaker_reset_time",
+]
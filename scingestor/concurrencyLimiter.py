@@ -0,0 +1,205 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import time
+import math
+import threading
+
+from .logger import get_logger
+
+
+class ConcurrencyLimiter:
+
+    """ Adaptive limiter of in-flight requests with additive-increase
+        and multiplicative-decrease (AIMD) of the limit
+    """
+
+    #: (:obj:`list` <:obj:`int`>) response status codes of overload
+    overload_status_codes = [429, 503]
+
+    def __init__(self, configuration=None):
+        """ constructor
+
+        :param configuration: dictionary with the ingestor configuration
+        :type configuration: :obj:`dict` <:obj:`str`, `any`>
+        """
+        #: (:obj:`dict` <:obj:`str`, `any`>) ingestor configuration
+        self.__config = configuration or {}
+
+        #: (:obj:`float`) initial limit of in-flight requests
+        self.__initial = 4.0
+        #: (:obj:`float`) minimal limit of in-flight requests
+        self.__min = 1.0
+        #: (:obj:`float`) maximal limit of in-flight requests
+        self.__max = 32.0
+        #: (:obj:`float`) multiplicative decrease factor of the limit
+        self.__decrease = 0.5
+        #: (:obj:`float`) maximal share of the limit used by one key,
+        #:    e.g. one beamtime
+        self.__share = None
+
+        if "adaptive_concurrency_initial" in self.__config.keys():
+            try:
+                self.__initial = float(
+                    self.__config["adaptive_concurrency_initial"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "adaptive_concurrency_min" in self.__config.keys():
+            try:
+                self.__min = max(
+                    1.0, float(self.__config["adaptive_concurrency_min"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "adaptive_concurrency_max" in self.__config.keys():
+            try:
+                self.__max = float(self.__config["adaptive_concurrency_max"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "adaptive_concurrency_decrease" in self.__config.keys():
+            try:
+                self.__decrease = float(
+                    self.__config["adaptive_concurrency_decrease"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "adaptive_concurrency_beamtime_share" in self.__config.keys():
+            try:
+                self.__share = float(
+                    self.__config["adaptive_concurrency_beamtime_share"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        self.__max = max(self.__min, self.__max)
+        #: (:obj:`float`) current limit of in-flight requests
+        self.__limit = min(max(self.__initial, self.__min), self.__max)
+        #: (:obj:`int`) number of in-flight requests
+        self.__inflight = 0
+        #: (:obj:`dict` <:obj:`str`, :obj:`int`>)
+        #:    number of in-flight requests per key
+        self.__keyinflight = {}
+        #: (:obj:`float`) time of the last limit decrease
+        self.__decreased = 0
+        #: (:class:`threading.Condition`) limiter condition
+        self.__condition = threading.Condition()
+
+    def limit(self):
+        """ provides current limit of in-flight requests
+
+        :returns: request limit
+        :rtype: :obj:`int`
+        """
+        with self.__condition:
+            return int(self.__limit)
+
+    def inflight(self, key=None):
+        """ provides number of in-flight requests
+
+        :param key: request key, e.g. beamtime id
+        :type key: :obj:`str`
+        :returns: number of in-flight requests
+        :rtype: :obj:`int`
+        """
+        with self.__condition:
+            if key is None:
+                return self.__inflight
+            return self.__keyinflight.get(key, 0)
+
+    def __available(self, key):
+        """ checks if a new request can be started, called with the lock
+
+        :param key: request key, e.g. beamtime id
+        :type key: :obj:`str`
+        :returns: available flag
+        :rtype: :obj:`bool`
+        """
+        limit = int(self.__limit)
+        if self.__inflight >= limit:
+            return False
+        if key is not None and self.__share:
+            keylimit = max(1, int(math.floor(limit * self.__share)))
+            if self.__keyinflight.get(key, 0) >= keylimit:
+                return False
+        return True
+
+    def acquire(self, key=None):
+        """ waits for a free slot of an in-flight request
+
+        :param key: request key, e.g. beamtime id
+        :type key: :obj:`str`
+        :returns: request start time
+        :rtype: :obj:`float`
+        """
+        with self.__condition:
+            while not self.__available(key):
+                self.__condition.wait()
+            self.__inflight += 1
+            if key is not None:
+                self.__keyinflight[key] = self.__keyinflight.get(key, 0) + 1
+        return time.time()
+
+    def release(self, start, key=None, status=None, timeout=False):
+        """ frees the slot of the finished request and adapts the limit.
+            Only timeouts, 429 and 503 responses mean overload since
+            the latency of large uploads depends on their size
+
+        :param start: request start time
+        :type start: :obj:`float`
+        :param key: request key, e.g. beamtime id
+        :type key: :obj:`str`
+        :param status: response status code
+        :type status: :obj:`int`
+        :param timeout: request timeout flag
+        :type timeout: :obj:`bool`
+        """
+        now = time.time()
+        overload = timeout or status in self.overload_status_codes
+        with self.__condition:
+            self.__inflight -= 1
+            if key is not None:
+                self.__keyinflight[key] -= 1
+                if not self.__keyinflight[key]:
+                    self.__keyinflight.pop(key)
+            if overload:
+                # requests started before the last decrease
+                # do not decrease the limit again
+                if start > self.__decreased:
+                    self.__limit = max(
+                        self.__min, self.__limit * self.__decrease)
+                    self.__decreased = now
+                    get_logger().debug(
+                        'ConcurrencyLimiter: limit decreased to %s'
+                        % int(self.__limit))
+            else:
+                self.__limit = min(
+                    self.__max, self.__limit + 1.0 / self.__limit)
+            self.__condition.notify_all()
+
+
+#: (:obj:`list` <:obj:`str`>) configuration variables of the limiter
+LIMITER_CONFIG_KEYS = [
+    "adaptive_concurrency",
+    "adaptive_concurrency_initial",
+    "adaptive_concurrency_min",
+    "adaptive_concurrency_max",
+    "adaptive_concurrency_decrease",
+    "adaptive_concurrency_beamtime_share",
+]
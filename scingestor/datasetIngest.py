@@ -269,6 +269,7 @@ class DatasetIngest:
                         if scan and not scan.startswith("__command__ "):
                             ingestor.reingest(scan, token)
                 ingestor.update_from_tmpfile()
+                ingestor.log_metrics()
             except Exception as e:
                 get_logger().warning(str(e))
 
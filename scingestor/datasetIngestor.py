@@ -20,14 +20,25 @@
 import os
 import glob
 import json
-import subprocess
-import requests
 import time
+import datetime
 import enum
 import socket
 import pathlib
 import shutil
-
+import re
+import hashlib
+import mmap
+import threading
+import concurrent.futures
+
+from .scicatClient import get_scicat_client
+from .datasetSpool import DatasetSpool
+from . import jsonStream
+from .tokenProvider import get_token_provider
+from .remoteStateCache import get_remote_state_cache
+from .payloadValidator import get_payload_validator
+from .metadataGenerator import MetadataGenerator
 from .logger import get_logger
 
 
@@ -52,6 +63,9 @@ class DatasetIngestor:
     """ Dataset Ingestor
     """
 
+    #: (:obj:`list` <:obj:`int`>) response codes of unsupported bulk deletes
+    bulk_delete_unsupported_codes = [404, 405, 501]
+
     def __init__(self, configuration,
                  path, dsfile, idsfile, meta, beamtimefile):
         """ constructor
@@ -89,6 +103,10 @@ class DatasetIngestor:
         self.__idsfile = idsfile
         #: (:obj:`str`) file with a ingested dataset tmp list
         self.__idsfiletmp = "%s%s" % (idsfile, ".tmp")
+        #: (:obj:`str`) file with digests of ingested dataset metadata
+        self.__digestfile = "%s%s" % (idsfile, ".digests")
+        #: (:obj:`str`) file with digests of posted origdatablock chunks
+        self.__chunkfile = "%s%s" % (idsfile, ".chunks")
         #: (:obj:`str`) scan path dir
         self.__path = path
         #: (:obj:`str`) metadata path dir
@@ -180,6 +198,95 @@ class DatasetIngestor:
 
         #: (:obj:`int`) maximal counter value for post tries
         self.__maxcounter = 100
+        #: (:obj:`int`) maximal number of concurrent dataset sub-requests
+        self.__max_request_workers = 1
+        #: (:class:`scingestor.remoteStateCache.RemoteStateCache`)
+        #:      local mirror of remote dataset state
+        self.__statecache = None
+        #: (:obj:`bool`) resolve new pid versions with one list query
+        self.__pid_version_query = False
+        #: (:obj:`bool`) delete all dataset items with one filtered delete
+        self.__bulk_delete = False
+        #: (:obj:`float`) number of spooled datasets ingested per second
+        self.__spool_drain_rate = 1.0
+        #: (:obj:`int`) minimal size in bytes of metadata files
+        #:    uploaded without loading them into memory
+        self.__streaming_min_size = None
+        #: (:obj:`bool`) patch only changed top-level dataset fields
+        self.__patch_minimal_diff = False
+        #: (:obj:`bool`) compare metadata by canonical digests first
+        self.__metadata_digests = False
+        #: (:obj:`dict` <:obj:`str`, :obj:`str`>)
+        #:      metadata digests of ingested datasets
+        self.__sc_digests = None
+        #: (:obj:`bool`) scicat merges patched scientificMetadata
+        self.__patch_metadata_merge = False
+        #: (:obj:`list` <:class:`UpdateStrategy`>) update strategies
+        #:      which post new datasets without checking if they exist
+        self.__optimistic_strategies = []
+        #: (:obj:`dict` <:obj:`str`, :obj:`int`>)
+        #:      counters of optimistic dataset posts
+        self.__optimistic_metrics = {"posts": 0, "created": 0,
+                                     "conflicts": 0}
+        #: (:obj:`bool`) look up all waiting datasets with list queries
+        self.__batch_lookup = False
+        #: (:obj:`int`) number of pids in one batch lookup query
+        self.__batch_lookup_size = 100
+        #: (:obj:`dict` <:obj:`str`, :obj:`dict` <:obj:`str`, `any`>>)
+        #:      looked up dataset documents or None if they do not exist
+        self.__batch_datasets = {}
+        #: (:class:`scingestor.payloadValidator.PayloadValidator`)
+        #:      preflight validator of generated payloads
+        self.__validator = None
+        #: (:obj:`int`) maximal number of files in one origdatablock
+        self.__chunk_files = None
+        #: (:obj:`int`) maximal size in bytes of the file list
+        #:      in one origdatablock
+        self.__chunk_size = None
+        #: (:obj:`dict` <:obj:`str`, :obj:`set` <:obj:`str`>>)
+        #:      digests of posted origdatablock chunks of datasets
+        self.__sc_chunks = None
+        #: (:class:`threading.Lock`) origdatablock chunks lock
+        self.__chunk_lock = threading.Lock()
+        #: (:obj:`bool`) re-ingest only the last waiting entry
+        #:      of the same scan or measurement
+        self.__reingest_coalescing = False
+        #: (:obj:`dict` <:obj:`str`, :obj:`list` <:obj:`str`>>)
+        #:      re-ingest entries coalesced with a later entry
+        self.__coalesced = {}
+        #: (:obj:`bool`) generate and ingest attachments after datasets
+        #:      in a separate lane
+        self.__attachment_lane = False
+        #: (:obj:`int`) number of workers of the attachment lane
+        self.__attachment_lane_workers = 1
+        #: (:obj:`int`) number of tries of deferred attachments
+        self.__attachment_lane_tries = 3
+        #: (:class:`concurrent.futures.ThreadPoolExecutor`)
+        #:      executor of the attachment lane
+        self.__attachment_executor = None
+        #: (:class:`threading.Lock`) attachment lane lock
+        self.__attachment_lock = threading.Lock()
+        #: (:class:`threading.Lock`) ingested dataset list lock
+        self.__record_lock = threading.Lock()
+        #: (:class:`threading.Lock`) ingested dataset digest lock
+        self.__digest_lock = threading.Lock()
+        #: (:obj:`set` <:obj:`str`>) scans with attachments queued
+        #:      in the attachment lane
+        self.__pending_attachments = set()
+        #: (:obj:`bool`) run nxsfileinfo generator commands in the process
+        self.__inprocess_generators = False
+        #: (:obj:`bool`) update origdatablocks with new and changed files
+        #:      instead of posting all files again
+        self.__incremental_origdatablocks = False
+        #: (:obj:`bool`) register datasets and their files
+        #:      while scans are running
+        self.__progressive = False
+        #: (:obj:`dict` <:obj:`str`, :obj:`dict` <:obj:`str`, `any`>>)
+        #:      dataset ids and posted file paths of running scans
+        self.__progressive_scans = {}
+        #: (:obj:`dict` <:obj:`str`, :obj:`int`>)
+        #:      last posted versions of base pids
+        self.__pid_versions = {}
 
         #: (:obj:`str`) raw dataset scan postfix
         self.__scanpostfix = ".scan.json"
@@ -684,6 +791,153 @@ class DatasetIngestor:
             except Exception as e:
                 get_logger().warning('%s' % (str(e)))
 
+        if "max_request_workers" in self.__config.keys():
+            try:
+                self.__max_request_workers = max(
+                    1, int(self.__config["max_request_workers"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "remote_state_cache" in self.__config.keys() \
+           and self.__config["remote_state_cache"]:
+            self.__statecache = get_remote_state_cache(self.__config)
+
+        if "pid_version_query" in self.__config.keys():
+            self.__pid_version_query = bool(
+                self.__config["pid_version_query"])
+
+        if "bulk_delete" in self.__config.keys():
+            self.__bulk_delete = bool(self.__config["bulk_delete"])
+
+        if "spool_drain_rate" in self.__config.keys():
+            try:
+                self.__spool_drain_rate = float(
+                    self.__config["spool_drain_rate"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "metadata_digests" in self.__config.keys():
+            self.__metadata_digests = bool(
+                self.__config["metadata_digests"])
+
+        if "attachment_lane" in self.__config.keys():
+            self.__attachment_lane = bool(self.__config["attachment_lane"])
+
+        if "attachment_lane_workers" in self.__config.keys():
+            try:
+                self.__attachment_lane_workers = max(
+                    1, int(self.__config["attachment_lane_workers"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "attachment_lane_tries_number" in self.__config.keys():
+            try:
+                self.__attachment_lane_tries = max(
+                    1, int(self.__config["attachment_lane_tries_number"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "inprocess_metadata_generators" in self.__config.keys():
+            self.__inprocess_generators = bool(
+                self.__config["inprocess_metadata_generators"])
+
+        #: (:class:`scingestor.metadataGenerator.MetadataGenerator`)
+        #:      runner of metadata generator commands
+        self.__generator = MetadataGenerator(self.__inprocess_generators)
+
+        if "incremental_origdatablocks" in self.__config.keys():
+            self.__incremental_origdatablocks = bool(
+                self.__config["incremental_origdatablocks"])
+
+        if "progressive_ingestion" in self.__config.keys():
+            self.__progressive = bool(
+                self.__config["progressive_ingestion"])
+
+        if "reingest_coalescing" in self.__config.keys():
+            self.__reingest_coalescing = bool(
+                self.__config["reingest_coalescing"])
+
+        if "origdatablock_chunk_files" in self.__config.keys() \
+           and self.__config["origdatablock_chunk_files"]:
+            try:
+                self.__chunk_files = max(
+                    1, int(self.__config["origdatablock_chunk_files"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "origdatablock_chunk_size" in self.__config.keys() \
+           and self.__config["origdatablock_chunk_size"]:
+            try:
+                self.__chunk_size = max(
+                    1, int(self.__config["origdatablock_chunk_size"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "payload_validation" in self.__config.keys() \
+           and self.__config["payload_validation"]:
+            self.__validator = get_payload_validator(self.__config)
+
+        if "batch_existence_lookup" in self.__config.keys():
+            self.__batch_lookup = bool(
+                self.__config["batch_existence_lookup"])
+
+        if "batch_existence_lookup_size" in self.__config.keys():
+            try:
+                self.__batch_lookup_size = max(
+                    1, int(self.__config["batch_existence_lookup_size"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "optimistic_create" in self.__config.keys():
+            try:
+                strategies = self.__config["optimistic_create"]
+                if strategies is True:
+                    self.__optimistic_strategies = list(UpdateStrategy)
+                elif strategies:
+                    if not isinstance(strategies, list):
+                        strategies = [strategies]
+                    self.__optimistic_strategies = [
+                        UpdateStrategy[str(st).upper()]
+                        for st in strategies]
+            except Exception as e:
+                get_logger().warning(
+                    'Wrong UpdateStrategy value: %s' % str(e))
+
+        if "patch_minimal_diff" in self.__config.keys():
+            self.__patch_minimal_diff = bool(
+                self.__config["patch_minimal_diff"])
+
+        if "patch_metadata_merge" in self.__config.keys():
+            self.__patch_metadata_merge = bool(
+                self.__config["patch_metadata_merge"])
+
+        if "streaming_upload_min_size" in self.__config.keys() \
+           and self.__config["streaming_upload_min_size"] is not None:
+            try:
+                self.__streaming_min_size = int(
+                    self.__config["streaming_upload_min_size"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:class:`scingestor.scicatClient.SciCatClient`)
+        #:      process-wide SciCat client with pooled connections
+        #:      and the beamtime share of the concurrency limit
+        self.__client = get_scicat_client(self.__config).keyed(self.__bid)
+
+        #: (:class:`scingestor.datasetSpool.DatasetSpool`)
+        #:      spool of payloads prepared while SciCat is unavailable
+        self.__spool = None
+        if self.__client.breaker() is not None:
+            self.__spool = DatasetSpool("%s%s" % (idsfile, ".spool"))
+
+        #: (:obj:`str`) file with scans of invalid payloads
+        self.__quarantinefile = "%s%s" % (idsfile, ".quarantine")
+        #: (:class:`scingestor.datasetSpool.DatasetSpool`)
+        #:      quarantine of scans with invalid payloads
+        self.__quarantine = None
+        if self.__validator is not None:
+            self.__quarantine = DatasetSpool(self.__quarantinefile)
+
         #: (:obj:`dict` <:obj:`str`, :obj:`str`>) command format parameters
         self.__dctfmt = {
             "scanname": None,
@@ -736,6 +990,11 @@ class DatasetIngestor:
         self.__tokenurl = self.__scicat_url + self.__scicat_users_login
         # get_logger().info(
         #     'DatasetIngestor: LOGIN %s' % self.__tokenurl)
+        #: (:class:`scingestor.tokenProvider.TokenProvider`)
+        #:      process-wide token provider
+        self.__tokenprovider = get_token_provider(
+            self.__tokenurl, self.__username, self.__incd,
+            self.__headers, self.__config)
 
         #: (:obj:`str`) dataset url
         self.__dataseturl = self.__scicat_url + self.__scicat_datasets
@@ -830,7 +1089,7 @@ class DatasetIngestor:
                 get_logger().debug(
                     'DatasetIngestor: Generating dataset command: %s ' % (
                         command))
-            subprocess.run(command, shell=True, check=True)
+            self.__generator.run(command)
 
             if self.__dctfmt["masterscanname"] != self.__dctfmt["scanname"]:
                 if os.path.isfile(self.__dctfmt["masterfile"]):
@@ -852,7 +1111,7 @@ class DatasetIngestor:
                 get_logger().debug(
                     'DatasetIngestor: Generating dataset command: %s'
                     % (command))
-            subprocess.run(command, shell=True, check=True)
+            self.__generator.run(command)
         if ffname and os.path.isfile(ffname):
             try:
                 os.remove(ffname)
@@ -890,7 +1149,7 @@ class DatasetIngestor:
         else:
             get_logger().debug(
                 'DatasetIngestor: Generating origdatablock command: %s' % cmd)
-        subprocess.run(cmd, shell=True, check=True)
+        self.__generator.run(cmd)
         odbs = glob.glob(
             "{metapath}/{scanname}{datablockpostfix}".format(
                     **self.__dctfmt))
@@ -898,46 +1157,50 @@ class DatasetIngestor:
             return odbs[0]
         return ""
 
-    def _generate_attachment_metadata(self, scan):
+    def _generate_attachment_metadata(self, scan, dctfmt=None):
         """ generate origdatablock metadata
 
         :param scan: scan name
         :type scan: :obj:`str`
+        :param dctfmt: command format parameters of the scan
+        :type dctfmt: :obj:`dict` <:obj:`str`, `any`>
         :returns: a file name of generate file
         :rtype: :obj:`str`
         """
-        self.__plotext = ""
+        if dctfmt is None:
+            dctfmt = self.__dctfmt
+        plotext = ""
 
-        self.__dctfmt["plotfile"] = \
-            "{scanpath}/{masterscanname}.{plotext}".format(**self.__dctfmt)
+        dctfmt["plotfile"] = \
+            "{scanpath}/{masterscanname}.{plotext}".format(**dctfmt)
         for ext in self.__plot_file_extension_list:
-            self.__dctfmt["plotext"] = ext
+            dctfmt["plotext"] = ext
 
             if os.path.isfile(
                     "{scanpath}/{masterscanname}.{plotext}".format(
-                        **self.__dctfmt)):
-                self.__plotext = ext
-                self.__dctfmt["plotfile"] = \
+                        **dctfmt)):
+                plotext = ext
+                dctfmt["plotfile"] = \
                     "{scanpath}/{masterscanname}.{plotext}".format(
-                        **self.__dctfmt)
+                        **dctfmt)
                 break
         else:
             for ext in self.__plot_file_extension_list:
-                self.__dctfmt["plotext"] = ext
+                dctfmt["plotext"] = ext
 
                 if os.path.isfile(
                         "{scanpath}/{scanname}/{scanname}.{plotext}".
-                        format(**self.__dctfmt)):
-                    self.__plotext = ext
-                    self.__dctfmt["plotfile"] = \
+                        format(**dctfmt)):
+                    plotext = ext
+                    dctfmt["plotfile"] = \
                         "{scanpath}/{scanname}/{scanname}.{plotext}".format(
-                            **self.__dctfmt)
+                            **dctfmt)
                     break
-        self.__dctfmt["plotext"] = self.__plotext
+        dctfmt["plotext"] = plotext
         ffname = ""
-        if self.__dctfmt["plotext"]:
-            if self.__dctfmt["masterscanname"] != self.__dctfmt["scanname"]:
-                plotfile = self.__dctfmt["plotfile"]
+        if dctfmt["plotext"]:
+            if dctfmt["masterscanname"] != dctfmt["scanname"]:
+                plotfile = dctfmt["plotfile"]
                 mdir, mfile = os.path.split(plotfile)
                 if self.__meta_in_var_dir and self.__var_dir:
                     mdir = "%s%s" % (self.__var_dir, mdir)
@@ -950,27 +1213,27 @@ class DatasetIngestor:
                     fcnt += 1
                     ffname = os.path.join(
                         mdir, "_tmp_scingestor_%s_%s" % (fcnt, mfile))
-                self.__dctfmt["plotfile"] = ffname
-                shutil.copy(plotfile, self.__dctfmt["plotfile"])
+                dctfmt["plotfile"] = ffname
+                shutil.copy(plotfile, dctfmt["plotfile"])
 
             get_logger().info(
                 'DatasetIngestor: Generating attachment metadata: %s %s' % (
                     scan,
                     "{metapath}/{scanname}{attachmentpostfix}".format(
-                        **self.__dctfmt)))
-            cmd = self.__attachmentcommand.format(**self.__dctfmt)
+                        **dctfmt)))
+            cmd = self.__attachmentcommand.format(**dctfmt)
             if self.__logcommands:
                 get_logger().info(
                     'DatasetIngestor: Generating attachment command: %s' % cmd)
             else:
                 get_logger().debug(
                     'DatasetIngestor: Generating attachment command: %s' % cmd)
-            subprocess.run(cmd, shell=True, check=True)
+            self.__generator.run(cmd)
 
-            if self.__dctfmt["masterscanname"] != self.__dctfmt["scanname"]:
-                if os.path.isfile(self.__dctfmt["plotfile"]):
-                    os.remove(self.__dctfmt["plotfile"])
-                self.__dctfmt["plotfile"] = plotfile
+            if dctfmt["masterscanname"] != dctfmt["scanname"]:
+                if os.path.isfile(dctfmt["plotfile"]):
+                    os.remove(dctfmt["plotfile"])
+                dctfmt["plotfile"] = plotfile
 
             if ffname and os.path.isfile(ffname):
                 try:
@@ -980,7 +1243,7 @@ class DatasetIngestor:
                         "File %s cannot be removed: %s" % (ffname, str(e)))
             adss = glob.glob(
                 "{metapath}/{scanname}{attachmentpostfix}".format(
-                    **self.__dctfmt))
+                    **dctfmt))
             if adss and adss[0]:
                 return adss[0]
         return ""
@@ -1014,27 +1277,7 @@ class DatasetIngestor:
         except Exception as e:
             if not force:
                 get_logger().warning('%s: %s' % (scan, str(e)))
-        cmd = self.__datablockmemcommand.format(**self.__dctfmt)
-        sscan = (scan or "").split(" ")
-        if self.__datablockscanpath:
-            dctfmt = dict(self.__dctfmt)
-            for sc in sscan:
-                dctfmt["scanname"] = sc
-                cmd += self.__datablockscanpath.format(**dctfmt)
-        get_logger().debug(
-            'DatasetIngestor: Checking origdatablock command: %s ' % cmd)
-        if self.__logcommands:
-            get_logger().info(
-                'DatasetIngestor: Generating origdatablock command: %s'
-                % cmd)
-        else:
-            get_logger().debug(
-                'DatasetIngestor: Generating origdatablock command: %s'
-                % cmd)
-        result = subprocess.run(
-            cmd, shell=True,
-            text=True, capture_output=True, check=True)
-        nwmeta = str(result.stdout)
+        nwmeta = self._origdatablock_listing(scan)
         if dmeta is None:
             with open(mfilename, "w") as mf:
                 mf.write(nwmeta)
@@ -1045,7 +1288,7 @@ class DatasetIngestor:
                 get_logger().warning('%s: %s' % (scan, str(e)))
                 dnwmeta = None
             if dnwmeta is not None:
-                if not self._metadataEqual(dmeta, dnwmeta) or force:
+                if not self._metadata_equal(dmeta, dnwmeta) or force:
                     get_logger().info(
                         'DatasetIngestor: '
                         'Generating origdatablock metadata: %s %s' % (
@@ -1060,6 +1303,151 @@ class DatasetIngestor:
             return odbs[0]
         return ""
 
+    def _origdatablock_listing(self, scan):
+        """ generates origdatablock metadata of the scan files in memory
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :returns: origdatablock metadata in json string
+        :rtype: :obj:`str`
+        """
+        cmd = self.__datablockmemcommand.format(**self.__dctfmt)
+        sscan = (scan or "").split(" ")
+        if self.__datablockscanpath:
+            dctfmt = dict(self.__dctfmt)
+            for sc in sscan:
+                dctfmt["scanname"] = sc
+                cmd += self.__datablockscanpath.format(**dctfmt)
+        get_logger().debug(
+            'DatasetIngestor: Checking origdatablock command: %s ' % cmd)
+        if self.__logcommands:
+            get_logger().info(
+                'DatasetIngestor: Generating origdatablock command: %s'
+                % cmd)
+        else:
+            get_logger().debug(
+                'DatasetIngestor: Generating origdatablock command: %s'
+                % cmd)
+        return self.__generator.run(cmd, capture=True)
+
+    def _metadata_digest(self, dct, skip=None):
+        """ provides canonical digest of metadata without skipped fields
+
+        :param dct: metadata dictionary
+        :type dct: :obj:`dct` <:obj:`str`, `any`>
+        :param skip: a list of keywords to skip
+        :type skip: :obj:`list` <:obj:`str`>
+        :returns: metadata digest
+        :rtype: :obj:`str`
+        """
+        dct = dict(dct)
+        for node in skip or []:
+            keys = node.split(".")
+            parent = dct
+            # dictionaries on the node path are copied before the removal
+            for key in keys[:-1]:
+                if not isinstance(parent.get(key), dict):
+                    parent = None
+                    break
+                parent[key] = dict(parent[key])
+                parent = parent[key]
+            if parent is not None:
+                parent.pop(keys[-1], None)
+        return hashlib.sha256(json.dumps(
+            dct, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+    def _metadata_equal(self, dct, dct2, skip=None):
+        """ compare two dictionaries by their digests and if they differ
+            recursively
+
+        :param dct: first metadata dictionary
+        :type dct: :obj:`dct` <:obj:`str`, `any`>
+        :param dct2: second metadata dictionary
+        :type dct2: :obj:`dct` <:obj:`str`, `any`>
+        :param skip: a list of keywords to skip
+        :type skip: :obj:`list` <:obj:`str`>
+        """
+        if self.__metadata_digests:
+            try:
+                if self._metadata_digest(dct, skip) == \
+                   self._metadata_digest(dct2, skip):
+                    return True
+            except Exception as e:
+                get_logger().debug('DatasetIngestor: %s' % str(e))
+        return self._metadataEqual(dct, dct2, skip)
+
+    def _dataset_digest(self, dct):
+        """ provides digest of dataset metadata compared on ingestion,
+            i.e. without fields without checks and with scientificMetadata
+
+        :param dct: dataset metadata
+        :type dct: :obj:`dct` <:obj:`str`, `any`>
+        :returns: metadata digest
+        :rtype: :obj:`str`
+        """
+        skip = [node for node in self.__withoutsm
+                if node != "scientificMetadata" and
+                not node.startswith("scientificMetadata.")]
+        return self._metadata_digest(dct, skip)
+
+    def _unchanged_digest(self, mdic, dsmeta):
+        """ checks if the remote dataset has the digest of new metadata
+
+        :param mdic: new dataset metadata
+        :type mdic: :obj:`dct` <:obj:`str`, `any`>
+        :param dsmeta: remote dataset metadata
+        :type dsmeta: :obj:`dct` <:obj:`str`, `any`>
+        :returns: unchanged dataset flag
+        :rtype: :obj:`bool`
+        """
+        if not self.__metadata_digests:
+            return False
+        try:
+            digest = self._dataset_digest(mdic)
+            if self._dataset_digest(dsmeta) == digest:
+                self._record_digest(mdic["pid"], digest)
+                return True
+            if self._ingested_digests().get(mdic["pid"]) == digest:
+                get_logger().debug(
+                    'DatasetIngestor: Dataset %s changed since its '
+                    'ingestion' % mdic["pid"])
+        except Exception as e:
+            get_logger().debug('DatasetIngestor: %s' % str(e))
+        return False
+
+    def _ingested_digests(self):
+        """ provides metadata digests of ingested datasets
+
+        :returns: dataset digests
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`str`>
+        """
+        with self.__digest_lock:
+            if self.__sc_digests is None:
+                self.__sc_digests = {}
+                if os.path.isfile(self.__digestfile):
+                    with open(self.__digestfile, "r") as fl:
+                        for line in fl.read().split("\n"):
+                            sline = line.strip().split(" ")
+                            if len(sline) == 2:
+                                self.__sc_digests[sline[0]] = sline[1]
+            return self.__sc_digests
+
+    def _record_digest(self, pid, digest):
+        """ stores metadata digest of the ingested dataset
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param digest: ingested dataset metadata digest
+        :type digest: :obj:`str`
+        """
+        digests = self._ingested_digests()
+        # upload workers of the pipeline record digests concurrently
+        with self.__digest_lock:
+            if digests.get(pid) != digest:
+                digests[pid] = digest
+                with open(self.__digestfile, 'a+') as fl:
+                    fl.write("%s %s\n" % (pid, digest))
+
     def _metadataEqual(self, dct, dct2, skip=None, parent=None):
         """ compare two dictionaries if metdatdata is equal
 
@@ -1124,13 +1512,7 @@ class DatasetIngestor:
         :rtype: :obj:`str`
         """
         try:
-            response = requests.post(
-                self.__tokenurl, headers=self.__headers,
-                json={"username": self.__username, "password": self.__incd})
-            if response.ok:
-                return json.loads(response.content)["id"]
-            else:
-                raise Exception("%s" % response.text)
+            return self.__tokenprovider.get_token()
         except Exception as e:
             get_logger().error(
                 'DatasetIngestor: %s' % (str(e)))
@@ -1149,17 +1531,16 @@ class DatasetIngestor:
         token = self.get_token()
         bid = self.__meta["beamtimeId"]
         try:
-            self.__headers["Authorization"] = "Bearer {}".format(token)
             propid = self.__idpattern.format(
                 beamtimeId=self.__bid.replace("/", "%2F"),
                 proposalId=self.__dpid.replace("/", "%2F"))
-            resexists = requests.get(
+            resexists = self.__client.get(
                 "{url}/{pid}"
                 .format(
                     url=self.__proposalurl,
                     pid=propid),
                 headers=self.__headers,
-                params={"access_token": token}
+                token=token
             )
 
             if resexists.ok:
@@ -1213,6 +1594,15 @@ class DatasetIngestor:
         pexist = True
         npid = mdic["pid"]
         ipid = mdct["pid"]
+        if self.__pid_version_query:
+            base, ver = self._split_pid_version(npid)
+            if self.__pid_versions.get(base, 1) > ver:
+                # start probing after the last posted version
+                npid = "%s/%s" % (base, self.__pid_versions[base])
+            qpid = self._query_pid_version(npid, token)
+            if qpid:
+                npid = ipid = qpid
+                pexist = False
         while pexist:
             npre = ""
             if npid.startswith(self.__pidprefix):
@@ -1230,14 +1620,13 @@ class DatasetIngestor:
             npid = npre + "/".join(spid)
             if len(spid) > 0:
                 ipid = npre + "/".join(spid)
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            resexists = requests.get(
+            resexists = self.__client.get(
                 "{url}/{pid}"
                 .format(
                     url=self.__dataseturl,
                     pid=(npre + npid.replace("/", "%2F"))),
                 headers=self.__headers,
-                params={"access_token": token})
+                token=token)
             if resexists.ok:
                 pexist = bool(resexists.content)
             else:
@@ -1250,18 +1639,125 @@ class DatasetIngestor:
             'Post the dataset with a new pid: %s' % (npid))
 
         # post the dataset with the new pid
-        self.__headers["Authorization"] = "Bearer {}".format(token)
-        response = requests.post(
+        response = self.__client.post(
             self.__dataseturl,
-            params={"access_token": token},
+            token=token,
             headers=self.__headers,
-            data=nmeta)
+            data=nmeta,
+            # the pid is set by the ingestor so a repeated post conflicts
+            idempotent=True)
         if response.ok:
+            base, ver = self._split_pid_version(mdic["pid"])
+            self.__pid_versions[base] = max(
+                ver, self.__pid_versions.get(base, 1))
+            if self.__statecache is not None:
+                self.__statecache.set_dataset(
+                    mdic["pid"], json.loads(nmeta), created=True)
             return mdic["pid"]
         else:
             raise Exception("%s" % response.text)
 
-    def _patch_dataset(self, nmeta, pid, token, mdct):
+    def _split_pid_version(self, pid):
+        """ splits dataset pid into its base pid and version
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :returns: base pid and version
+        :rtype: (:obj:`str`, :obj:`int`)
+        """
+        npre = ""
+        if pid.startswith(self.__pidprefix):
+            npre = self.__pidprefix
+        spid = pid[len(npre):].split("/")
+        if len(spid) > 2:
+            try:
+                return npre + "/".join(spid[:-1]), int(spid[-1])
+            except Exception:
+                pass
+        return pid, 1
+
+    def _query_pid_version(self, pid, token):
+        """ finds the next free version of dataset pid with one list query
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :returns: new dataset pid or None if the query is not supported
+        :rtype: :obj:`str`
+        """
+        base, ver = self._split_pid_version(pid)
+        pattern = "^%s/[0-9]+$" % re.escape(base)
+        try:
+            flt = {"where": {"pid": {"like": pattern}},
+                   "fields": {"pid": True}}
+            response = self.__client.get(
+                self.__dataseturl,
+                headers=self.__headers,
+                token=token,
+                params={"filter": json.dumps(flt)})
+            if not response.ok:
+                raise Exception("%s" % response.text)
+            dss = json.loads(response.content)
+            if not isinstance(dss, list):
+                raise Exception("Wrong list of datasets: %s" % dss)
+            # the server may ignore or interpret the filter differently
+            pids = [ds["pid"] for ds in dss
+                    if isinstance(ds, dict) and isinstance(ds.get("pid"), str)
+                    and re.match(pattern, ds["pid"])]
+            for dpid in pids:
+                _, dver = self._split_pid_version(dpid)
+                ver = max(ver, dver)
+            npid = "%s/%s" % (base, ver + 1)
+            if not pids or len(pids) != len(dss):
+                response = self.__client.get(
+                    "{url}/{pid}".format(
+                        url=self.__dataseturl,
+                        pid=npid.replace("/", "%2F")),
+                    headers=self.__headers,
+                    token=token)
+                if not response.ok:
+                    raise Exception("%s" % response.text)
+                if response.content:
+                    raise Exception("Dataset %s exists" % npid)
+        except Exception as e:
+            get_logger().debug(
+                'DatasetIngestor: Versions of %s not queried: %s' % (
+                    base, str(e)))
+            return None
+        return npid
+
+    def _patch_fields(self, dsmeta, mdic):
+        """ provides dataset fields to patch
+
+        :param dsmeta: remote dataset metadata
+        :type dsmeta: :obj:`dct` <:obj:`str`, `any`>
+        :param mdic: new dataset metadata
+        :type mdic: :obj:`dct` <:obj:`str`, `any`>
+        :returns: changed fields or all fields
+        :rtype: :obj:`dct` <:obj:`str`, `any`>
+        """
+        if not self.__patch_minimal_diff:
+            return mdic
+        fields = {}
+        for key, value in mdic.items():
+            if key == "pid" or (key in dsmeta and dsmeta[key] == value):
+                continue
+            if key == "scientificMetadata" and \
+               self.__patch_metadata_merge and \
+               isinstance(value, dict) and \
+               isinstance(dsmeta.get(key), dict):
+                # merge patch of changed scientificMetadata subtrees
+                old = dsmeta[key]
+                value = dict(
+                    (ky, vl) for ky, vl in value.items()
+                    if ky not in old or old[ky] != vl)
+                value.update(
+                    (ky, None) for ky in old.keys() if ky not in mdic[key])
+            fields[key] = value
+        return fields or mdic
+
+    def _patch_dataset(self, nmeta, pid, token, mdct, fields=None):
         """ post dataset
 
         :param nmeta: metadata in json string
@@ -1272,6 +1768,9 @@ class DatasetIngestor:
         :type token: :obj:`str`
         :param mdct: metadata in dct
         :type mdct: :obj:`dct` <:obj:`str`, `any`>
+        :param fields: dataset fields after the patch,
+                       parsed from nmeta if None
+        :type fields: :obj:`dct` <:obj:`str`, `any`>
         :returns: dataset pid
         :rtype: :obj:`str`
         """
@@ -1279,179 +1778,630 @@ class DatasetIngestor:
             'DatasetIngestor: '
             'Patch scientificMetadata of dataset:'
             ' %s' % (pid))
-        self.__headers["Authorization"] = "Bearer {}".format(token)
-        response = requests.patch(
+        response = self.__client.patch(
             "{url}/{pid}"
             .format(
                 url=self.__dataseturl,
                 pid=pid.replace("/", "%2F")),
-            params={"access_token": token},
+            token=token,
             headers=self.__headers,
             data=nmeta)
         if response.ok:
+            if self.__statecache is not None:
+                self.__statecache.update_dataset(
+                    pid, fields if fields is not None else json.loads(nmeta))
+            if self.__metadata_digests and fields is not None:
+                self._record_digest(pid, self._dataset_digest(fields))
             return mdct["pid"]
         else:
+            if self.__statecache is not None:
+                self.__statecache.invalidate(pid)
             raise Exception("%s" % response.text)
 
-    def _ingest_dataset(self, metadata, token, mdct):
-        """ ingests dataset
+    def _create_dataset(self, metadata, pid, token, mdct, optimistic=False):
+        """ posts the new dataset
 
         :param metadata: metadata in json string
         :type metadata: :obj:`str`
+        :param pid: dataset pid with the prefix
+        :type pid: :obj:`str`
         :param token: ingestor token
         :type token: :obj:`str`
         :param mdct: metadata in dct
         :type mdct: :obj:`dct` <:obj:`str`, `any`>
-        :returns: dataset pid
-        :rtype: :obj:`str`
+        :param optimistic: the dataset was not checked if it exists
+        :type optimistic: :obj:`bool`
+        :returns: created flag, False if the optimistic post conflicts
+        :rtype: :obj:`bool`
         """
-        try:
-            pid = "%s%s" % (self.__pidprefix, mdct["pid"])
-            # check if dataset with the pid exists
-            get_logger().info(
-                'DatasetIngestor: Check if dataset exists: %s' % (pid))
-            checking = True
-            counter = 0
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            while checking:
-                resexists = requests.get(
-                    "{url}/{pid}".format(
-                        url=self.__dataseturl,
-                        pid=pid.replace("/", "%2F")),
-                    headers=self.__headers,
-                    params={"access_token": token}
-                )
-                if hasattr(resexists, "content"):
-                    try:
-                        json.loads(resexists.content)
-                        checking = False
-                    except Exception:
-                        time.sleep(0.1)
-                        if resexists.ok and hasattr(resexists, "content") and \
-                           not bool(resexists.content):
-                            checking = False
-                        else:
-                            time.sleep(0.1)
-                if counter == self.__maxcounter:
-                    checking = False
-                counter += 1
-            if resexists.ok and hasattr(resexists, "content"):
-                try:
-                    exists = bool(resexists.content)
-                except Exception:
-                    exists = False
-                if not exists:
-                    # post the new dataset since it does not exist
-                    get_logger().info(
-                        'DatasetIngestor: Post the dataset: %s' % (pid))
-                    self.__headers["Authorization"] = "Bearer {}".format(token)
-                    response = requests.post(
-                        self.__dataseturl,
-                        headers=self.__headers,
-                        params={"access_token": token},
-                        data=metadata)
-                    if response.ok:
-                        return mdct["pid"]
-                    else:
-                        raise Exception("%s" % response.text)
-                elif self.__strategy != UpdateStrategy.NO:
-                    # find dataset by pid
-                    get_logger().info(
-                        'DatasetIngestor: Find the dataset by id: %s' % (pid))
-                    resds = requests.get(
-                        "{url}/{pid}".format(
-                            url=self.__dataseturl,
-                            pid=pid.replace("/", "%2F")),
-                        headers=self.__headers,
-                        params={"access_token": token}
-                    )
-                    if resds.ok:
-                        dsmeta = json.loads(resds.content)
-                        mdic = dict(mdct)
-                        mdic["pid"] = pid
-                        if self.__forcemeasurementkeyword and \
-                           self.__dctfmt["measurement"] and \
-                           "keywords" in mdic and \
-                           isinstance(mdic["keywords"], list) and \
-                           self.__dctfmt["measurement"] \
-                           not in mdic["keywords"]:
-                            mdic["keywords"].append(
-                                self.__dctfmt["measurement"])
-                        if not self._metadataEqual(
-                                dsmeta, mdic, skip=self.__withoutsm):
-                            if self.__strategy in [
-                                    UpdateStrategy.PATCH, UpdateStrategy.NO]:
-                                nmeta = json.dumps(mdic)
-                                # mm = dict(mdic)
-                                # mm["scientificMetadata"] = {}
-                                # get_logger().info(
-                                #     'DatasetIngestor: PATCH: %s' % str(mm))
-                                return self._patch_dataset(
-                                    nmeta, pid, token, mdct)
-                            else:
-                                return self._post_dataset(mdic, token, mdct)
-                        else:
-                            if "scientificMetadata" in dsmeta.keys() and \
-                               "scientificMetadata" in mdic.keys():
-                                smmeta = dsmeta["scientificMetadata"]
-                                smnmeta = mdic["scientificMetadata"]
-                                nmeta = json.dumps(mdic)
-                                if not self._metadataEqual(smmeta, smnmeta):
-                                    if self.__strategy == \
-                                       UpdateStrategy.CREATE:
-                                        return self._post_dataset(
-                                            mdic, token, mdct)
-                                    else:
-                                        return self._patch_dataset(
-                                            nmeta, pid, token, mdct)
-                    else:
-                        raise Exception("%s" % resds.text)
-                else:
-                    return pid
-            else:
-                raise Exception("%s" % resexists.text)
-        except Exception as e:
-            get_logger().error(
-                'DatasetIngestor: %s' % (str(e)))
-        return None
+        get_logger().info(
+            'DatasetIngestor: Post the dataset: %s' % (pid))
+        if optimistic:
+            self.__optimistic_metrics["posts"] += 1
+        response = self.__client.post(
+            self.__dataseturl,
+            headers=self.__headers,
+            token=token,
+            data=metadata,
+            # the pid is set by the ingestor so a repeated post conflicts
+            idempotent=True)
+        if response.ok:
+            if self.__statecache is not None:
+                dsmeta = json.loads(metadata)
+                dsmeta["pid"] = pid
+                self.__statecache.set_dataset(
+                    pid, dsmeta, created=True)
+            if self.__metadata_digests:
+                mdic = dict(mdct)
+                mdic["pid"] = pid
+                self._record_digest(
+                    pid, self._dataset_digest(mdic))
+            if optimistic:
+                self.__optimistic_metrics["created"] += 1
+            return True
+        if self.__statecache is not None:
+            self.__statecache.invalidate(pid)
+        if optimistic and self._conflict(response):
+            self.__optimistic_metrics["conflicts"] += 1
+            get_logger().debug(
+                'DatasetIngestor: Dataset already exists: %s' % (pid))
+            return False
+        raise Exception("%s" % response.text)
 
-    def _ingest_origdatablock(self, metadata, token):
-        """ ingets origdatablock
+    def _conflict(self, response):
+        """ checks if the post response reports an existing dataset
 
-        :param metadata: metadata in json string
-        :type metadata: :obj:`str`
-        :param token: ingestor token
-        :type token: :obj:`str`
-        :returns: rewquest startus
+        :param response: post response
+        :type response: :class:`requests.Response`
+        :returns: conflict flag
         :rtype: :obj:`bool`
         """
-        try:
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            response = requests.post(
-                self.__datablockurl,
-                headers=self.__headers,
-                params={"access_token": token},
-                data=metadata)
-            if response.ok:
-                return True
-            else:
-                raise Exception("%s" % response.text)
-        except Exception as e:
-            get_logger().error(
-                'DatasetIngestor: %s' % (str(e)))
+        if response.status_code == 409:
+            return True
+        if response.status_code in [400, 422, 500]:
+            text = (response.text or "").lower()
+            return "e11000" in text or "duplicate key" in text or \
+                "already exists" in text
         return False
 
-    def _ingest_attachment(self, metadata, datasetid, token):
-        """ ingets origdatablock
+    def generator_metrics(self):
+        """ provides numbers of generator commands run in the process
+            and in the shell
 
-        :param metadata: metadata in json string
-        :type metadata: :obj:`str`
-        :param datasetid: dataset id
-        :type datasetid: :obj:`str`
+        :returns: numbers of in-process and shell commands
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`int`>
+        """
+        return self.__generator.metrics()
+
+    def optimistic_metrics(self):
+        """ provides counters of optimistic dataset posts
+
+        :returns: numbers of posts, created datasets and conflicts
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`int`>
+        """
+        return dict(self.__optimistic_metrics)
+
+    def log_metrics(self):
+        """ logs counters of optimistic dataset posts
+            and of generator commands
+        """
+        metrics = self.optimistic_metrics()
+        if metrics["posts"]:
+            get_logger().debug(
+                'DatasetIngestor: Optimistic dataset posts: %s, '
+                'created: %s, conflicts: %s' % (
+                    metrics["posts"], metrics["created"],
+                    metrics["conflicts"]))
+        metrics = self.generator_metrics()
+        if metrics["inprocess"] or metrics["shell"]:
+            get_logger().debug(
+                'DatasetIngestor: Generator commands in process: %s, '
+                'in shell: %s' % (metrics["inprocess"], metrics["shell"]))
+
+    def _check_dataset(self, pid, token):
+        """ checks if dataset with the pid exists
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
         :param token: ingestor token
         :type token: :obj:`str`
-        :returns: rewquest startus
-        :rtype: :obj:`bool`
+        :returns: exists flag and the cached dataset document if known
+        :rtype: (:obj:`bool`, :obj:`dict` <:obj:`str`, `any`>)
+        """
+        if pid in self.__batch_datasets:
+            dsmeta = self.__batch_datasets.pop(pid)
+            get_logger().debug(
+                'DatasetIngestor: Looked up dataset state: %s' % (pid))
+            return dsmeta is not None, dsmeta
+        if self.__statecache is not None:
+            dsmeta = self._get_cached_dataset(pid, token)
+            return dsmeta is not None, dsmeta
+        retrypolicy = self.__client.retry_policy()
+        start = time.time()
+        counter = 0
+        while True:
+            resexists = self.__client.get(
+                "{url}/{pid}".format(
+                    url=self.__dataseturl,
+                    pid=pid.replace("/", "%2F")),
+                headers=self.__headers,
+                token=token
+            )
+            if not resexists.ok:
+                # transient server errors are retried by the client
+                break
+            try:
+                json.loads(resexists.content)
+                break
+            except Exception:
+                # an empty response means that the dataset does not exist
+                if not bool(resexists.content):
+                    break
+            counter += 1
+            if not retrypolicy.wait(counter, start, self.__maxcounter):
+                break
+        if not resexists.ok:
+            raise Exception("%s" % resexists.text)
+        return bool(resexists.content), None
+
+    def _get_cached_dataset(self, pid, token):
+        """ provides dataset document from the remote state cache
+            or from the server
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :returns: dataset document or None if it does not exist
+        :rtype: :obj:`dict` <:obj:`str`, `any`>
+        """
+        prefix = "%s%s/" % (self.__pidprefix, self.__bid)
+        if pid.startswith(prefix) and \
+           not self.__statecache.prefetched(prefix):
+            self._prefetch_datasets(prefix, token)
+        if self.__statecache.exists(pid) is False:
+            get_logger().debug(
+                'DatasetIngestor: Cached dataset state: %s' % (pid))
+            return None
+        dsmeta = self.__statecache.current(pid)
+        if dsmeta is not None:
+            # the listed modification time equals the cached one
+            get_logger().debug(
+                'DatasetIngestor: Cached dataset state: %s' % (pid))
+            return dsmeta
+        # other cached documents are revalidated with a conditional request
+        headers = self.__headers
+        etag, dsmeta = self.__statecache.etag(pid)
+        if etag:
+            headers = dict(self.__headers)
+            headers["If-None-Match"] = etag
+        response = self.__client.get(
+            "{url}/{pid}".format(
+                url=self.__dataseturl,
+                pid=pid.replace("/", "%2F")),
+            headers=headers,
+            token=token)
+        if etag and response.status_code == 304:
+            self.__statecache.validate(pid)
+            return dsmeta
+        if not response.ok:
+            raise Exception("%s" % response.text)
+        dsmeta = json.loads(response.content) if response.content else None
+        self.__statecache.set_dataset(
+            pid, dsmeta, response.headers.get("ETag"))
+        return dsmeta
+
+    def _prefetch_datasets(self, prefix, token):
+        """ fetches pids and modification times of all datasets with
+            the pid prefix into the remote state cache with paged list queries
+
+        :param prefix: dataset pid prefix
+        :type prefix: :obj:`str`
+        :param token: ingestor token
+        :type token: :obj:`str`
+        """
+        datasets = []
+        size = self.__statecache.page_size()
+        try:
+            while True:
+                flt = {"where": {"pid": {"like": "^%s" % re.escape(prefix)}},
+                       "fields": ["pid", "updatedAt"],
+                       "limit": size, "skip": len(datasets)}
+                response = self.__client.get(
+                    self.__dataseturl,
+                    headers=self.__headers,
+                    token=token,
+                    params={"filter": json.dumps(flt)})
+                if not response.ok:
+                    raise Exception("%s" % response.text)
+                page = json.loads(response.content)
+                if not isinstance(page, list):
+                    raise Exception("Wrong list of datasets: %s" % page)
+                datasets.extend(page)
+                if len(page) < size:
+                    break
+            get_logger().debug(
+                'DatasetIngestor: Prefetched %s datasets: %s' % (
+                    len(datasets), prefix))
+        except Exception as e:
+            datasets = None
+            get_logger().debug(
+                'DatasetIngestor: Datasets %s not prefetched: %s' % (
+                    prefix, str(e)))
+        self.__statecache.set_prefetched(prefix, datasets)
+
+    def _ingest_dataset(self, metadata, token, mdct, optimistic=False,
+                        inplace=False):
+        """ ingests dataset
+
+        :param metadata: metadata in json string
+        :type metadata: :obj:`str`
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :param mdct: metadata in dct
+        :type mdct: :obj:`dct` <:obj:`str`, `any`>
+        :param optimistic: post the dataset before checking if it exists,
+                           i.e. on the first ingestion of the scan
+        :type optimistic: :obj:`bool`
+        :param inplace: patch the existing dataset instead of posting
+                        its new version, e.g. for progressive ingestion
+        :type inplace: :obj:`bool`
+        :returns: dataset pid
+        :rtype: :obj:`str`
+        """
+        try:
+            pid = "%s%s" % (self.__pidprefix, mdct["pid"])
+            mdic = dict(mdct)
+            mdic["pid"] = pid
+            if self.__forcemeasurementkeyword and \
+               self.__dctfmt["measurement"] and \
+               "keywords" in mdic and \
+               isinstance(mdic["keywords"], list) and \
+               self.__dctfmt["measurement"] \
+               not in mdic["keywords"]:
+                mdic["keywords"].append(
+                    self.__dctfmt["measurement"])
+            if optimistic and \
+               self.__strategy in self.__optimistic_strategies and \
+               (self.__statecache is None or
+                    self.__statecache.exists(pid) is None):
+                # post the dataset and check if it exists only on conflict
+                if self._create_dataset(
+                        metadata, pid, token, mdct, optimistic=True):
+                    return mdct["pid"]
+            # check if dataset with the pid exists
+            get_logger().info(
+                'DatasetIngestor: Check if dataset exists: %s' % (pid))
+            exists, dsmeta = self._check_dataset(pid, token)
+            if not exists:
+                # post the new dataset since it does not exist
+                self._create_dataset(metadata, pid, token, mdct)
+                return mdct["pid"]
+            elif self.__strategy != UpdateStrategy.NO:
+                # find dataset by pid
+                get_logger().info(
+                    'DatasetIngestor: Find the dataset by id: %s' % (pid))
+                if dsmeta is None:
+                    resds = self.__client.get(
+                        "{url}/{pid}".format(
+                            url=self.__dataseturl,
+                            pid=pid.replace("/", "%2F")),
+                        headers=self.__headers,
+                        token=token
+                    )
+                    if not resds.ok:
+                        raise Exception("%s" % resds.text)
+                    dsmeta = json.loads(resds.content)
+                if self._unchanged_digest(mdic, dsmeta):
+                    return None
+                if not self._metadata_equal(
+                        dsmeta, mdic, skip=self.__withoutsm):
+                    if inplace or self.__strategy in [
+                            UpdateStrategy.PATCH, UpdateStrategy.NO]:
+                        nmeta = json.dumps(self._patch_fields(dsmeta, mdic))
+                        # mm = dict(mdic)
+                        # mm["scientificMetadata"] = {}
+                        # get_logger().info(
+                        #     'DatasetIngestor: PATCH: %s' % str(mm))
+                        return self._patch_dataset(
+                            nmeta, pid, token, mdct, mdic)
+                    else:
+                        return self._post_dataset(mdic, token, mdct)
+                else:
+                    if "scientificMetadata" in dsmeta.keys() and \
+                       "scientificMetadata" in mdic.keys():
+                        smmeta = dsmeta["scientificMetadata"]
+                        smnmeta = mdic["scientificMetadata"]
+                        if not self._metadata_equal(smmeta, smnmeta):
+                            if not inplace and self.__strategy == \
+                               UpdateStrategy.CREATE:
+                                return self._post_dataset(
+                                    mdic, token, mdct)
+                            else:
+                                nmeta = json.dumps(
+                                    self._patch_fields(dsmeta, mdic))
+                                return self._patch_dataset(
+                                    nmeta, pid, token, mdct, mdic)
+            else:
+                return pid
+        except Exception as e:
+            get_logger().error(
+                'DatasetIngestor: %s' % (str(e)))
+        return None
+
+    def _cache_item(self, datasetid, kind, response, metadata=None,
+                    digest=None):
+        """ adds id of the created dataset item to the remote state cache
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :param response: post response
+        :type response: :class:`requests.Response`
+        :param metadata: attachment metadata in json string
+        :type metadata: :obj:`str`
+        :param digest: attachment thumbnail digest
+        :type digest: :obj:`str`
+        """
+        if self.__statecache is not None and datasetid:
+            try:
+                iid = json.loads(response.content)["id"]
+                if digest is None and metadata is not None:
+                    digest = self._thumbnail_digest(json.loads(metadata))
+            except Exception:
+                iid = None
+            self.__statecache.add_item(datasetid, kind, iid, digest)
+
+    def _thumbnail_digest(self, attachment):
+        """ provides digest of the attachment thumbnail
+
+        :param attachment: attachment metadata
+        :type attachment: :obj:`dict` <:obj:`str`, `any`>
+        :returns: thumbnail digest or empty string if there is no thumbnail
+        :rtype: :obj:`str`
+        """
+        if "thumbnail" not in attachment:
+            return ""
+        return hashlib.sha256(
+            str(attachment["thumbnail"]).encode()).hexdigest()
+
+    def _get_attachment_digests(self, datasetid, token):
+        """ provides ids and thumbnail digests of dataset attachments
+            from the remote state cache or from the server
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :returns: list of attachment ids and thumbnail digests
+        :rtype: :obj:`list` < (:obj:`str`, :obj:`str`) >
+        """
+        if self.__statecache is not None:
+            digests = self.__statecache.digests(datasetid, "attachments")
+            if digests is not None and None not in digests.values():
+                get_logger().debug(
+                    'DatasetIngestor: Cached attachment digests: %s'
+                    % (datasetid))
+                return list(digests.items())
+        return [(ads.get("id"), self._thumbnail_digest(ads))
+                for ads in self._get_attachments(datasetid, token) or []]
+
+    def _uncache_items(self, datasetid, kind, ids, statuses):
+        """ removes ids of the deleted dataset items from the remote
+            state cache
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :param ids: item ids
+        :type ids: :obj:`list` <:obj:`str`>
+        :param statuses: deletion statuses
+        :type statuses: :obj:`list` <:obj:`bool`>
+        """
+        if self.__statecache is not None:
+            if all(statuses):
+                self.__statecache.remove_items(datasetid, kind, ids)
+            else:
+                self.__statecache.set_items(datasetid, kind, None)
+
+    def _ingest_origdatablock(self, metadata, token, datasetid=None):
+        """ ingets origdatablock
+
+        :param metadata: metadata in json string or json file object
+        :type metadata: :obj:`str` or :obj:`file`
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :returns: rewquest startus
+        :rtype: :obj:`bool`
+        """
+        try:
+            response = self.__client.post(
+                self.__datablockurl,
+                headers=self.__headers,
+                token=token,
+                data=metadata)
+            if response.ok:
+                self._cache_item(datasetid, "origdatablocks", response)
+                return True
+            else:
+                raise Exception("%s" % response.text)
+        except Exception as e:
+            get_logger().error(
+                'DatasetIngestor: %s' % (str(e)))
+        return False
+
+    def _chunked(self):
+        """ checks if origdatablocks are split into size-bounded blocks
+
+        :returns: chunking flag
+        :rtype: :obj:`bool`
+        """
+        return bool(self.__chunk_files or self.__chunk_size)
+
+    def _chunks(self, mt):
+        """ splits the origdatablock into blocks bounded by the number
+            of files and the size of the file list
+
+        :param mt: origdatablock metadata
+        :type mt: :obj:`dict` <:obj:`str`, `any`>
+        :returns: origdatablocks with parts of the file list
+        :rtype: :obj:`list` <:obj:`dict` <:obj:`str`, `any`>>
+        """
+        chunks = []
+        chunk = []
+        size = 0
+        for entry in mt.get("dataFileList") or []:
+            esize = len(json.dumps(entry)) + 2 if self.__chunk_size else 0
+            if chunk and (
+                    (self.__chunk_files and
+                     len(chunk) >= self.__chunk_files) or
+                    (self.__chunk_size and
+                     size + esize > self.__chunk_size)):
+                chunks.append(chunk)
+                chunk = []
+                size = 0
+            chunk.append(entry)
+            size += esize
+        if chunk:
+            chunks.append(chunk)
+        if len(chunks) < 2:
+            return [mt]
+        sizes = [sum(entry["size"] for entry in chunk
+                     if isinstance(entry, dict) and
+                     isinstance(entry.get("size"), (int, float)))
+                 for chunk in chunks]
+        # the size of files without numeric sizes is counted once
+        rest = max(0, mt["size"] - sum(sizes)) \
+            if isinstance(mt.get("size"), (int, float)) else 0
+        blocks = []
+        for ich, chunk in enumerate(chunks):
+            block = dict(mt)
+            block["dataFileList"] = chunk
+            if "size" in mt:
+                block["size"] = sizes[ich] + (rest if not ich else 0)
+            blocks.append(block)
+        return blocks
+
+    def _ingest_origdatablock_chunks(self, blocks, token, datasetid):
+        """ posts origdatablock chunks concurrently and skips chunks
+            posted by the previous tries
+
+        :param blocks: origdatablock chunks
+        :type blocks: :obj:`list` <:obj:`dict` <:obj:`str`, `any`>>
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :returns: request status of all chunks
+        :rtype: :obj:`bool`
+        """
+        digests = [hashlib.sha256(json.dumps(
+            block["dataFileList"], sort_keys=True).encode()).hexdigest()
+            for block in blocks]
+        posted = self._posted_chunks(datasetid)
+        todo = [(block, digest) for block, digest in zip(blocks, digests)
+                if digest not in posted]
+        if len(todo) < len(blocks):
+            get_logger().info(
+                'DatasetIngestor: Skip %s posted origdatablock chunks: %s'
+                % (len(blocks) - len(todo), datasetid))
+
+        def ingest_chunk(item):
+            block, digest = item
+            status = self._ingest_origdatablock(
+                json.dumps(block), token, datasetid)
+            if status:
+                self._record_chunk(datasetid, digest)
+            return status
+
+        statuses = self._map_requests(ingest_chunk, todo)
+        if not all(statuses):
+            get_logger().error(
+                'DatasetIngestor: %s of %s origdatablock chunks failed: %s'
+                % (statuses.count(False), len(blocks), datasetid))
+            return False
+        self._forget_chunks(datasetid, digests)
+        return True
+
+    def _posted_chunks(self, datasetid):
+        """ provides digests of posted origdatablock chunks
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :returns: chunk digests
+        :rtype: :obj:`set` <:obj:`str`>
+        """
+        with self.__chunk_lock:
+            if self.__sc_chunks is None:
+                self.__sc_chunks = {}
+                if os.path.isfile(self.__chunkfile):
+                    with open(self.__chunkfile, "r") as fl:
+                        for line in fl.read().split("\n"):
+                            sline = line.strip().split(" ")
+                            if len(sline) == 2:
+                                self.__sc_chunks.setdefault(
+                                    sline[0], set()).add(sline[1])
+            return set(self.__sc_chunks.get(datasetid, set()))
+
+    def _record_chunk(self, datasetid, digest):
+        """ stores digest of the posted origdatablock chunk
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param digest: chunk digest
+        :type digest: :obj:`str`
+        """
+        self._posted_chunks(datasetid)
+        with self.__chunk_lock:
+            self.__sc_chunks.setdefault(datasetid, set()).add(digest)
+            with open(self.__chunkfile, 'a+') as fl:
+                fl.write("%s %s\n" % (datasetid, digest))
+
+    def _forget_chunks(self, datasetid, digests=None):
+        """ removes digests of origdatablock chunks which were all posted
+            or deleted
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param digests: chunk digests or None for all dataset chunks
+        :type digests: :obj:`list` <:obj:`str`>
+        """
+        if not self._posted_chunks(datasetid):
+            return
+        with self.__chunk_lock:
+            if digests is None:
+                self.__sc_chunks.pop(datasetid, None)
+            else:
+                self.__sc_chunks[datasetid].difference_update(digests)
+                if not self.__sc_chunks[datasetid]:
+                    self.__sc_chunks.pop(datasetid)
+            if self.__sc_chunks:
+                tmpfile = "%s%s" % (self.__chunkfile, ".tmp")
+                with open(tmpfile, "w") as fl:
+                    for dsid, dgs in self.__sc_chunks.items():
+                        for digest in sorted(dgs):
+                            fl.write("%s %s\n" % (dsid, digest))
+                os.replace(tmpfile, self.__chunkfile)
+            elif os.path.exists(self.__chunkfile):
+                os.remove(self.__chunkfile)
+
+    def _ingest_attachment(self, metadata, datasetid, token, digest=None):
+        """ ingets origdatablock
+
+        :param metadata: metadata in json string or json file object
+        :type metadata: :obj:`str` or :obj:`file`
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :param digest: thumbnail digest of the attachment file object
+        :type digest: :obj:`str`
+        :returns: rewquest startus
+        :rtype: :obj:`bool`
         """
         try:
             dsid = datasetid.replace("/", "%2F")
@@ -1459,13 +2409,18 @@ class DatasetIngestor:
             # get_logger().debug(
             #     'DatasetIngestor: ingest attachment %s' % (
             #         url.format(pid=dsid, token=token)))
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            response = requests.post(
+            response = self.__client.post(
                 url.format(pid=dsid),
                 headers=self.__headers,
-                params={"access_token": token},
+                token=token,
                 data=metadata)
             if response.ok:
+                if digest is not None:
+                    self._cache_item(
+                        datasetid, "attachments", response, digest=digest)
+                else:
+                    self._cache_item(
+                        datasetid, "attachments", response, metadata)
                 return True
             else:
                 raise Exception("%s" % response.text)
@@ -1474,25 +2429,34 @@ class DatasetIngestor:
                 'DatasetIngestor: %s' % (str(e)))
         return False
 
-    def _get_origdatablocks(self, datasetid, token):
+    def _get_origdatablocks(self, datasetid, token, cached=False):
         """ get origdatablocks with datasetid
 
         :param datasetid: dataset id
         :type datasetid: :obj:`str`
         :param token: ingestor token
         :type token: :obj:`str`
+        :param cached: provide only ids from the remote state cache if known
+        :type cached: :obj:`bool`
         :returns: list of  origdatablocks
         :rtype: :obj:`str` <:obj:`str`>
         """
         try:
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            response = requests.get(
+            if cached and self.__statecache is not None:
+                ids = self.__statecache.items(datasetid, "origdatablocks")
+                if ids is not None:
+                    return [{"id": iid} for iid in ids]
+            response = self.__client.get(
                 self.__dataseturl + "/%s/%s" %
                 (datasetid.replace("/", "%2F"), self.__scicat_datablocks),
-                params={"access_token": token},
+                token=token,
                 headers=self.__headers)
             if response.ok:
                 js = response.json()
+                if self.__statecache is not None:
+                    self.__statecache.set_items(
+                        datasetid, "origdatablocks",
+                        [odb["id"] for odb in js if "id" in odb])
                 return js
         except Exception as e:
             get_logger().error(
@@ -1508,13 +2472,12 @@ class DatasetIngestor:
         :type token: :obj:`str`
         """
         try:
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            response = requests.delete(
+            response = self.__client.delete(
                 "{url}/{pid}"
                 .format(
                     url=self.__datablockurl,
                     pid=did.replace("/", "%2F")),
-                params={"access_token": token},
+                token=token,
                 headers=self.__headers,
             )
             if response.ok:
@@ -1526,25 +2489,35 @@ class DatasetIngestor:
                 'DatasetIngestor: %s' % (str(e)))
         return None
 
-    def _get_attachments(self, datasetid, token):
+    def _get_attachments(self, datasetid, token, cached=False):
         """ get attachments with datasetid
 
         :param datasetid: dataset id
         :type datasetid: :obj:`str`
         :param token: ingestor token
         :type token: :obj:`str`
+        :param cached: provide only ids from the remote state cache if known
+        :type cached: :obj:`bool`
         :returns: list of  attachments
         :rtype: :obj:`str` <:obj:`str`>
         """
         try:
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            response = requests.get(self.__attachmenturl.format(
+            if cached and self.__statecache is not None:
+                ids = self.__statecache.items(datasetid, "attachments")
+                if ids is not None:
+                    return [{"id": iid} for iid in ids]
+            response = self.__client.get(self.__attachmenturl.format(
                 pid=datasetid.replace("/", "%2F")),
-                params={"access_token": token},
+                token=token,
                 headers=self.__headers
             )
             if response.ok:
                 js = response.json()
+                if self.__statecache is not None:
+                    self.__statecache.set_items(
+                        datasetid, "attachments",
+                        dict((ads["id"], self._thumbnail_digest(ads))
+                             for ads in js if "id" in ads))
                 return js
         except Exception as e:
             get_logger().error(
@@ -1562,12 +2535,11 @@ class DatasetIngestor:
         :type token: :obj:`str`
         """
         try:
-            self.__headers["Authorization"] = "Bearer {}".format(token)
-            response = requests.delete(
+            response = self.__client.delete(
                 self.__attachmenturl.format(
                     pid=datasetid.replace("/", "%2F"))
                 + "/{aid}".format(aid=aid.replace("/", "%2F")),
-                params={"access_token": token},
+                token=token,
                 headers=self.__headers)
             if response.ok:
                 return True
@@ -1598,13 +2570,20 @@ class DatasetIngestor:
 
         return pid
 
-    def _ingest_rawdataset_metadata(self, metafile, token):
+    def _ingest_rawdataset_metadata(self, metafile, token, optimistic=False,
+                                    inplace=False):
         """ ingest raw dataset metadata
 
         :param metafile: metadata file name
         :type metafile: :obj:`str`
         :param token: ingestor token
         :type token: :obj:`str`
+        :param optimistic: post the dataset before checking if it exists,
+                           i.e. on the first ingestion of the scan
+        :type optimistic: :obj:`bool`
+        :param inplace: patch the existing dataset instead of posting
+                        its new version
+        :type inplace: :obj:`bool`
         :returns: dataset id
         :rtype: :obj:`str`
         """
@@ -1623,7 +2602,8 @@ class DatasetIngestor:
                 raise Exception(
                     "Wrong pid %s for DESY beamtimeId %s in  %s"
                     % (mt["pid"], self.__bid, metafile))
-            status = self._ingest_dataset(smt, token, mt)
+            status = self._ingest_dataset(
+                smt, token, mt, optimistic, inplace)
             if status:
                 return status
         except Exception as e:
@@ -1631,6 +2611,101 @@ class DatasetIngestor:
                 'DatasetIngestor: %s' % (str(e)))
         return None
 
+    def _map_requests(self, func, items):
+        """ executes independent dataset sub-requests for all items,
+            concurrently if max_request_workers is greater than 1
+
+        :param func: request function called with an item
+        :type func: :obj:`function`
+        :param items: request items
+        :type items: :obj:`list` <`any`>
+        :returns: request results in the item order
+        :rtype: :obj:`list` <`any`>
+        """
+        items = list(items)
+        workers = min(self.__max_request_workers, len(items))
+        if workers < 2:
+            return [func(item) for item in items]
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as executor:
+            return list(executor.map(func, items))
+
+    def _bulk_delete_items(self, datasetid, kind, ids, token):
+        """ deletes all dataset items with one filtered delete
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :param ids: item ids
+        :type ids: :obj:`list` <:obj:`str`>
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :returns: deletion statuses of item ids or None if it failed
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`bool`>
+        """
+        dsid = datasetid.replace("/", "%2F")
+        if kind == "origdatablocks":
+            url = self.__dataseturl + "/%s/%s" % (
+                dsid, self.__scicat_datablocks)
+        else:
+            url = self.__attachmenturl.format(pid=dsid)
+        try:
+            response = self.__client.delete(
+                url, token=token, headers=self.__headers)
+            if response.ok:
+                get_logger().debug(
+                    'DatasetIngestor: Bulk delete of %s %s: %s' % (
+                        len(ids), kind, datasetid))
+                return dict((iid, True) for iid in ids)
+            if response.status_code in self.bulk_delete_unsupported_codes:
+                self.__bulk_delete = False
+            raise Exception("%s" % response.text)
+        except Exception as e:
+            get_logger().debug(
+                'DatasetIngestor: Bulk delete of %s failed: %s' % (
+                    kind, str(e)))
+        return None
+
+    def _delete_items(self, datasetid, kind, ids, token, bulk=False):
+        """ deletes dataset items with bounded parallel deletes
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :param ids: item ids
+        :type ids: :obj:`list` <:obj:`str`>
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :param bulk: ids are all dataset items so one filtered delete
+                     can be used if the server supports it
+        :type bulk: :obj:`bool`
+        :returns: deletion statuses of item ids
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`bool`>
+        """
+        if not ids:
+            return {}
+        statuses = None
+        if bulk and self.__bulk_delete:
+            statuses = self._bulk_delete_items(datasetid, kind, ids, token)
+        if statuses is None:
+            if kind == "origdatablocks":
+                results = self._map_requests(
+                    lambda iid: self._get_delete_origdatablock(iid, token),
+                    ids)
+            else:
+                results = self._map_requests(
+                    lambda iid: self._get_delete_attachment(
+                        datasetid, iid, token),
+                    ids)
+            statuses = dict(
+                (iid, bool(res)) for iid, res in zip(ids, results))
+        self._uncache_items(datasetid, kind, ids, statuses.values())
+        if kind == "origdatablocks":
+            self._forget_chunks(datasetid)
+        return statuses
+
     def _delete_origdatablocks(self, pid, token):
         """ delete origdatablock with given dataset pid
 
@@ -1638,19 +2713,21 @@ class DatasetIngestor:
         :type pid: :obj:`str`
         :param token: ingestor token
         :type token: :obj:`str`
-        :returns: dataset id
-        :rtype: :obj:`str`
+        :returns: deletion statuses of origdatablock ids
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`bool`>
         """
+        statuses = {}
         try:
             datasetid = "%s%s" % (self.__pidprefix, pid)
-            odbs = self._get_origdatablocks(datasetid, token) or []
-            for odb in odbs:
-                if "id" in odb:
-                    self._get_delete_origdatablock(odb["id"], token)
+            odbs = self._get_origdatablocks(
+                datasetid, token, cached=True) or []
+            ids = [odb["id"] for odb in odbs if "id" in odb]
+            statuses = self._delete_items(
+                datasetid, "origdatablocks", ids, token, bulk=True)
         except Exception as e:
             get_logger().error(
                 'DatasetIngestor: %s' % (str(e)))
-        return ""
+        return statuses
 
     def _delete_attachments(self, pid, token):
         """ delete attachment with given dataset pid
@@ -1659,22 +2736,22 @@ class DatasetIngestor:
         :type pid: :obj:`str`
         :param token: ingestor token
         :type token: :obj:`str`
-        :returns: dataset id
-        :rtype: :obj:`str`
+        :returns: deletion statuses of attachment ids
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`bool`>
         """
+        statuses = {}
         try:
             datasetid = "%s%s" % (self.__pidprefix, pid)
             # get_logger().info("DA %s %s" % (pid, datasetid))
-            odbs = self._get_attachments(datasetid, token) or []
+            odbs = self._get_attachments(datasetid, token, cached=True) or []
             # get_logger().info("DA2 %s %s" % (pid, odbs))
-            for odb in odbs:
-                if "id" in odb:
-                    # get_logger().info("DA3 %s %s" % (odb["id"], odb))
-                    self._get_delete_attachment(datasetid, odb["id"], token)
+            ids = [odb["id"] for odb in odbs if "id" in odb]
+            statuses = self._delete_items(
+                datasetid, "attachments", ids, token, bulk=True)
         except Exception as e:
             get_logger().error(
                 'DatasetIngestor: %s' % (str(e)))
-        return ""
+        return statuses
 
     def _update_attachments(self, tads, pid, token):
         """ delete attachment with given dataset pid
@@ -1690,7 +2767,8 @@ class DatasetIngestor:
         try:
             datasetid = "%s%s" % (self.__pidprefix, pid)
             # get_logger().info("DA %s %s" % (pid, datasetid))
-            odbs = self._get_attachments(datasetid, token) or []
+            # thumbnails are compared by their digests
+            odbs = self._get_attachment_digests(datasetid, token)
             # get_logger().info("DA2 %s %s" % (pid, odbs))
             found = []
             for fads in tads:
@@ -1698,11 +2776,11 @@ class DatasetIngestor:
                     smt = fl.read()
                     ads = json.loads(smt)
                 if "thumbnail" in ads:
-                    for odb in odbs:
-                        if "thumbnail" in odb and \
-                           odb["thumbnail"] == ads["thumbnail"]:
-                            if "id" in odb:
-                                found.append(odb["id"])
+                    digest = self._thumbnail_digest(ads)
+                    for adid, addigest in odbs:
+                        if addigest == digest:
+                            if adid is not None:
+                                found.append(adid)
                             break
                     else:
                         dastatus = self._ingest_attachment_metadata(
@@ -1710,26 +2788,34 @@ class DatasetIngestor:
                         get_logger().info(
                             "DatasetIngestor: Ingest attachment: %s"
                             % (fads))
-            for odb in odbs:
-                if "id" in odb and odb["id"] not in found:
-                    self._get_delete_attachment(datasetid, odb["id"], token)
+            ids = [adid for adid, _ in odbs
+                   if adid is not None and adid not in found]
+            self._delete_items(datasetid, "attachments", ids, token)
 
         except Exception as e:
             get_logger().error(
                 'DatasetIngestor: %s' % (str(e)))
         return dastatus
 
-    def _ingest_origdatablock_metadata(self, metafile, pid, token):
+    def _ingest_origdatablock_metadata(self, metafile, pid, token,
+                                       kept=None):
         """ ingest origdatablock metadata
 
         :param metafile: metadata file name
         :type metafile: :obj:`str`
         :param pid: dataset id
         :type pid: :obj:`str`
+        :param kept: keys of registered files which are not posted again
+        :type kept: :obj:`set` <:obj:`tuple`>
         :returns: dataset id
         :rtype: :obj:`str`
         """
         try:
+            progressive = self._progressive_scan(
+                "%s%s" % (self.__pidprefix, pid))
+            if self._streamed(metafile) and not self._chunked() \
+               and progressive is None and kept is None:
+                return self._ingest_origdatablock_stream(metafile, pid, token)
             with open(metafile) as fl:
                 smt = fl.read()
                 mt = json.loads(smt)
@@ -1743,9 +2829,24 @@ class DatasetIngestor:
                 smt = json.dumps(mt)
                 with open(metafile, "w") as mf:
                     mf.write(smt)
+            if progressive is not None and kept is None:
+                kept = self._kept_origdatablocks(
+                    mt["datasetId"], self._file_keys([mt]), token)
+                if kept is None:
+                    raise Exception(
+                        "Origdatablocks of %s cannot be fetched"
+                        % mt["datasetId"])
+            if kept is not None:
+                mt = self._remaining_files(mt, kept)
+                smt = json.dumps(mt)
             status = time.time()
-            if "dataFileList" in mt and mt["dataFileList"]:
-                status = self._ingest_origdatablock(smt, token)
+            blocks = self._chunks(mt) if self._chunked() else [mt]
+            if len(blocks) > 1:
+                status = self._ingest_origdatablock_chunks(
+                    blocks, token, mt["datasetId"])
+            elif "dataFileList" in mt and mt["dataFileList"]:
+                status = self._ingest_origdatablock(
+                    smt, token, mt["datasetId"])
             if status:
                 return mt["datasetId"]
         except Exception as e:
@@ -1753,6 +2854,260 @@ class DatasetIngestor:
                 'DatasetIngestor: %s' % (str(e)))
         return ""
 
+    def _file_key(self, entry):
+        """ provides a key of the dataFileList entry
+
+        :param entry: dataFileList entry
+        :type entry: :obj:`dict` <:obj:`str`, `any`>
+        :returns: path, size, time and checksum of the file
+        :rtype: :obj:`tuple`
+        """
+        return (entry.get("path"), entry.get("size"),
+                self._file_time(entry.get("time")), entry.get("chk"))
+
+    def _file_time(self, value):
+        """ provides the file time in UTC with milliseconds since
+            SciCat returns times normalised in that way
+
+        :param value: file time, e.g. in local time with microseconds
+        :type value: :obj:`str`
+        :returns: normalised file time or the value if it cannot be parsed
+        :rtype: :obj:`str`
+        """
+        if not isinstance(value, str):
+            return value
+        text = value.strip()
+        for fmt in ["%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z",
+                    "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"]:
+            try:
+                tm = datetime.datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                pass
+        else:
+            return value
+        # times without offset are local
+        tm = tm.astimezone(datetime.timezone.utc)
+        return "%s.%03dZ" % (
+            tm.strftime("%Y-%m-%dT%H:%M:%S"), tm.microsecond // 1000)
+
+    def _progressive_scan(self, datasetid):
+        """ provides the running scan progressively ingested to the dataset
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :returns: scan name or None
+        :rtype: :obj:`str`
+        """
+        for scan, state in list(self.__progressive_scans.items()):
+            if state["datasetid"] == datasetid:
+                return scan
+
+    def _file_keys(self, todb):
+        """ provides keys of files in origdatablocks
+
+        :param todb: origdatablock metadata or their file names
+        :type todb: :obj:`list` <:obj:`str` or :obj:`dict`>
+        :returns: keys of the files
+        :rtype: :obj:`set` <:obj:`tuple`>
+        """
+        keys = set()
+        for odb in todb:
+            mt = odb
+            if not isinstance(mt, dict):
+                with open(odb) as fl:
+                    mt = json.loads(fl.read())
+            keys.update(self._file_key(entry)
+                        for entry in mt.get("dataFileList") or [])
+        return keys
+
+    def _kept_origdatablocks(self, datasetid, keys, token):
+        """ keeps registered origdatablocks whose files all match the given
+            files, trims blocks with changed or vanished files to their
+            unchanged files and removes blocks without unchanged files
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param keys: keys of current files
+        :type keys: :obj:`set` <:obj:`tuple`>
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :returns: keys of files in kept origdatablocks
+                  or None if origdatablocks cannot be fetched
+        :rtype: :obj:`set` <:obj:`tuple`>
+        """
+        odbs = self._get_origdatablocks(datasetid, token)
+        if odbs is None:
+            return None
+        kept = set()
+        stale = []
+        for odb in odbs:
+            entries = odb.get("dataFileList") or []
+            okeys = [self._file_key(entry) for entry in entries]
+            if okeys and keys.issuperset(okeys) and kept.isdisjoint(okeys):
+                kept.update(okeys)
+                continue
+            # unchanged files stay in the block, the others are posted again
+            matching = []
+            mkeys = set()
+            for entry, key in zip(entries, okeys):
+                if key in keys and key not in kept and key not in mkeys:
+                    matching.append(entry)
+                    mkeys.add(key)
+            if matching and "id" in odb and self._trim_origdatablock(
+                    datasetid, odb["id"], matching, token):
+                kept.update(mkeys)
+            elif "id" in odb:
+                stale.append(odb["id"])
+        if stale:
+            get_logger().info(
+                'DatasetIngestor: Removing %s outdated origdatablocks of %s'
+                % (len(stale), datasetid))
+            self._delete_items(datasetid, "origdatablocks", stale, token)
+        return kept
+
+    def _trim_origdatablock(self, datasetid, did, entries, token):
+        """ patches the registered origdatablock to keep only given files
+
+        :param datasetid: dataset id
+        :type datasetid: :obj:`str`
+        :param did: origdatablock id
+        :type did: :obj:`str`
+        :param entries: dataFileList entries to be kept
+        :type entries: :obj:`list` <:obj:`dict` <:obj:`str`, `any`>>
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :returns: request status
+        :rtype: :obj:`bool`
+        """
+        try:
+            size = sum(entry["size"] for entry in entries
+                       if isinstance(entry.get("size"), (int, float)))
+            get_logger().info(
+                'DatasetIngestor: Keeping %s files of origdatablock %s of %s'
+                % (len(entries), did, datasetid))
+            response = self.__client.patch(
+                "{url}/{pid}"
+                .format(
+                    url=self.__datablockurl,
+                    pid=did.replace("/", "%2F")),
+                token=token,
+                headers=self.__headers,
+                data=json.dumps({"dataFileList": entries, "size": size}))
+            if response.ok:
+                if self.__statecache is not None:
+                    # the content digest of the block is unknown
+                    self.__statecache.add_item(
+                        datasetid, "origdatablocks", did)
+                self._forget_chunks(datasetid)
+                return True
+            raise Exception("%s" % response.text)
+        except Exception as e:
+            get_logger().error(
+                'DatasetIngestor: %s' % (str(e)))
+        return False
+
+    def _remaining_files(self, mt, kept):
+        """ provides the origdatablock without kept files
+
+        :param mt: origdatablock metadata
+        :type mt: :obj:`dict` <:obj:`str`, `any`>
+        :param kept: keys of registered files
+        :type kept: :obj:`set` <:obj:`tuple`>
+        :returns: origdatablock metadata with files to be posted
+        :rtype: :obj:`dict` <:obj:`str`, `any`>
+        """
+        mt = dict(mt)
+        mt["dataFileList"] = [
+            entry for entry in mt.get("dataFileList") or []
+            if self._file_key(entry) not in kept]
+        if "size" in mt:
+            mt["size"] = sum(
+                entry.get("size") or 0 for entry in mt["dataFileList"])
+        return mt
+
+    def _master_file(self):
+        """ provides the master file of the scan set in format parameters
+
+        :returns: master file name or empty string
+        :rtype: :obj:`str`
+        """
+        for pattern in ["{scanpath}/{masterscanname}.{ext}",
+                        "{scanpath}/{scanname}/{scanname}.{ext}"]:
+            for ext in self.__master_file_extension_list:
+                dctfmt = dict(self.__dctfmt)
+                dctfmt["ext"] = ext
+                fname = pattern.format(**dctfmt)
+                if os.path.isfile(fname):
+                    return fname
+        return ""
+
+    def progress(self, scan, token):
+        """ registers the dataset of the running scan when its master file
+            appears and posts origdatablocks with its new files
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :param token: access token
+        :type token: :obj:`str`
+        :returns: number of posted files
+        :rtype: :obj:`int`
+        """
+        if not self.__progressive or not scan or " " in scan \
+           or self.__skip_scan_dataset_ingestion \
+           or scan in self.__sc_seingested_map.keys() \
+           or scan in self.__measurements:
+            return 0
+        self._set_scan_names(scan)
+        state = self.__progressive_scans.get(scan)
+        if state is None:
+            if not self._master_file():
+                return 0
+            rds = self._generate_rawdataset_metadata(scan)
+            if not rds:
+                return 0
+            pid = self._ingest_rawdataset_metadata(
+                rds, token, optimistic=True)
+            if not pid:
+                return 0
+            get_logger().info(
+                'DatasetIngestor: Registering running scan: %s %s' % (
+                    scan, pid))
+            datasetid = "%s%s" % (self.__pidprefix, pid)
+            # files posted before a restart are known by SciCat
+            odbs = self._get_origdatablocks(datasetid, token) or []
+            state = {
+                "datasetid": datasetid,
+                "paths": set(entry.get("path")
+                             for odb in odbs
+                             for entry in odb.get("dataFileList") or [])}
+            self.__progressive_scans[scan] = state
+        mt = json.loads(self._origdatablock_listing(scan))
+        entries = [entry for entry in mt.get("dataFileList") or []
+                   if entry.get("path") not in state["paths"]]
+        if not entries:
+            return 0
+        mt["datasetId"] = state["datasetid"]
+        mt["dataFileList"] = entries
+        if "size" in mt:
+            mt["size"] = sum(entry.get("size") or 0 for entry in entries)
+        if not self._ingest_origdatablock(
+                json.dumps(mt), token, state["datasetid"]):
+            return 0
+        state["paths"].update(entry.get("path") for entry in entries)
+        get_logger().info(
+            'DatasetIngestor: Posted %s files of running scan: %s' % (
+                len(entries), scan))
+        return len(entries)
+
+    def progressive_scans(self):
+        """ provides running scans with registered datasets
+
+        :returns: running scan names
+        :rtype: :obj:`list` <:obj:`str`>
+        """
+        return list(self.__progressive_scans.keys())
+
     def _ingest_attachment_metadata(self, metafile, pid, token):
         """ ingest attachment metadata
 
@@ -1764,6 +3119,8 @@ class DatasetIngestor:
         :rtype: :obj:`str`
         """
         try:
+            if self._streamed(metafile):
+                return self._ingest_attachment_stream(metafile, pid, token)
             with open(metafile) as fl:
                 smt = fl.read()
                 mt = json.loads(smt)
@@ -1792,6 +3149,106 @@ class DatasetIngestor:
                 'DatasetIngestor: %s' % (str(e)))
         return ""
 
+    def _streamed(self, metafile):
+        """ checks if the metadata file is uploaded without loading it
+
+        :param metafile: metadata file name
+        :type metafile: :obj:`str`
+        :returns: streamed upload flag
+        :rtype: :obj:`bool`
+        """
+        return self.__streaming_min_size is not None and \
+            os.path.getsize(metafile) >= self.__streaming_min_size
+
+    def _ingest_origdatablock_stream(self, metafile, pid, token):
+        """ ingest origdatablock metadata file without loading it
+
+        :param metafile: metadata file name
+        :type metafile: :obj:`str`
+        :param pid: dataset id
+        :type pid: :obj:`str`
+        :returns: dataset id
+        :rtype: :obj:`str`
+        """
+        if not pid or not pid.startswith(self.__bid):
+            raise Exception(
+                "Wrong origdatablock datasetId %s for DESY beamtimeId "
+                "%s in  %s"
+                % (pid, self.__bid, metafile))
+        dsid = "%s%s" % (self.__pidprefix, pid)
+        with open(metafile, "rb") as fl:
+            with mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                values, _ = jsonStream.top_level_values(
+                    mm, ["datasetId", "dataFileList"])
+                if "datasetId" not in values:
+                    raise KeyError("datasetId")
+                start = values["datasetId"]
+                olddsid, end = jsonStream.string_at(mm, start)
+                files = "dataFileList" in values and \
+                    not jsonStream.empty_at(mm, values["dataFileList"])
+        if olddsid is None:
+            raise Exception(
+                "Wrong origdatablock datasetId in %s" % metafile)
+        if olddsid != dsid:
+            jsonStream.replace_span(
+                metafile, start, end, json.dumps(dsid).encode())
+        status = True
+        if files:
+            with open(metafile, "rb") as fl:
+                status = self._ingest_origdatablock(fl, token, dsid)
+        if status:
+            return dsid
+        return ""
+
+    def _ingest_attachment_stream(self, metafile, pid, token):
+        """ ingest attachment metadata file without loading it
+
+        :param metafile: metadata file name
+        :type metafile: :obj:`str`
+        :param pid: dataset id
+        :type pid: :obj:`str`
+        :returns: dataset id
+        :rtype: :obj:`str`
+        """
+        dsid = "%s%s" % (self.__pidprefix, pid)
+        digest = None
+        patch = None
+        with open(metafile, "rb") as fl:
+            with mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                values, objstart = jsonStream.top_level_values(
+                    mm, ["datasetId", "thumbnail"])
+                if "datasetId" in values:
+                    if not pid or not pid.startswith(self.__bid):
+                        raise Exception(
+                            "Wrong attachment datasetId %s for DESY "
+                            "beamtimeId %s in  %s"
+                            % (pid, self.__bid, metafile))
+                    start = values["datasetId"]
+                    olddsid, end = jsonStream.string_at(mm, start)
+                    if olddsid is None:
+                        raise Exception(
+                            "Wrong attachment datasetId in %s" % metafile)
+                    if olddsid != dsid:
+                        patch = (start, end, json.dumps(dsid).encode())
+                else:
+                    field = b'"datasetId": ' + json.dumps(dsid).encode()
+                    if not jsonStream.empty_at(mm, objstart):
+                        field += b", "
+                    patch = (objstart + 1, objstart + 1, field)
+                if self.__statecache is not None:
+                    attachment = {}
+                    if "thumbnail" in values:
+                        attachment["thumbnail"] = jsonStream.string_at(
+                            mm, values["thumbnail"])[0]
+                    digest = self._thumbnail_digest(attachment)
+        if patch is not None:
+            jsonStream.replace_span(metafile, *patch)
+        with open(metafile, "rb") as fl:
+            status = self._ingest_attachment(fl, dsid, token, digest)
+        if status:
+            return dsid
+        return ""
+
     def ingest(self, scan, token):
         """ ingest scan
 
@@ -1800,37 +3257,43 @@ class DatasetIngestor:
         :param token: access token
         :type token: :obj:`str`
         """
+        payloads = self.generate_payloads(scan)
+        if payloads is not None:
+            self.ingest_payloads(scan, payloads, token)
+
+    def generate_payloads(self, scan):
+        """ generates and validates metadata of the scan to be ingested,
+            not thread-safe since it sets the shared command format
+            parameters of the scan
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :returns: metadata file names and their modification times
+                  or None if the scan is quarantined or spooled
+        :rtype: :obj:`dict` <:obj:`str`, `any`>
+        """
         get_logger().info(
             'DatasetIngestor: Ingesting: %s %s' % (
                 self.__dsfile, scan))
 
-        sscan = scan.split(" ")
-        self.__dctfmt["entryname"] = ""
-        self.__dctfmt["scanname"] = sscan[0] if len(sscan) > 0 else ""
-        self.__dctfmt["masterscanname"] = self.__dctfmt["scanname"]
-        sndir, snname = os.path.split(str(self.__dctfmt["scanname"]))
-        plist = []
-        self.__dctfmt["dbrelpath"] = ""
-        if self.__relpath_in_datablock:
-            plist.append(self.__dctfmt["relpath"])
-        if sndir:
-            plist.append(sndir)
-        if plist:
-            self.__dctfmt["dbrelpath"] = os.path.join(*plist)
+        self._set_scan_names(scan)
+        # metadata of running scans is regenerated from complete files
+        progressive = self.__dctfmt["scanname"] in self.__progressive_scans
         rdss = glob.glob(
             "{metapath}/{scan}{postfix}".format(
                 scan=self.__dctfmt["scanname"],
                 postfix=self.__scanpostfix,
                 metapath=self.__dctfmt["metapath"]))
-        if rdss and rdss[0]:
+        if rdss and rdss[0] and not progressive:
             rds = rdss[0]
-        elif self.__forcegeneratemeasurement or \
+        elif progressive or self.__forcegeneratemeasurement or \
                 self.__dctfmt["scanname"] not in self.__measurements:
             rds = self._generate_rawdataset_metadata(self.__dctfmt["scanname"])
         else:
             rds = []
         mtmds = 0
         ads = None
+        tads = []
         if rds:
             mtmds = os.path.getmtime(rds)
 
@@ -1856,7 +3319,11 @@ class DatasetIngestor:
         if odb:
             mtmdb = os.path.getmtime(odb)
         mtmda = 0
-        if self.__ingest_attachment:
+        deferred = None
+        if self.__ingest_attachment and self.__attachment_lane:
+            # attachments are generated and ingested by the lane
+            deferred = dict(self.__dctfmt)
+        elif self.__ingest_attachment:
             adss = glob.glob(
                 "{metapath}/{scan}{postfix}".format(
                     scan=self.__dctfmt["scanname"],
@@ -1886,31 +3353,109 @@ class DatasetIngestor:
             get_logger().info(
                 'DatasetIngestor: Metadata generated callback: %s ' % (
                     command))
-            subprocess.run(command, shell=True, check=True)
+            self.__generator.run(command)
+        payloads = {
+            "rds": rds, "odb": odb, "todb": todb, "tads": tads,
+            "rdsfile": rdss[0] if rdss and rdss[0] else None,
+            "mtmds": mtmds, "mtmdb": mtmdb, "mtmda": mtmda}
+        if deferred is not None:
+            payloads["attachments"] = deferred
+        if rds and odb and not self.__skip_scan_dataset_ingestion \
+           and not self._valid_payloads(scan, [rds], todb, tads):
+            return None
+        if self.__spool is not None and rds and odb \
+           and not self.__skip_scan_dataset_ingestion \
+           and (self.__spool.scans() or not self.__client.breaker().closed()):
+            # payloads wait for SciCat in the order of scans
+            payloads["scan"] = scan
+            self.__spool.append(payloads)
+            get_logger().info(
+                'DatasetIngestor: Spooling: %s %s' % (
+                    self.__dsfile, scan))
+            return None
+        return payloads
+
+    def _set_scan_names(self, scan):
+        """ sets scan names and datablock relative path of the scan
+            in command format parameters
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        """
+        sscan = scan.split(" ")
+        self.__dctfmt["entryname"] = ""
+        self.__dctfmt["scanname"] = sscan[0] if len(sscan) > 0 else ""
+        self.__dctfmt["masterscanname"] = self.__dctfmt["scanname"]
+        sndir, snname = os.path.split(str(self.__dctfmt["scanname"]))
+        plist = []
+        self.__dctfmt["dbrelpath"] = ""
+        if self.__relpath_in_datablock:
+            plist.append(self.__dctfmt["relpath"])
+        if sndir:
+            plist.append(sndir)
+        if plist:
+            self.__dctfmt["dbrelpath"] = os.path.join(*plist)
+
+    def ingest_payloads(self, scan, payloads, token):
+        """ ingest generated metadata of the scan,
+            can be called concurrently for different scans
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :param payloads: metadata file names and their modification times
+        :type payloads: :obj:`dict` <:obj:`str`, `any`>
+        :param token: access token
+        :type token: :obj:`str`
+        """
+        sscan = scan.split(" ")
+        rds = payloads["rds"]
+        odb = payloads["odb"]
+        todb = payloads["todb"]
+        tads = payloads["tads"]
+        rdsfile = payloads["rdsfile"]
+        mtmds = payloads["mtmds"]
+        mtmdb = payloads["mtmdb"]
+        mtmda = payloads["mtmda"]
         dbstatus = None
         dastatus = None
         pid = None
         if rds and odb and not self.__skip_scan_dataset_ingestion:
+            progressive = sscan[0] in self.__progressive_scans
             if rds and rds[0]:
-                pid = self._ingest_rawdataset_metadata(rds, token)
+                # progressively registered datasets already exist and
+                # keep their pid since their origdatablocks are posted
+                pid = self._ingest_rawdataset_metadata(
+                    rds, token, optimistic=not progressive,
+                    inplace=progressive)
+            if progressive and pid is None:
+                # unchanged metadata, files of the scan are still finalised
+                pid = self.__progressive_scans[sscan[0]]["datasetid"][
+                    len(self.__pidprefix):]
             if todb and todb[0] and pid:
-                if pid is None and rdss and rdss[0]:
-                    pid = self._get_pid(rdss[0])
-                for odb in todb:
-                    dbstatus = self._ingest_origdatablock_metadata(
-                        odb, pid, token)
-                    if not dbstatus:
-                        mtmdb = -1
-            if pid is None and rdss and rdss[0]:
-                pid = self._get_pid(rdss[0])
+                if pid is None and rdsfile:
+                    pid = self._get_pid(rdsfile)
+                kept = None
+                if progressive:
+                    kept = self._kept_origdatablocks(
+                        "%s%s" % (self.__pidprefix, pid),
+                        self._file_keys(todb), token)
+                dbstatuses = self._map_requests(
+                    lambda odb: self._ingest_origdatablock_metadata(
+                        odb, pid, token, kept), todb)
+                dbstatus = dbstatuses[-1]
+                if not all(dbstatuses):
+                    mtmdb = -1
+            if pid is None and rdsfile:
+                pid = self._get_pid(rdsfile)
             if self.__ingest_attachment and tads and tads[0] and pid:
-                if pid is None and rdss and rdss[0]:
-                    pid = self._get_pid(rdss[0])
-                for ads in tads:
-                    dastatus = self._ingest_attachment_metadata(
-                        ads, pid, token)
-                    if not dastatus:
-                        mtmda = -1
+                if pid is None and rdsfile:
+                    pid = self._get_pid(rdsfile)
+                dastatuses = self._map_requests(
+                    lambda ads: self._ingest_attachment_metadata(
+                        ads, pid, token), tads)
+                dastatus = dastatuses[-1]
+                if not all(dastatuses):
+                    mtmda = -1
         if pid is None:
             if scan in self.__sc_seingested_map.keys():
                 mtmds = self.__sc_seingested_map[scan][-3]
@@ -1928,10 +3473,109 @@ class DatasetIngestor:
                 mtmda = 0
 
         sscan.extend([str(mtmds), str(mtmdb), str(mtmda)])
-        self.__sc_ingested.append(sscan)
-        self.__sc_seingested_map[scan] = [mtmds, mtmdb, mtmda]
-        with open(self.__idsfile, 'a+') as f:
-            f.write("%s %s %s %s\n" % (scan, mtmds, mtmdb, mtmda))
+        with self.__record_lock:
+            self.__sc_ingested.append(sscan)
+            self.__sc_seingested_map[scan] = [mtmds, mtmdb, mtmda]
+            with open(self.__idsfile, 'a+') as f:
+                f.write("%s %s %s %s\n" % (scan, mtmds, mtmdb, mtmda))
+            self.__progressive_scans.pop(sscan[0], None)
+            if payloads.get("attachments") is not None and pid:
+                # the scan is not ingested again until the lane is done
+                self.__pending_attachments.add(scan)
+        if payloads.get("attachments") is not None and pid:
+            self._defer_attachments(
+                scan, pid, payloads["attachments"], token)
+
+    def _defer_attachments(self, scan, pid, dctfmt, token):
+        """ queues generation and ingestion of scan attachments
+            in the attachment lane
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param dctfmt: command format parameters of the scan
+        :type dctfmt: :obj:`dict` <:obj:`str`, `any`>
+        :param token: access token
+        :type token: :obj:`str`
+        """
+        with self.__attachment_lock:
+            if self.__attachment_executor is None:
+                self.__attachment_executor = \
+                    concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.__attachment_lane_workers)
+            self.__attachment_executor.submit(
+                self._ingest_deferred_attachments,
+                scan, pid, dict(dctfmt), token)
+        get_logger().debug(
+            'DatasetIngestor: Deferred attachments: %s' % (scan))
+
+    def _ingest_deferred_attachments(self, scan, pid, dctfmt, token):
+        """ generates and ingests scan attachments and marks
+            their status in the ingested list
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param dctfmt: command format parameters of the scan
+        :type dctfmt: :obj:`dict` <:obj:`str`, `any`>
+        :param token: access token
+        :type token: :obj:`str`
+        """
+        mtmda = -1
+        for counter in range(self.__attachment_lane_tries):
+            try:
+                if counter:
+                    time.sleep(self.__client.retry_policy().delay(counter))
+                    token = self.get_token() or token
+                adss = glob.glob(
+                    "{metapath}/{scanname}{attachmentpostfix}".format(
+                        **dctfmt))
+                if adss and adss[0]:
+                    ads = adss[0]
+                else:
+                    ads = self._generate_attachment_metadata(
+                        dctfmt["scanname"], dctfmt)
+                if not ads:
+                    # the scan has no attachment
+                    with self.__record_lock:
+                        self.__pending_attachments.discard(scan)
+                    return
+                tads = [ads]
+                with open(ads) as fl:
+                    admt = json.loads(fl.read())
+                    if isinstance(admt, list):
+                        tads = [] if self.__skip_multi_attachment else admt
+                statuses = [self._ingest_attachment_metadata(
+                    fads, pid, token) for fads in tads]
+                if all(statuses):
+                    mtmda = os.path.getmtime(ads)
+                    break
+            except Exception as e:
+                get_logger().warning(
+                    'DatasetIngestor: %s' % (str(e)))
+        with self.__record_lock:
+            mtmds, mtmdb = self.__sc_seingested_map.get(scan, [0, 0, 0])[:2]
+            sscan = scan.split(" ")
+            sscan.extend([str(mtmds), str(mtmdb), str(mtmda)])
+            self.__sc_ingested.append(sscan)
+            self.__sc_seingested_map[scan] = [mtmds, mtmdb, mtmda]
+            with open(self.__idsfile, 'a+') as f:
+                f.write("%s %s %s %s\n" % (scan, mtmds, mtmdb, mtmda))
+            self.__pending_attachments.discard(scan)
+        get_logger().info(
+            'DatasetIngestor: Ingest deferred attachments: %s %s'
+            % (scan, "done" if mtmda != -1 else "failed"))
+
+    def wait_for_attachments(self):
+        """ waits until the attachment lane ingests all queued attachments
+        """
+        with self.__attachment_lock:
+            executor = self.__attachment_executor
+            self.__attachment_executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
 
     def reingest(self, scan, token, notmp=False):
         """ re-ingest scan
@@ -1946,6 +3590,8 @@ class DatasetIngestor:
         get_logger().info(
             'DatasetIngestor: Checking: %s %s' % (
                 self.__dsfile, scan))
+        if self._coalesced(scan):
+            return
 
         reingest_dataset = False
         reingest_origdatablock = False
@@ -2093,7 +3739,7 @@ class DatasetIngestor:
             get_logger().info(
                 'DatasetIngestor: Metadata generated callback: %s ' % (
                     command))
-            subprocess.run(command, shell=True, check=True)
+            self.__generator.run(command)
         dastatus = None
         dbstatus = None
         ads = None
@@ -2130,6 +3776,13 @@ class DatasetIngestor:
             if ads:
                 mtm0 = os.path.getmtime(ads)
 
+        if not self._valid_payloads(
+                scan,
+                [rds] if rds and reingest_dataset else [],
+                todb if reingest_origdatablock else [],
+                tads if reingest_attachment and self.__ingest_attachment
+                else []):
+            return
         pid = None
         if (rds and odb) or ads:
             if rds and reingest_dataset:
@@ -2144,12 +3797,27 @@ class DatasetIngestor:
             if todb and todb[0] and reingest_origdatablock:
                 if pid is None and rdss and rdss[0]:
                     pid = self._get_pid(rdss[0])
-                self._delete_origdatablocks(pid, token)
-                for odb in todb:
-                    dbstatus = self._ingest_origdatablock_metadata(
-                        odb, pid, token)
+                kept = None
+                if self.__incremental_origdatablocks and pid:
+                    try:
+                        kept = self._kept_origdatablocks(
+                            "%s%s" % (self.__pidprefix, pid),
+                            self._file_keys(todb), token)
+                    except Exception as e:
+                        get_logger().warning(
+                            'DatasetIngestor: %s' % (str(e)))
+                if kept is None:
+                    self._delete_origdatablocks(pid, token)
+
+                def ingest_origdatablock(odb):
+                    status = self._ingest_origdatablock_metadata(
+                        odb, pid, token, kept)
                     get_logger().info(
                         "DatasetIngestor: Ingest origdatablock: %s" % (odb))
+                    return status
+
+                dbstatus = self._map_requests(
+                    ingest_origdatablock, todb)[-1]
                 if not dbstatus:
                     mtmdb = -1
 
@@ -2172,12 +3840,18 @@ class DatasetIngestor:
                                 tads, pid, token)
                         else:
                             self._delete_attachments(pid, token)
-                            for ads in tads:
-                                dastatus = self._ingest_attachment_metadata(
+
+                            def ingest_attachment(ads):
+                                status = self._ingest_attachment_metadata(
                                     ads, pid, token)
                                 get_logger().info(
                                     "DatasetIngestor: Ingest attachment: %s"
                                     % (ads))
+                                return status
+
+                            dastatus = self._map_requests(
+                                ingest_attachment, tads)[-1]
+                            ads = tads[-1]
                         if not dastatus:
                             mtmda = -1
         mtmda = 0
@@ -2204,12 +3878,21 @@ class DatasetIngestor:
         else:
             mtmda = 0
 
-        sscan.extend([str(mtmds), str(mtmdb), str(mtmda)])
-        self.__sc_ingested.append(sscan)
-        self.__sc_seingested_map[scan] = [mtmds, mtmdb, mtmda]
         lfile = self.__idsfiletmp
         if notmp:
             lfile = self.__idsfile
+        # coalesced entries are done with the last one
+        for cscan in self.__coalesced.pop(
+                self._reingest_target(scan), []):
+            csscan = cscan.split(" ")
+            csscan.extend([str(mtmds), str(mtmdb), str(mtmda)])
+            self.__sc_ingested.append(csscan)
+            self.__sc_seingested_map[cscan] = [mtmds, mtmdb, mtmda]
+            with open(lfile, 'a+') as f:
+                f.write("%s %s %s %s\n" % (cscan, mtmds, mtmdb, mtmda))
+        sscan.extend([str(mtmds), str(mtmdb), str(mtmda)])
+        self.__sc_ingested.append(sscan)
+        self.__sc_seingested_map[scan] = [mtmds, mtmdb, mtmda]
         with open(lfile, 'a+') as f:
             f.write("%s %s %s %s\n" % (scan, mtmds, mtmdb, mtmda))
 
@@ -2220,6 +3903,11 @@ class DatasetIngestor:
             scans = [sc.strip()
                      for sc in dsf.read().split("\n")
                      if sc.strip()]
+        if self.__quarantine is not None:
+            # quarantined scans wait until they are removed from the file
+            self.__quarantine = DatasetSpool(self.__quarantinefile)
+            quarantined = self.__quarantine.scans()
+            scans = [sc for sc in scans if sc not in quarantined]
         if os.path.isfile(self.__idsfile):
             with open(self.__idsfile, "r") as idsf:
                 self.__sc_ingested = [
@@ -2265,6 +3953,10 @@ class DatasetIngestor:
                         self.__sc_ingested_map[" ".join(sc[:-3])] = sc
                 except Exception as e:
                     get_logger().debug("%s" % str(e))
+            if self.__spool is not None:
+                ingested.extend(self.__spool.scans())
+            with self.__record_lock:
+                ingested.extend(self.__pending_attachments)
             self.__sc_waiting = [
                 sc for sc in scans if sc not in ingested]
         else:
@@ -2281,6 +3973,206 @@ class DatasetIngestor:
                 except Exception as e:
                     get_logger().debug("%s" % str(e))
 
+    def _reingest_target(self, scan):
+        """ provides the scan or measurement re-ingested by
+            the name:timestamp entry
+
+        :param scan: waiting entry
+        :type scan: :obj:`str`
+        :returns: re-ingest target or None for other entries
+        :rtype: :obj:`str`
+        """
+        sscan = scan.split(" ")
+        if not sscan[0] or ":" not in sscan[0] or "::/" in sscan[0] \
+           or scan.startswith("__command__ "):
+            return None
+        return " ".join([sscan[0].split(":")[0]] + sscan[1:])
+
+    def _coalesced(self, scan):
+        """ checks if the re-ingest entry is coalesced with a later
+            waiting entry of the same target before the next command
+
+        :param scan: waiting entry
+        :type scan: :obj:`str`
+        :returns: coalesced flag
+        :rtype: :obj:`bool`
+        """
+        if not self.__reingest_coalescing:
+            return False
+        target = self._reingest_target(scan)
+        if target is None:
+            return False
+        coalesced = self.__coalesced.get(target, [])
+        try:
+            # position of the entry among its repetitions
+            index = -1
+            for _ in range(coalesced.count(scan) + 1):
+                index = self.__sc_waiting.index(scan, index + 1)
+        except ValueError:
+            return False
+        for later in self.__sc_waiting[index + 1:]:
+            if later.startswith("__command__ "):
+                # commands end the coalescing window
+                break
+            if self._reingest_target(later) == target:
+                self.__coalesced.setdefault(target, []).append(scan)
+                get_logger().info(
+                    'DatasetIngestor: Coalesce %s with %s' % (scan, later))
+                return True
+        return False
+
+    def quarantined_datasets(self):
+        """ provides datasets with invalid payloads
+
+        :returns: quarantined datasets list
+        :rtype: :obj:`list` <:obj:`str`>
+        """
+        if self.__quarantine is None:
+            return []
+        return self.__quarantine.scans()
+
+    def _valid_payloads(self, scan, rdss, todb, tads):
+        """ validates metadata files before they are posted
+            and quarantines the scan with invalid payloads
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :param rdss: dataset metadata file names
+        :type rdss: :obj:`list` <:obj:`str`>
+        :param todb: origdatablock metadata file names
+        :type todb: :obj:`list` <:obj:`str`>
+        :param tads: attachment metadata file names
+        :type tads: :obj:`list` <:obj:`str`>
+        :returns: valid payloads flag
+        :rtype: :obj:`bool`
+        """
+        if self.__validator is None:
+            return True
+        for model, files in [("dataset", rdss),
+                             ("origdatablock", todb or []),
+                             ("attachment", tads or [])]:
+            for metafile in files:
+                # streamed files are not loaded into memory
+                if not metafile or self._streamed(metafile):
+                    continue
+                try:
+                    with open(metafile) as fl:
+                        errors = self.__validator.errors(
+                            model, json.loads(fl.read()))
+                except Exception as e:
+                    errors = [str(e)]
+                if errors:
+                    self.__quarantine.append(
+                        {"scan": scan, "file": metafile, "errors": errors})
+                    get_logger().error(
+                        'DatasetIngestor: Quarantined %s: %s: %s' % (
+                            scan, metafile, "; ".join(errors)))
+                    return False
+        return True
+
+    def spooled_datasets(self):
+        """ provides datasets spooled while SciCat is unavailable
+
+        :returns: spooled datasets list
+        :rtype: :obj:`list` <:obj:`str`>
+        """
+        if self.__spool is None:
+            return []
+        return self.__spool.scans()
+
+    def lookup_waiting_datasets(self, token):
+        """ looks up all waiting datasets with a few list queries
+            instead of one existence request per scan
+
+        :param token: ingestor token
+        :type token: :obj:`str`
+        """
+        if not self.__batch_lookup:
+            return
+        pids = []
+        for scan in self.__sc_waiting:
+            sscan = scan.split(" ")
+            if not sscan[0] or scan.startswith("__command__ ") \
+               or "::/" in sscan[0]:
+                continue
+            pid = "%s%s/%s" % (
+                self.__pidprefix, self.__bid, sscan[0].split(":")[0])
+            if pid not in pids:
+                pids.append(pid)
+        size = self.__batch_lookup_size
+        for i in range(0, len(pids), size):
+            bpids = pids[i:i + size]
+            flt = {"where": {"pid": {"inq": bpids}}, "limit": len(bpids)}
+            try:
+                response = self.__client.get(
+                    self.__dataseturl,
+                    headers=self.__headers,
+                    token=token,
+                    params={"filter": json.dumps(flt)})
+                if not response.ok:
+                    raise Exception("%s" % response.text)
+                datasets = json.loads(response.content)
+                if not isinstance(datasets, list):
+                    raise Exception("Wrong list of datasets: %s" % datasets)
+            except Exception as e:
+                get_logger().debug(
+                    'DatasetIngestor: Datasets not looked up: %s' % str(e))
+                continue
+            found = dict((ds["pid"], ds) for ds in datasets
+                         if isinstance(ds, dict) and "pid" in ds)
+            for pid in bpids:
+                if self.__statecache is not None:
+                    self.__statecache.set_dataset(pid, found.get(pid))
+                else:
+                    self.__batch_datasets[pid] = found.get(pid)
+            get_logger().debug(
+                'DatasetIngestor: Looked up %s datasets: %s existing'
+                % (len(bpids), len(found)))
+
+    def _probe_scicat(self, token):
+        """ checks if SciCat is available again with a probe request
+
+        :param token: access token
+        :type token: :obj:`str`
+        :returns: SciCat available flag
+        :rtype: :obj:`bool`
+        """
+        breaker = self.__client.breaker()
+        if breaker.closed():
+            return True
+        try:
+            self.__client.get(
+                self.__dataseturl, headers=self.__headers, token=token,
+                params={"filter": json.dumps(
+                    {"fields": {"pid": True}, "limit": 1})})
+        except Exception as e:
+            get_logger().debug('DatasetIngestor: %s' % (str(e)))
+        return breaker.closed()
+
+    def drain_spool(self, token):
+        """ ingests spooled datasets in order when SciCat is available
+
+        :param token: access token
+        :type token: :obj:`str`
+        """
+        if self.__spool is None or not self.__spool.scans() \
+           or not self._probe_scicat(token):
+            return
+        breaker = self.__client.breaker()
+        delay = 1.0 / self.__spool_drain_rate \
+            if self.__spool_drain_rate > 0 else 0
+        for ie, entry in enumerate(self.__spool.entries()):
+            if ie and delay:
+                time.sleep(delay)
+            get_logger().info(
+                'DatasetIngestor: Ingesting spooled: %s %s' % (
+                    self.__dsfile, entry["scan"]))
+            self.ingest_payloads(entry["scan"], entry, token)
+            if not breaker.closed():
+                # the entry stays in the spool for the next drain
+                break
+            self.__spool.pop()
+
     def waiting_datasets(self):
         """ provides waitings datasets
 
@@ -2294,6 +4186,8 @@ class DatasetIngestor:
         """
         self.__sc_waiting = []
         self.__measurements = set()
+        self.__batch_datasets = {}
+        self.__coalesced = {}
 
     def clear_tmpfile(self):
         """ clear waitings datasets
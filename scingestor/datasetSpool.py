@@ -0,0 +1,101 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import os
+import json
+import threading
+
+from .logger import get_logger
+
+
+class DatasetSpool:
+
+    """ Durable ordered spool of prepared dataset payloads
+        kept in a file with one json entry per line
+    """
+
+    def __init__(self, spoolfile):
+        """ constructor
+
+        :param spoolfile: spool file name
+        :type spoolfile: :obj:`str`
+        """
+        #: (:obj:`str`) spool file name
+        self.__spoolfile = spoolfile
+        #: (:obj:`list` <:obj:`dict` <:obj:`str`, `any`>>) spooled entries
+        self.__entries = []
+        #: (:class:`threading.Lock`) spool lock
+        self.__lock = threading.Lock()
+
+        if os.path.isfile(self.__spoolfile):
+            with open(self.__spoolfile, "r") as fl:
+                for line in fl.read().split("\n"):
+                    if line.strip():
+                        try:
+                            self.__entries.append(json.loads(line))
+                        except Exception as e:
+                            get_logger().warning(
+                                'DatasetSpool: %s' % (str(e)))
+
+    def entries(self):
+        """ provides spooled entries in the spooling order
+
+        :returns: spooled entries
+        :rtype: :obj:`list` <:obj:`dict` <:obj:`str`, `any`>>
+        """
+        with self.__lock:
+            return list(self.__entries)
+
+    def scans(self):
+        """ provides spooled scans in the spooling order
+
+        :returns: spooled scan names
+        :rtype: :obj:`list` <:obj:`str`>
+        """
+        with self.__lock:
+            return [entry["scan"] for entry in self.__entries]
+
+    def append(self, entry):
+        """ appends the entry to the spool
+
+        :param entry: spool entry with the scan name and its payloads
+        :type entry: :obj:`dict` <:obj:`str`, `any`>
+        """
+        with self.__lock:
+            self.__entries.append(entry)
+            with open(self.__spoolfile, 'a+') as fl:
+                fl.write("%s\n" % json.dumps(entry))
+
+    def pop(self):
+        """ removes the first entry from the spool
+
+        :returns: removed spool entry
+        :rtype: :obj:`dict` <:obj:`str`, `any`>
+        """
+        with self.__lock:
+            entry = self.__entries.pop(0) if self.__entries else None
+            if self.__entries:
+                tmpfile = "%s%s" % (self.__spoolfile, ".tmp")
+                with open(tmpfile, "w") as fl:
+                    for ent in self.__entries:
+                        fl.write("%s\n" % json.dumps(ent))
+                os.replace(tmpfile, self.__spoolfile)
+            elif os.path.exists(self.__spoolfile):
+                os.remove(self.__spoolfile)
+            return entry
@@ -25,6 +25,7 @@ import inotifyx
 
 from .safeINotifier import SafeINotifier
 from .datasetIngestor import DatasetIngestor
+from .ingestionPipeline import IngestionPipeline
 from .pathConverter import PathConverter
 from .logger import get_logger
 
@@ -85,6 +86,8 @@ class DatasetWatcher(threading.Thread):
             self.__corepath, self.__bpath,
             self.__usecorepath and self.__corepath)
 
+        #: (:obj:`str`) scan dir path
+        self.__path = path
         #: (:obj:`str`) file with a dataset list
         self.__measurement_name = ""
         #: (:obj:`str`) file with a dataset list
@@ -101,6 +104,30 @@ class DatasetWatcher(threading.Thread):
         #:                              beamtime watch description paths
         self.__wd_to_queue = {}
 
+        #: (:obj:`bool`) ingest running scans progressively
+        self.__progressive = False
+        #: (:obj:`float`) min time between progressive scan updates in s
+        self.__progressive_interval = 10
+        #: (:obj:`list` <:obj:`str`>) master file extension list
+        self.__master_file_extension_list = [
+            "nxs", "h5", "ndf", "nx", "fio"]
+        #: (:obj:`dict` <:obj:`int`, :obj:`str`>)
+        #:     watch description paths of running scan directories
+        self.__wd_to_scandir = {}
+        #: (:obj:`dict` <:obj:`str`, :obj:`float`>)
+        #:     times of the first unprocessed changes in running scans
+        self.__changed_scans = {}
+
+        #: (:obj:`bool`) overlap generation and upload of scans
+        self.__use_pipeline = False
+        #: (:obj:`int`) number of upload workers of the pipeline
+        self.__pipeline_upload_workers = 2
+        #: (:obj:`int`) size of queues between pipeline stages
+        self.__pipeline_queue_size = 4
+        #: (:class:`scingestor.ingestionPipeline.IngestionPipeline`)
+        #:     ingestion pipeline
+        self.__pipeline = None
+
         #: (:obj:`float`) timeout value for inotifyx get events in s
         self.__timeout = 0.1
         #: (:obj:`float`) max count of recheck the dataset list
@@ -119,6 +146,39 @@ class DatasetWatcher(threading.Thread):
             except Exception as e:
                 get_logger().warning('%s' % (str(e)))
 
+        if "ingestion_pipeline" in self.__config.keys():
+            self.__use_pipeline = bool(self.__config["ingestion_pipeline"])
+
+        if "ingestion_pipeline_upload_workers" in self.__config.keys():
+            try:
+                self.__pipeline_upload_workers = int(
+                    self.__config["ingestion_pipeline_upload_workers"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "ingestion_pipeline_queue_size" in self.__config.keys():
+            try:
+                self.__pipeline_queue_size = int(
+                    self.__config["ingestion_pipeline_queue_size"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "progressive_ingestion" in self.__config.keys():
+            self.__progressive = bool(self.__config["progressive_ingestion"])
+
+        if "progressive_ingestion_interval" in self.__config.keys():
+            try:
+                self.__progressive_interval = float(
+                    self.__config["progressive_ingestion_interval"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "master_file_extension_list" in self.__config.keys() \
+           and isinstance(self.__config["master_file_extension_list"], list):
+            self.__master_file_extension_list = [
+                ext for ext in self.__config["master_file_extension_list"]
+                if ext]
+
         if "ingestion_delay_time" in self.__config.keys():
             try:
                 self.__delay = float(self.__config["ingestion_delay_time"])
@@ -163,6 +223,150 @@ class DatasetWatcher(threading.Thread):
         except Exception as e:
             get_logger().warning('%s: %s' % (path, str(e)))
 
+    def _generate(self, item):
+        """ generates metadata of the scan in the pipeline
+
+        :param item: scan name and access token
+        :type item: :obj:`tuple` <:obj:`str`, :obj:`str`>
+        :returns: scan name, its payloads and access token
+        :rtype: :obj:`tuple` <:obj:`str`, :obj:`dict`, :obj:`str`>
+        """
+        scan, token = item
+        payloads = self.__ingestor.generate_payloads(scan)
+        if payloads is not None:
+            return (scan, payloads, token)
+
+    def _upload(self, item):
+        """ uploads and records metadata of the scan in the pipeline
+
+        :param item: scan name, its payloads and access token
+        :type item: :obj:`tuple` <:obj:`str`, :obj:`dict`, :obj:`str`>
+        """
+        self.__ingestor.ingest_payloads(*item)
+
+    def _ingest(self, scan, token):
+        """ ingests the scan directly or passes it to the pipeline
+
+        :param scan: scan name
+        :type scan: :obj:`str`
+        :param token: access token
+        :type token: :obj:`str`
+        """
+        if self.__pipeline is not None:
+            self.__pipeline.put((scan, token))
+        else:
+            self.__ingestor.ingest(scan, token)
+
+    def _drain(self):
+        """ waits until scans passed to the pipeline are ingested
+        """
+        if self.__pipeline is not None:
+            self.__pipeline.join()
+
+    def _add_scandir(self, path):
+        """ add running scan directory to notifier
+
+        :param path: scan directory path
+        :type path: :obj:`str`
+        """
+        if path in self.__wd_to_scandir.values():
+            return
+        try:
+            wqueue, watch_descriptor = self.__notifier.add_watch(
+                self.__conv.from_core(path),
+                inotifyx.IN_CLOSE_WRITE | inotifyx.IN_CREATE |
+                inotifyx.IN_MOVED_TO)
+            self.__wd_to_path[watch_descriptor] = path
+            self.__wd_to_queue[watch_descriptor] = wqueue
+            self.__wd_to_scandir[watch_descriptor] = path
+            get_logger().debug(
+                'DatasetWatcher: Adding scan watch %s: %s' % (
+                    watch_descriptor, path))
+        except Exception as e:
+            get_logger().warning('%s: %s' % (path, str(e)))
+
+    def _changed_scan(self, ffn):
+        """ provides a scan name of the changed file in the scan directory
+
+        :param ffn: changed file path
+        :type ffn: :obj:`str`
+        :returns: scan name or None
+        :rtype: :obj:`str`
+        """
+        relpath = os.path.relpath(ffn, self.__path)
+        if relpath.startswith(".."):
+            return None
+        sdir, sfile = os.path.split(relpath)
+        name, ext = os.path.splitext(sfile)
+        if ext[1:] in self.__master_file_extension_list:
+            if name == os.path.basename(sdir):
+                # {scanpath}/{scanname}/{scanname}.{ext}
+                return sdir
+            if not sdir:
+                return name
+        parts = relpath.split(os.sep)
+        if len(parts) > 1:
+            return parts[0]
+        return None
+
+    def _scandir_event(self, qid, event):
+        """ handles an event of the running scan directory
+
+        :param qid: watch description id
+        :type qid: :obj:`int`
+        :param event: notifier event
+        :type event: :class:`scingestor.safeINotifier.Event`
+        """
+        if not event.name:
+            return
+        masks = event.masks.split("|")
+        ffn = os.path.join(self.__wd_to_scandir[qid], event.name)
+        if "IN_ISDIR" in masks:
+            self._add_scandir(ffn)
+            return
+        scan = self._changed_scan(ffn)
+        if scan:
+            self.__changed_scans.setdefault(scan, time.time())
+
+    def _progress(self):
+        """ updates running scans with unprocessed changes
+        """
+        now = time.time()
+        scans = [scan for scan, tm in self.__changed_scans.items()
+                 if now - tm >= self.__progressive_interval]
+        if not scans:
+            return
+        try:
+            token = self.__ingestor.get_token()
+        except Exception as e:
+            get_logger().warning(str(e))
+            return
+        if not token:
+            return
+        for scan in scans:
+            self.__changed_scans.pop(scan, None)
+            try:
+                self.__ingestor.progress(scan, token)
+            except Exception as e:
+                get_logger().warning(str(e))
+
+    def _remove_scandirs(self, scans):
+        """ remove directories of ingested scans from notifier
+
+        :param scans: ingested scan names
+        :type scans: :obj:`list` <:obj:`str`>
+        """
+        names = set(scan.split(" ")[0] for scan in scans if scan)
+        for wd, path in list(self.__wd_to_scandir.items()):
+            relpath = os.path.relpath(path, self.__path)
+            if relpath.split(os.sep)[0] in names:
+                self.__notifier.rm_watch(wd)
+                self.__wd_to_path.pop(wd, None)
+                self.__wd_to_queue.pop(wd, None)
+                self.__wd_to_scandir.pop(wd, None)
+        for name in names:
+            self.__changed_scans.pop(name, None)
+
     def _stop_notifier(self):
         """ stop notifier
         """
@@ -170,6 +374,7 @@ class DatasetWatcher(threading.Thread):
             self.__notifier.rm_watch(wd)
             path = self.__wd_to_path.pop(wd, None)
             self.__wd_to_queue.pop(wd, None)
+            self.__wd_to_scandir.pop(wd, None)
             get_logger().info(
                 'ScanDirWatcher: '
                 'Removing watch %s: %s' % (str(wd), path))
@@ -177,7 +382,16 @@ class DatasetWatcher(threading.Thread):
     def run(self):
         """ scandir watcher thread
         """
+        if self.__use_pipeline:
+            # generate_payloads sets the shared command format parameters
+            # of the ingestor so metadata is generated by a single worker
+            self.__pipeline = IngestionPipeline(
+                [("generate", self._generate, 1),
+                 ("upload", self._upload, self.__pipeline_upload_workers)],
+                self.__pipeline_queue_size)
         self._start_notifier(self.__dsfile)
+        if self.__progressive:
+            self._add_scandir(self.__path)
         try:
             self.__ingestor.check_list()
         except Exception as e:
@@ -195,9 +409,13 @@ class DatasetWatcher(threading.Thread):
             try:
                 token = self.__ingestor.get_token()
                 if token:
+                    self.__ingestor.drain_spool(token)
+                    self.__ingestor.lookup_waiting_datasets(token)
                     for scan in self.__ingestor.waiting_datasets():
                         sscan = scan.split(" ")
                         if scan and scan.startswith("__command__ "):
+                            # commands apply after the previous scans
+                            self._drain()
                             if self.__executecommands and len(sscan) > 1:
                                 cmd = sscan[1]
                                 if cmd == "stop":
@@ -208,6 +426,7 @@ class DatasetWatcher(threading.Thread):
                                     self.__ingestor.start_measurement(
                                         groupname)
                         elif len(sscan) > 0 and ":" in sscan[0]:
+                            self._drain()
                             try:
                                 self.__ingestor.reingest(
                                     scan, token, notmp=True)
@@ -215,12 +434,15 @@ class DatasetWatcher(threading.Thread):
                                 get_logger().warning(str(e))
                                 continue
                         else:
-                            self.__ingestor.ingest(scan, token)
+                            self._ingest(scan, token)
+                    self._drain()
                     self.__ingestor.clear_waiting_datasets()
+                    self.__ingestor.log_metrics()
             except Exception as e:
                 get_logger().warning(str(e))
 
         counter = 0
+        spooltime = time.time()
         try:
             while self.running:
 
@@ -234,7 +456,9 @@ class DatasetWatcher(threading.Thread):
                         event = wqueue.get(block=True, timeout=self.__timeout)
                     except queue.Empty:
                         break
-                    if qid in self.__wd_to_path.keys():
+                    if qid in self.__wd_to_scandir.keys():
+                        self._scandir_event(qid, event)
+                    elif qid in self.__wd_to_path.keys():
                         # get_logger().info(
                         #     'Ds: %s %s %s' % (event.name,
                         #                       event.masks,
@@ -301,6 +525,21 @@ class DatasetWatcher(threading.Thread):
                         #     (counter, self.__recheck_dslist_interval))
                         counter += 1
 
+                if self.__changed_scans:
+                    self._progress()
+
+                if self.__ingestor.spooled_datasets() \
+                   and not self.__ingestor.waiting_datasets() \
+                   and time.time() - spooltime > self.__delay:
+                    # spooled datasets are retried without new scans
+                    spooltime = time.time()
+                    try:
+                        token = self.__ingestor.get_token()
+                        if token:
+                            self.__ingestor.drain_spool(token)
+                    except Exception as e:
+                        get_logger().warning(str(e))
+
                 if self.__ingestor.waiting_datasets():
                     time.sleep(self.__delay)
                     try:
@@ -309,9 +548,13 @@ class DatasetWatcher(threading.Thread):
                         get_logger().warning(str(e))
                         continue
                     if token:
+                        self.__ingestor.drain_spool(token)
+                        self.__ingestor.lookup_waiting_datasets(token)
                         for scan in self.__ingestor.waiting_datasets():
                             sscan = scan.split(" ")
                             if scan and scan.startswith("__command__ "):
+                                # commands apply after the previous scans
+                                self._drain()
                                 if self.__executecommands and len(sscan) > 1:
                                     cmd = sscan[1]
                                     if cmd == "stop":
@@ -322,6 +565,7 @@ class DatasetWatcher(threading.Thread):
                                         self.__ingestor.start_measurement(
                                             groupname)
                             elif len(sscan) > 0 and ":" in sscan[0]:
+                                self._drain()
                                 try:
                                     self.__ingestor.reingest(
                                         scan, token, notmp=True)
@@ -330,15 +574,24 @@ class DatasetWatcher(threading.Thread):
                                     continue
                             else:
                                 try:
-                                    self.__ingestor.ingest(scan, token)
+                                    self._ingest(scan, token)
                                 except Exception as e:
                                     get_logger().warning(str(e))
                                     continue
+                        self._drain()
+                        if self.__wd_to_scandir:
+                            self._remove_scandirs(
+                                self.__ingestor.waiting_datasets())
                         self.__ingestor.clear_waiting_datasets()
+                        self.__ingestor.log_metrics()
                 # else:
                 #     time.sleep(self.__timeout)
         finally:
             self.stop()
+            if self.__pipeline is not None:
+                self.__pipeline.close()
+                self.__pipeline = None
+            self.__ingestor.wait_for_attachments()
 
     def stop(self):
         """ stop the watcher
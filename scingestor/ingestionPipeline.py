@@ -0,0 +1,112 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import queue
+import threading
+
+from .logger import get_logger
+
+
+class IngestionPipeline:
+
+    """ Ingestion stages with their own workers connected by bounded
+        queues, i.e. a full queue blocks the upstream stage
+    """
+
+    def __init__(self, stages, queue_size=4):
+        """ constructor
+
+        :param stages: stage names, functions and numbers of workers.
+                       A stage function gets an item and returns an item
+                       for the next stage or None to drop it
+        :type stages: :obj:`list` < (:obj:`str`, :obj:`function`,
+                      :obj:`int`) >
+        :param queue_size: maximal number of items waiting for a stage
+        :type queue_size: :obj:`int`
+        """
+        #: (:obj:`list` <:class:`queue.Queue`>) input queues of stages
+        self.__queues = [queue.Queue(maxsize=max(1, int(queue_size)))
+                         for _ in stages]
+        #: (:obj:`list` <:class:`threading.Thread`>) stage workers
+        self.__workers = []
+        #: (:obj:`list` <:obj:`int`>) numbers of workers of stages
+        self.__counts = []
+        for ist, (name, func, workers) in enumerate(stages):
+            count = max(1, int(workers))
+            self.__counts.append(count)
+            for iw in range(count):
+                worker = threading.Thread(
+                    target=self.__work, args=(ist, name, func),
+                    name="%s-%s" % (name, iw))
+                worker.daemon = True
+                worker.start()
+                self.__workers.append(worker)
+
+    def __work(self, ist, name, func):
+        """ processes items of the stage
+
+        :param ist: stage index
+        :type ist: :obj:`int`
+        :param name: stage name
+        :type name: :obj:`str`
+        :param func: stage function
+        :type func: :obj:`function`
+        """
+        inqueue = self.__queues[ist]
+        outqueue = self.__queues[ist + 1] \
+            if ist + 1 < len(self.__queues) else None
+        while True:
+            item = inqueue.get()
+            try:
+                if item is None:
+                    return
+                result = func(item)
+                if result is not None and outqueue is not None:
+                    # blocks when the next stage falls behind
+                    outqueue.put(result)
+            except Exception as e:
+                get_logger().warning(
+                    'IngestionPipeline: %s: %s' % (name, str(e)))
+            finally:
+                inqueue.task_done()
+
+    def put(self, item):
+        """ puts the item into the first stage, blocks if its queue is full
+
+        :param item: item to be processed
+        :type item: `any`
+        """
+        if item is not None:
+            self.__queues[0].put(item)
+
+    def join(self):
+        """ waits until all put items pass through all stages
+        """
+        for que in self.__queues:
+            que.join()
+
+    def close(self):
+        """ processes remaining items and stops stage workers
+        """
+        for que, count in zip(self.__queues, self.__counts):
+            que.join()
+            for _ in range(count):
+                que.put(None)
+        for worker in self.__workers:
+            worker.join()
@@ -0,0 +1,135 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import os
+import re
+import json
+import shutil
+
+#: (:class:`re.Pattern`) json string, optionally followed by a colon,
+#:    or a bracket
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"(\s*:)?|[{}\[\]]')
+#: (:class:`re.Pattern`) json string
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+#: (:class:`re.Pattern`) white spaces
+_SPACE = re.compile(rb'\s*')
+#: (:obj:`int`) size of copied file chunks
+_CHUNK_SIZE = 1024 * 1024
+
+
+def top_level_values(buffer, keys):
+    """ finds values of the top-level object keys in the json buffer
+        without decoding the whole document
+
+    :param buffer: json document, e.g. memory mapped file
+    :type buffer: :obj:`bytes`
+    :param keys: object keys
+    :type keys: :obj:`list` <:obj:`str`>
+    :returns: start positions of the key values and the position
+              of the top-level object start
+    :rtype: (:obj:`dict` <:obj:`str`, :obj:`int`>, :obj:`int`)
+    """
+    rawkeys = dict((json.dumps(key).encode(), key) for key in keys)
+    values = {}
+    start = None
+    depth = 0
+    for match in _TOKEN.finditer(buffer):
+        token = buffer[match.start():match.start() + 1]
+        if token in (b"{", b"["):
+            if start is None:
+                if token != b"{":
+                    raise ValueError("JSON document is not an object")
+                start = match.start()
+            depth += 1
+        elif token in (b"}", b"]"):
+            depth -= 1
+            if depth == 0:
+                break
+        elif depth == 1 and match.group(1):
+            key = rawkeys.get(buffer[match.start():match.start(1)])
+            if key is not None and key not in values:
+                values[key] = _SPACE.match(buffer, match.end()).end()
+                if len(values) == len(rawkeys):
+                    break
+    if start is None:
+        raise ValueError("JSON document is not an object")
+    return values, start
+
+
+def string_at(buffer, pos):
+    """ decodes the json string at the given position
+
+    :param buffer: json document, e.g. memory mapped file
+    :type buffer: :obj:`bytes`
+    :param pos: string start position
+    :type pos: :obj:`int`
+    :returns: decoded string or None if it is not a string
+              and the string end position
+    :rtype: (:obj:`str`, :obj:`int`)
+    """
+    match = _STRING.match(buffer, pos)
+    if match is None:
+        return None, pos
+    return json.loads(buffer[match.start():match.end()]), match.end()
+
+
+def empty_at(buffer, pos):
+    """ checks if the json value at the given position is empty,
+        i.e. null, an empty list, an empty object or an empty string
+
+    :param buffer: json document, e.g. memory mapped file
+    :type buffer: :obj:`bytes`
+    :param pos: value start position
+    :type pos: :obj:`int`
+    :returns: empty value flag
+    :rtype: :obj:`bool`
+    """
+    token = buffer[pos:pos + 1]
+    if token in (b"[", b"{"):
+        nxt = _SPACE.match(buffer, pos + 1).end()
+        return buffer[nxt:nxt + 1] in (b"]", b"}")
+    return buffer[pos:pos + 4] == b"null" or buffer[pos:pos + 2] == b'""'
+
+
+def replace_span(filename, start, end, data):
+    """ replaces the byte span of the file without reading it into memory
+
+    :param filename: file name
+    :type filename: :obj:`str`
+    :param start: span start position
+    :type start: :obj:`int`
+    :param end: span end position
+    :type end: :obj:`int`
+    :param data: new span content
+    :type data: :obj:`bytes`
+    """
+    tmpfile = "%s%s" % (filename, ".tmp")
+    with open(filename, "rb") as src, open(tmpfile, "wb") as dst:
+        size = start
+        while size > 0:
+            chunk = src.read(min(size, _CHUNK_SIZE))
+            if not chunk:
+                break
+            dst.write(chunk)
+            size -= len(chunk)
+        dst.write(data)
+        src.seek(end)
+        shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+    shutil.copymode(filename, tmpfile)
+    os.replace(tmpfile, filename)
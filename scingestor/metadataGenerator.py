@@ -0,0 +1,173 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+
+from .logger import get_logger
+
+
+class MetadataGenerator:
+
+    """ Runner of metadata generator commands which executes nxsfileinfo
+        sub-commands in the ingestor process and other commands,
+        e.g. custom generators, in the shell
+    """
+
+    #: (:obj:`list` <:obj:`str`>) nxsfileinfo sub-commands run in process
+    subcommands = ["metadata", "origdatablock", "attachment",
+                   "groupmetadata"]
+
+    #: (:obj:`str`) characters of commands which require the shell
+    shellchars = "|&;<>()$`\\\n"
+
+    def __init__(self, inprocess=False):
+        """ constructor
+
+        :param inprocess: run nxsfileinfo sub-commands in the process
+        :type inprocess: :obj:`bool`
+        """
+        #: (:obj:`bool`) run nxsfileinfo sub-commands in the process
+        self.__inprocess = inprocess
+        #: (:class:`nxstools.nxsargparser.NXSArgParser`) nxsfileinfo parser
+        self.__parser = None
+        #: (:obj:`dict` <:obj:`str`, :class:`nxstools.nxsargparser.Runner`>)
+        #:    nxsfileinfo sub-command runners
+        self.__runners = None
+        #: (:class:`threading.Lock`) nxsfileinfo runner lock
+        self.__lock = threading.Lock()
+        #: (:obj:`dict` <:obj:`str`, :obj:`int`>)
+        #:    numbers of in-process and shell commands
+        self.__metrics = {"inprocess": 0, "shell": 0}
+
+    def __load(self):
+        """ creates the nxsfileinfo parser and sub-command runners
+
+        :returns: True if nxsfileinfo can be run in the process
+        :rtype: :obj:`bool`
+        """
+        if self.__runners is None:
+            try:
+                from nxstools import nxsfileinfo
+                parser = nxsfileinfo.NXSArgParser()
+                parser.cmdrunners = [
+                    ("metadata", nxsfileinfo.Metadata),
+                    ("origdatablock", nxsfileinfo.OrigDatablock),
+                    ("attachment", nxsfileinfo.Attachment),
+                    ("groupmetadata", nxsfileinfo.GroupMetadata),
+                ]
+                self.__runners = parser.createSubParsers()
+                self.__parser = parser
+            except Exception as e:
+                get_logger().warning(
+                    'MetadataGenerator: nxsfileinfo cannot be loaded: %s'
+                    % str(e))
+                self.__inprocess = False
+                self.__runners = {}
+        return bool(self.__runners)
+
+    def arguments(self, command):
+        """ provides nxsfileinfo arguments of the command
+
+        :param command: generator command
+        :type command: :obj:`str`
+        :returns: sub-command arguments or None if the command
+                  has to be run in the shell
+        :rtype: :obj:`list` <:obj:`str`>
+        """
+        if any(ch in command for ch in self.shellchars):
+            return None
+        try:
+            args = shlex.split(command)
+        except ValueError:
+            return None
+        if len(args) < 2 or os.path.basename(args[0]) != "nxsfileinfo" \
+           or args[1] not in self.subcommands:
+            return None
+        return args[1:]
+
+    def __call(self, args, capture):
+        """ runs the nxsfileinfo sub-command in the process
+
+        :param args: sub-command arguments
+        :type args: :obj:`list` <:obj:`str`>
+        :param capture: provide the sub-command output
+        :type capture: :obj:`bool`
+        :returns: sub-command output
+        :rtype: :obj:`str`
+        """
+        output = None
+        with self.__lock:
+            options = self.__parser.parse_args(args)
+            if capture:
+                # the output goes to a file instead of the shared stdout
+                fd, output = tempfile.mkstemp(suffix=".json")
+                os.close(fd)
+                options.output = output
+            try:
+                self.__runners[options.subparser].run(options)
+                if output is not None:
+                    with open(output) as fl:
+                        return fl.read()
+            except SystemExit as e:
+                raise Exception(
+                    "nxsfileinfo %s exited with %s" % (args[0], e.code))
+            finally:
+                if output is not None and os.path.isfile(output):
+                    os.remove(output)
+
+    def run(self, command, capture=False):
+        """ runs the generator command
+
+        :param command: generator command
+        :type command: :obj:`str`
+        :param capture: provide the command output
+        :type capture: :obj:`bool`
+        :returns: command output if captured
+        :rtype: :obj:`str`
+        """
+        if self.__inprocess:
+            args = self.arguments(command)
+            if args is not None and self.__load():
+                try:
+                    result = self.__call(args, capture)
+                    self.__metrics["inprocess"] += 1
+                    return result
+                except Exception as e:
+                    # the shell command reports its own errors
+                    get_logger().warning(
+                        'MetadataGenerator: %s' % str(e))
+        self.__metrics["shell"] += 1
+        if capture:
+            result = subprocess.run(
+                command, shell=True,
+                text=True, capture_output=True, check=True)
+            return str(result.stdout)
+        subprocess.run(command, shell=True, check=True)
+
+    def metrics(self):
+        """ provides numbers of in-process and shell commands
+
+        :returns: numbers of in-process and shell commands
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`int`>
+        """
+        return dict(self.__metrics)
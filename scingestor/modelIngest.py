@@ -19,11 +19,11 @@
 #
 import sys
 import argparse
-import json
 import pathlib
-import requests
 
 from .configuration import load_config
+from .scicatClient import get_scicat_client
+from .tokenProvider import get_token_provider
 from .logger import get_logger, init_logger
 
 
@@ -97,6 +97,10 @@ class ModelIngest:
         if "scicat_url" in self.__config.keys():
             self.__scicat_url = self.__config["scicat_url"]
 
+        #: (:class:`scingestor.scicatClient.SciCatClient`)
+        #:      process-wide SciCat client with pooled connections
+        self.__client = get_scicat_client(self.__config)
+
         #: (:obj:`str`) scicat users login
         self.__scicat_users_login = "Users/login"
 
@@ -155,12 +159,11 @@ class ModelIngest:
         :returns: rewquest startus
         :rtype: :obj:`bool`
         """
-        self.__headers["Authorization"] = "Bearer {}".format(token)
         # print("ingest", self.__modelurl)
-        response = requests.post(
+        response = self.__client.post(
             self.__modelurl,
             headers=self.__headers,
-            params={"access_token": token},
+            token=token,
             data=metadata)
         if not response.ok:
             raise Exception("%s" % response.text)
@@ -173,13 +176,9 @@ class ModelIngest:
         :rtype: :obj:`str`
         """
         try:
-            response = requests.post(
-                self.__tokenurl, headers=self.__headers,
-                json={"username": self.__username, "password": self.__incd})
-            if response.ok:
-                return json.loads(response.content)["id"]
-            else:
-                raise Exception("%s" % response.text)
+            return get_token_provider(
+                self.__tokenurl, self.__username, self.__incd,
+                self.__headers, self.__config).get_token()
         except Exception as e:
             get_logger().error(
                 'ModelIngestor: %s' % (str(e)))
@@ -0,0 +1,285 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import threading
+
+from .logger import get_logger
+
+
+_STRING = {"type": "string"}
+_STRINGS = {"type": "array", "items": _STRING}
+_SIZE = {"type": "number", "minimum": 0}
+
+
+class PayloadValidator:
+
+    """ Preflight validator of SciCat payloads with compiled schemas
+        written in a subset of JSON Schema, i.e. type, required,
+        properties, items, enum, minimum and minLength
+    """
+
+    #: (:obj:`dict` <:obj:`str`, :obj:`dict` <:obj:`str`, `any`>>)
+    #:    schemas of the SciCat models posted by the ingestor
+    schemas = {
+        "dataset": {
+            "type": "object",
+            "required": ["pid", "type"],
+            "properties": {
+                "pid": {"type": "string", "minLength": 1},
+                "type": {"type": "string", "enum": ["raw", "derived"]},
+                "proposalId": _STRING,
+                "datasetName": _STRING,
+                "description": _STRING,
+                "owner": _STRING,
+                "ownerEmail": _STRING,
+                "contactEmail": _STRING,
+                "principalInvestigator": _STRING,
+                "sourceFolder": _STRING,
+                "sourceFolderHost": _STRING,
+                "creationTime": _STRING,
+                "creationLocation": _STRING,
+                "endTime": _STRING,
+                "dataFormat": _STRING,
+                "ownerGroup": _STRING,
+                "accessGroups": _STRINGS,
+                "keywords": _STRINGS,
+                "inputDatasets": _STRINGS,
+                "usedSoftware": _STRINGS,
+                "size": _SIZE,
+                "numberOfFiles": {"type": "integer", "minimum": 0},
+                "isPublished": {"type": "boolean"},
+                "scientificMetadata": {"type": "object"},
+                "techniques": {"type": "array",
+                               "items": {"type": "object"}},
+            },
+        },
+        "origdatablock": {
+            "type": "object",
+            "required": ["datasetId", "dataFileList"],
+            "properties": {
+                "datasetId": _STRING,
+                "size": _SIZE,
+                "ownerGroup": _STRING,
+                "accessGroups": _STRINGS,
+                "dataFileList": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "required": ["path", "size"],
+                        "properties": {
+                            "path": {"type": "string", "minLength": 1},
+                            "size": _SIZE,
+                            "time": _STRING,
+                            "chk": _STRING,
+                        },
+                    },
+                },
+            },
+        },
+        "attachment": {
+            "type": "object",
+            "required": ["thumbnail"],
+            "properties": {
+                "thumbnail": {"type": "string", "minLength": 1},
+                "caption": _STRING,
+                "datasetId": _STRING,
+                "ownerGroup": _STRING,
+                "accessGroups": _STRINGS,
+            },
+        },
+    }
+
+    #: (:obj:`dict` <:obj:`str`, :obj:`tuple` <:obj:`type`>>)
+    #:    python types of JSON Schema types
+    types = {
+        "string": (str,),
+        "integer": (int,),
+        "number": (int, float),
+        "boolean": (bool,),
+        "object": (dict,),
+        "array": (list,),
+        "null": (type(None),),
+    }
+
+    def __init__(self, configuration=None):
+        """ constructor
+
+        :param configuration: dictionary with the ingestor configuration
+        :type configuration: :obj:`dict` <:obj:`str`, `any`>
+        """
+        #: (:obj:`dict` <:obj:`str`, `any`>) ingestor configuration
+        self.__config = configuration or {}
+
+        schemas = dict(self.schemas)
+        if "payload_validation_schemas" in self.__config.keys() \
+           and self.__config["payload_validation_schemas"]:
+            try:
+                schemas.update(
+                    dict(self.__config["payload_validation_schemas"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:obj:`dict` <:obj:`str`, :obj:`function`>)
+        #:    compiled validators of the models
+        self.__validators = {}
+        for model, schema in schemas.items():
+            try:
+                self.__validators[model] = self.__compile(schema)
+            except Exception as e:
+                get_logger().warning(
+                    'PayloadValidator: Wrong %s schema: %s'
+                    % (model, str(e)))
+
+    def __compile(self, schema):
+        """ compiles the schema into a validation function
+
+        :param schema: schema of the value
+        :type schema: :obj:`dict` <:obj:`str`, `any`>
+        :returns: function which appends errors of the value at the path
+        :rtype: :obj:`function`
+        """
+        checks = []
+        if "type" in schema:
+            names = schema["type"]
+            if not isinstance(names, list):
+                names = [names]
+            types = tuple(tp for name in names for tp in self.types[name])
+            expected = " or ".join(names)
+
+            def check_type(value, path, errors):
+                # bool is a subclass of int but not a JSON number
+                if not isinstance(value, types) or (
+                        isinstance(value, bool) and bool not in types):
+                    errors.append("%s: %s expected, got %s" % (
+                        path, expected, type(value).__name__))
+                    return False
+                return True
+            checks.append(check_type)
+        if "enum" in schema:
+            enum = list(schema["enum"])
+
+            def check_enum(value, path, errors):
+                if value not in enum:
+                    errors.append("%s: %r is not one of %s" % (
+                        path, value, enum))
+                    return False
+                return True
+            checks.append(check_enum)
+        if "minimum" in schema:
+            minimum = schema["minimum"]
+
+            def check_minimum(value, path, errors):
+                if isinstance(value, (int, float)) and value < minimum:
+                    errors.append("%s: %s is less than %s" % (
+                        path, value, minimum))
+                    return False
+                return True
+            checks.append(check_minimum)
+        if "minLength" in schema:
+            minlength = int(schema["minLength"])
+
+            def check_length(value, path, errors):
+                if isinstance(value, str) and len(value) < minlength:
+                    errors.append("%s: %r is shorter than %s" % (
+                        path, value, minlength))
+                    return False
+                return True
+            checks.append(check_length)
+        if "required" in schema:
+            required = list(schema["required"])
+
+            def check_required(value, path, errors):
+                if isinstance(value, dict):
+                    for key in required:
+                        if key not in value:
+                            errors.append("%s: missing required %s" % (
+                                path, key))
+                return True
+            checks.append(check_required)
+        if "properties" in schema:
+            properties = dict(
+                (key, self.__compile(sch))
+                for key, sch in schema["properties"].items())
+
+            def check_properties(value, path, errors):
+                if isinstance(value, dict):
+                    for key, validate in properties.items():
+                        if key in value:
+                            validate(value[key], "%s.%s" % (path, key),
+                                     errors)
+                return True
+            checks.append(check_properties)
+        if "items" in schema:
+            items = self.__compile(schema["items"])
+
+            def check_items(value, path, errors):
+                if isinstance(value, list):
+                    for i, item in enumerate(value):
+                        items(item, "%s[%s]" % (path, i), errors)
+                return True
+            checks.append(check_items)
+
+        def validate(value, path, errors):
+            for check in checks:
+                if not check(value, path, errors):
+                    break
+        return validate
+
+    def errors(self, model, payload):
+        """ provides validation errors of the payload
+
+        :param model: SciCat model, i.e. dataset, origdatablock
+                      or attachment
+        :type model: :obj:`str`
+        :param payload: payload to be posted
+        :type payload: `any`
+        :returns: validation errors with paths of the wrong values
+        :rtype: :obj:`list` <:obj:`str`>
+        """
+        errors = []
+        if model in self.__validators:
+            self.__validators[model](payload, model, errors)
+        return errors
+
+
+#: (:obj:`list` <:obj:`str`>) configuration variables of the validator
+VALIDATOR_CONFIG_KEYS = [
+    "payload_validation_schemas",
+]
+
+#: (:obj:`dict` <:obj:`str`, :class:`PayloadValidator`>) shared validators
+_validators = {}
+#: (:class:`threading.Lock`) shared validators lock
+_validators_lock = threading.Lock()
+
+
+def get_payload_validator(configuration=None):
+    """ provides a process-wide payload validator for the given configuration
+
+    :param configuration: dictionary with the ingestor configuration
+    :type configuration: :obj:`dict` <:obj:`str`, `any`>
+    :returns: shared payload validator
+    :rtype: :class:`PayloadValidator`
+    """
+    config = configuration or {}
+    key = repr([(ky, config.get(ky)) for ky in VALIDATOR_CONFIG_KEYS])
+    with _validators_lock:
+        if key not in _validators:
+            _validators[key] = PayloadValidator(config)
+        return _validators[key]
@@ -0,0 +1,422 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import time
+import threading
+import collections
+
+from .logger import get_logger
+
+
+class RemoteStateCache:
+
+    """ Local mirror of the remote SciCat dataset state keyed by pid
+    """
+
+    #: (:obj:`list` <:obj:`str`>) cached kinds of dataset items
+    item_kinds = ["origdatablocks", "attachments"]
+
+    def __init__(self, configuration=None):
+        """ constructor
+
+        :param configuration: dictionary with the ingestor configuration
+        :type configuration: :obj:`dict` <:obj:`str`, `any`>
+        """
+        #: (:obj:`dict` <:obj:`str`, `any`>) ingestor configuration
+        self.__config = configuration or {}
+
+        #: (:obj:`float`) time in s after which cached state is revalidated
+        self.__ttl = 300.0
+        #: (:obj:`int`) number of datasets fetched by one list query
+        self.__page_size = 500
+        #: (:obj:`int`) maximal number of cached datasets
+        self.__max_size = 10000
+
+        if "remote_state_cache_ttl" in self.__config.keys():
+            try:
+                self.__ttl = float(self.__config["remote_state_cache_ttl"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "remote_state_cache_page_size" in self.__config.keys():
+            try:
+                self.__page_size = max(
+                    1, int(self.__config["remote_state_cache_page_size"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "remote_state_cache_max_size" in self.__config.keys():
+            try:
+                self.__max_size = max(
+                    1, int(self.__config["remote_state_cache_max_size"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:class:`collections.OrderedDict` <:obj:`str`, :obj:`dict`>)
+        #:    cached entries with dataset, etag, validation times
+        #:    and item digests
+        self.__entries = collections.OrderedDict()
+        #: (:obj:`dict` <:obj:`str`, (:obj:`float`,
+        #:    :obj:`dict` <:obj:`str`, :obj:`str`>)>) time of list queries
+        #:    for pid prefixes with modification times of listed pids
+        #:    or None if the listing is incomplete
+        self.__prefetched = {}
+        #: (:class:`threading.Lock`) cache lock
+        self.__lock = threading.Lock()
+
+    def page_size(self):
+        """ provides number of datasets fetched by one list query
+
+        :returns: page size
+        :rtype: :obj:`int`
+        """
+        return self.__page_size
+
+    def __fresh(self, tm):
+        """ checks if the validation time is still fresh
+
+        :param tm: validation time
+        :type tm: :obj:`float`
+        :returns: fresh flag
+        :rtype: :obj:`bool`
+        """
+        return time.time() - tm < self.__ttl
+
+    def __entry(self, pid, create=False):
+        """ provides the cache entry, called with the lock
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param create: create a new entry if it does not exist
+        :type create: :obj:`bool`
+        :returns: cache entry
+        :rtype: :obj:`dict` <:obj:`str`, `any`>
+        """
+        entry = self.__entries.get(pid)
+        if entry is None and create:
+            entry = {"dataset": None, "etag": None, "time": 0,
+                     "itemtime": 0,
+                     "origdatablocks": None, "attachments": None}
+            self.__entries[pid] = entry
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+        if entry is not None:
+            self.__entries.move_to_end(pid)
+        return entry
+
+    def exists(self, pid):
+        """ checks if the dataset is known to exist without a request.
+            Documents of existing datasets have to be revalidated
+            with a conditional request, see :meth:`etag`
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :returns: exists flag or None if it is unknown
+        :rtype: :obj:`bool`
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is not None and entry["dataset"] is not None:
+                return True
+            for prefix, (tm, listing) in self.__prefetched.items():
+                if listing is not None and pid.startswith(prefix) \
+                   and self.__fresh(tm):
+                    return pid in listing
+            if entry is not None and self.__fresh(entry["time"]):
+                return False
+        return None
+
+    def etag(self, pid):
+        """ provides the ETag and the document of the cached dataset
+            for a conditional request
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :returns: etag and the read-only dataset document
+        :rtype: (:obj:`str`, :obj:`dict` <:obj:`str`, `any`>)
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is not None and entry["dataset"] is not None:
+                return entry["etag"], entry["dataset"]
+        return None, None
+
+    def current(self, pid):
+        """ provides the cached dataset document if a fresh listing reports
+            the same modification time, i.e. without a request
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :returns: read-only dataset document or None if it has to be fetched
+        :rtype: :obj:`dict` <:obj:`str`, `any`>
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is None or entry["dataset"] is None or \
+               not entry["dataset"].get("updatedAt"):
+                return None
+            for prefix, (tm, listing) in self.__prefetched.items():
+                if listing is not None and pid.startswith(prefix) \
+                   and self.__fresh(tm):
+                    if listing.get(pid) == entry["dataset"]["updatedAt"]:
+                        return entry["dataset"]
+                    return None
+        return None
+
+    def validate(self, pid):
+        """ marks the cached dataset as validated
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is not None:
+                entry["time"] = time.time()
+
+    def set_dataset(self, pid, dataset, etag=None, created=False):
+        """ sets the dataset document fetched from the server
+            or created by the ingestor
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param dataset: dataset document or None if it does not exist
+        :type dataset: :obj:`dict` <:obj:`str`, `any`>
+        :param etag: response ETag
+        :type etag: :obj:`str`
+        :param created: dataset created by the ingestor flag
+        :type created: :obj:`bool`
+        """
+        with self.__lock:
+            entry = self.__entry(pid, True)
+            old = entry["dataset"]
+            if created or dataset is None:
+                # a new dataset has neither datablocks nor attachments
+                for kind in self.item_kinds:
+                    entry[kind] = {} if created else None
+            elif old is None or (
+                    old.get("updatedAt") and dataset.get("updatedAt")
+                    and old["updatedAt"] != dataset["updatedAt"]):
+                # the dataset was modified by someone else
+                for kind in self.item_kinds:
+                    entry[kind] = None
+            entry["dataset"] = dataset
+            entry["etag"] = etag
+            entry["time"] = time.time()
+            for prefix, (tm, listing) in self.__prefetched.items():
+                if listing is not None and pid.startswith(prefix):
+                    if dataset is None:
+                        listing.pop(pid, None)
+                    else:
+                        listing[pid] = dataset.get("updatedAt")
+
+    def update_dataset(self, pid, fields):
+        """ merges dataset fields patched by the ingestor
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param fields: patched dataset fields
+        :type fields: :obj:`dict` <:obj:`str`, `any`>
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is None or entry["dataset"] is None:
+                self.__entries.pop(pid, None)
+                return
+            dataset = dict(entry["dataset"])
+            dataset.update(fields)
+            # the server document changed so the ETag is outdated
+            entry["dataset"] = dataset
+            entry["etag"] = None
+            entry["time"] = time.time()
+
+    def invalidate(self, pid=None):
+        """ removes the given or all datasets from the cache
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        """
+        with self.__lock:
+            if pid is None:
+                self.__entries.clear()
+                self.__prefetched.clear()
+            else:
+                self.__entries.pop(pid, None)
+
+    def prefetched(self, prefix):
+        """ checks if datasets with the pid prefix were recently listed
+
+        :param prefix: pid prefix
+        :type prefix: :obj:`str`
+        :returns: prefetched flag
+        :rtype: :obj:`bool`
+        """
+        with self.__lock:
+            return prefix in self.__prefetched and \
+                self.__fresh(self.__prefetched[prefix][0])
+
+    def set_prefetched(self, prefix, datasets):
+        """ sets pids and modification times of datasets
+            listed with the pid prefix
+
+        :param prefix: pid prefix
+        :type prefix: :obj:`str`
+        :param datasets: pids and modification times of all datasets
+                         with the pid prefix or None if the list query failed
+        :type datasets: :obj:`list` <:obj:`dict` <:obj:`str`, `any`>>
+        """
+        listing = None
+        if datasets is not None and len(datasets) <= self.__max_size:
+            listing = dict(
+                (ds["pid"], ds.get("updatedAt")) for ds in datasets
+                if isinstance(ds, dict) and "pid" in ds)
+        with self.__lock:
+            for pid, updated in (listing or {}).items():
+                entry = self.__entries.get(pid)
+                if entry is not None and entry["dataset"] is not None \
+                   and updated and entry["dataset"].get("updatedAt") \
+                   and entry["dataset"]["updatedAt"] != updated:
+                    # the dataset was modified after it was cached
+                    entry["etag"] = None
+                    for kind in self.item_kinds:
+                        entry[kind] = None
+            # listings are kept apart from the entries so evicted
+            # datasets are never reported as missing
+            self.__prefetched[prefix] = (time.time(), listing)
+
+    def items(self, pid, kind):
+        """ provides ids of fresh dataset items
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :returns: item ids or None if they are unknown
+        :rtype: :obj:`list` <:obj:`str`>
+        """
+        digests = self.digests(pid, kind)
+        return list(digests.keys()) if digests is not None else None
+
+    def digests(self, pid, kind):
+        """ provides content digests of fresh dataset items
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :returns: item digests, None for unknown ones,
+                  or None if items are unknown
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`str`>
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is not None and entry[kind] is not None \
+               and self.__fresh(max(entry["time"], entry["itemtime"])):
+                return dict(entry[kind])
+        return None
+
+    def set_items(self, pid, kind, ids):
+        """ sets ids of dataset items
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :param ids: item ids or digests of item ids
+                    or None if they are unknown
+        :type ids: :obj:`list` <:obj:`str`>
+                   or :obj:`dict` <:obj:`str`, :obj:`str`>
+        """
+        with self.__lock:
+            entry = self.__entry(pid, ids is not None)
+            if entry is not None:
+                if ids is None:
+                    entry[kind] = None
+                else:
+                    if isinstance(ids, dict):
+                        entry[kind] = dict(ids)
+                    else:
+                        entry[kind] = dict.fromkeys(ids)
+                    entry["itemtime"] = time.time()
+
+    def add_item(self, pid, kind, iid, digest=None):
+        """ adds id of a dataset item created by the ingestor
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :param iid: item id or None if it is unknown
+        :type iid: :obj:`str`
+        :param digest: item content digest
+        :type digest: :obj:`str`
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is not None and entry[kind] is not None:
+                if iid is None:
+                    entry[kind] = None
+                else:
+                    entry[kind][iid] = digest
+
+    def remove_items(self, pid, kind, ids):
+        """ removes ids of dataset items deleted by the ingestor
+
+        :param pid: dataset pid
+        :type pid: :obj:`str`
+        :param kind: item kind, i.e. origdatablocks or attachments
+        :type kind: :obj:`str`
+        :param ids: item ids
+        :type ids: :obj:`list` <:obj:`str`>
+        """
+        with self.__lock:
+            entry = self.__entry(pid)
+            if entry is not None and entry[kind] is not None:
+                for iid in ids:
+                    entry[kind].pop(iid, None)
+
+
+#: (:obj:`list` <:obj:`str`>) configuration variables of the cache
+CACHE_CONFIG_KEYS = [
+    "scicat_url",
+    "remote_state_cache_ttl",
+    "remote_state_cache_page_size",
+    "remote_state_cache_max_size",
+]
+
+#: (:obj:`dict` <:obj:`str`, :class:`RemoteStateCache`>) shared caches
+_caches = {}
+#: (:class:`threading.Lock`) shared caches lock
+_caches_lock = threading.Lock()
+
+
+def get_remote_state_cache(configuration=None):
+    """ provides a process-wide remote state cache for the given configuration
+
+    :param configuration: dictionary with the ingestor configuration
+    :type configuration: :obj:`dict` <:obj:`str`, `any`>
+    :returns: shared remote state cache
+    :rtype: :class:`RemoteStateCache`
+    """
+    config = configuration or {}
+    key = repr([(ky, config.get(ky)) for ky in CACHE_CONFIG_KEYS])
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = RemoteStateCache(config)
+        return _caches[key]
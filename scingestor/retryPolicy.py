@@ -0,0 +1,260 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import time
+import random
+import threading
+import requests
+import urllib3
+
+from .logger import get_logger
+
+
+class RetryPolicy:
+
+    """ Retry policy with exponential backoff, jitter, deadline and budget
+    """
+
+    #: (:obj:`tuple` <:class:`Exception`>) transient request errors to retry
+    retry_exceptions = (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout)
+
+    def __init__(self, configuration=None):
+        """ constructor
+
+        :param configuration: dictionary with the ingestor configuration
+        :type configuration: :obj:`dict` <:obj:`str`, `any`>
+        """
+        #: (:obj:`dict` <:obj:`str`, `any`>) ingestor configuration
+        self.__config = configuration or {}
+
+        #: (:obj:`int`) maximal number of request tries
+        self.__tries = 1
+        #: (:obj:`float`) first backoff delay in s
+        self.__factor = 0.1
+        #: (:obj:`float`) maximal backoff delay in s
+        self.__maxdelay = 2.0
+        #: (:obj:`bool`) randomize backoff delays
+        self.__jitter = True
+        #: (:obj:`list` <:obj:`int`>) response status codes to retry
+        self.__status_codes = [502, 503, 504]
+        #: (:obj:`float`) total time in s for a request with its retries
+        self.__deadline = None
+        #: (:obj:`float`) retries earned by each request
+        self.__budget_ratio = 0.1
+        #: (:obj:`float`) maximal number of retries saved in the budget
+        self.__budget_max = 10.0
+
+        if "request_retry_tries_number" in self.__config.keys():
+            try:
+                self.__tries = max(
+                    1, int(self.__config["request_retry_tries_number"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_retry_backoff_factor" in self.__config.keys():
+            try:
+                self.__factor = float(
+                    self.__config["request_retry_backoff_factor"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_retry_backoff_max" in self.__config.keys():
+            try:
+                self.__maxdelay = float(
+                    self.__config["request_retry_backoff_max"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_retry_jitter" in self.__config.keys():
+            self.__jitter = bool(self.__config["request_retry_jitter"])
+
+        if "request_retry_status_codes" in self.__config.keys():
+            try:
+                # client errors are never retried
+                self.__status_codes = [
+                    int(code) for code in
+                    self.__config["request_retry_status_codes"]
+                    if not 400 <= int(code) < 500]
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_retry_deadline" in self.__config.keys():
+            try:
+                self.__deadline = float(
+                    self.__config["request_retry_deadline"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_retry_budget_ratio" in self.__config.keys():
+            try:
+                self.__budget_ratio = float(
+                    self.__config["request_retry_budget_ratio"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_retry_budget_max" in self.__config.keys():
+            try:
+                self.__budget_max = float(
+                    self.__config["request_retry_budget_max"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:obj:`float`) number of retries which can be currently spent
+        self.__budget = self.__budget_max
+        #: (:class:`threading.Lock`) budget lock
+        self.__lock = threading.Lock()
+
+    def delay(self, attempt):
+        """ provides backoff delay after the given failed attempt
+
+        :param attempt: number of failed attempts
+        :type attempt: :obj:`int`
+        :returns: delay in s
+        :rtype: :obj:`float`
+        """
+        delay = min(self.__maxdelay,
+                    self.__factor * (2 ** (max(attempt, 1) - 1)))
+        if self.__jitter:
+            delay = delay / 2. + random.uniform(0, delay / 2.)
+        return delay
+
+    def expired(self, start, delay=0):
+        """ checks if the deadline expires after the given delay
+
+        :param start: request start time
+        :type start: :obj:`float`
+        :param delay: delay in s
+        :type delay: :obj:`float`
+        :returns: deadline expired flag
+        :rtype: :obj:`bool`
+        """
+        return self.__deadline is not None and \
+            time.time() + delay - start > self.__deadline
+
+    def retryable(self, response=None, error=None, idempotent=True):
+        """ checks if the response or the error is transient
+
+        :param response: request response
+        :type response: :class:`requests.Response`
+        :param error: request error
+        :type error: :class:`Exception`
+        :param idempotent: the request can be repeated without side effects
+        :type idempotent: :obj:`bool`
+        :returns: retryable flag
+        :rtype: :obj:`bool`
+        """
+        if error is not None:
+            if not idempotent:
+                # the server may have processed the request
+                return self.connect_error(error)
+            return isinstance(error, self.retry_exceptions)
+        return idempotent and response is not None and \
+            response.status_code in self.__status_codes
+
+    def connect_error(self, error):
+        """ checks if the request failed before it was sent
+
+        :param error: request error
+        :type error: :class:`Exception`
+        :returns: connect error flag
+        :rtype: :obj:`bool`
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if not isinstance(error, requests.exceptions.ConnectionError) or \
+           isinstance(error, requests.exceptions.Timeout):
+            return False
+        reason = error.args[0] if error.args else None
+        reason = getattr(reason, "reason", reason)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    def wait(self, attempt, start, tries=None):
+        """ waits before the next try if the retry is allowed
+
+        :param attempt: number of failed attempts
+        :type attempt: :obj:`int`
+        :param start: request start time
+        :type start: :obj:`float`
+        :param tries: maximal number of tries instead of the configured one
+        :type tries: :obj:`int`
+        :returns: retry allowed flag
+        :rtype: :obj:`bool`
+        """
+        if attempt >= (self.__tries if tries is None else tries):
+            return False
+        delay = self.delay(attempt)
+        if self.expired(start, delay):
+            return False
+        with self.__lock:
+            if self.__budget < 1:
+                get_logger().debug('RetryPolicy: Retry budget exhausted')
+                return False
+            self.__budget -= 1
+        time.sleep(delay)
+        return True
+
+    def execute(self, func, name="", idempotent=True):
+        """ calls the request function with retries of transient failures
+
+        :param func: request function without arguments
+        :type func: :obj:`function`
+        :param name: request name used in logs
+        :type name: :obj:`str`
+        :param idempotent: the request can be repeated without side effects,
+                           otherwise only connect errors are retried
+        :type idempotent: :obj:`bool`
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        with self.__lock:
+            self.__budget = min(
+                self.__budget_max, self.__budget + self.__budget_ratio)
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = func()
+            except Exception as e:
+                if not self.retryable(error=e, idempotent=idempotent) or \
+                   not self.wait(attempt, start):
+                    raise
+                get_logger().debug(
+                    'RetryPolicy: Retry %s after %s' % (name, str(e)))
+                continue
+            if not self.retryable(response, idempotent=idempotent) or \
+               not self.wait(attempt, start):
+                return response
+            get_logger().debug(
+                'RetryPolicy: Retry %s after status %s'
+                % (name, response.status_code))
+
+
+#: (:obj:`list` <:obj:`str`>) configuration variables of the policy
+RETRY_CONFIG_KEYS = [
+    "request_retry_tries_number",
+    "request_retry_backoff_factor",
+    "request_retry_backoff_max",
+    "request_retry_jitter",
+    "request_retry_status_codes",
+    "request_retry_deadline",
+    "request_retry_budget_ratio",
+    "request_retry_budget_max",
+]
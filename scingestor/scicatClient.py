@@ -0,0 +1,658 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import re
+import copy
+import gzip
+import json
+import time
+import threading
+import collections
+import concurrent.futures
+import requests
+import requests.adapters
+
+from .retryPolicy import RetryPolicy, RETRY_CONFIG_KEYS
+from .concurrencyLimiter import ConcurrencyLimiter, LIMITER_CONFIG_KEYS
+from .circuitBreaker import (
+    CircuitBreaker, CircuitOpenError, BREAKER_CONFIG_KEYS)
+from .logger import get_logger
+
+
+class SciCatClient:
+
+    """ SciCat REST client with pooled keep-alive connections
+    """
+
+    def __init__(self, configuration=None, retrypolicy=None):
+        """ constructor
+
+        :param configuration: dictionary with the ingestor configuration
+        :type configuration: :obj:`dict` <:obj:`str`, `any`>
+        :param retrypolicy: retry policy, created from configuration if None
+        :type retrypolicy: :class:`scingestor.retryPolicy.RetryPolicy`
+        """
+        #: (:obj:`dict` <:obj:`str`, `any`>) ingestor configuration
+        self.__config = configuration or {}
+
+        #: (:obj:`int`) number of cached connection pools, i.e. hosts
+        self.__pool_connections = 10
+        #: (:obj:`int`) maximal number of connections kept per host
+        self.__pool_maxsize = 10
+        #: (:obj:`bool`) block when no free connection in the pool
+        self.__pool_block = False
+
+        if "request_pool_connections" in self.__config.keys():
+            try:
+                self.__pool_connections = int(
+                    self.__config["request_pool_connections"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_pool_maxsize" in self.__config.keys():
+            try:
+                self.__pool_maxsize = int(
+                    self.__config["request_pool_maxsize"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_pool_block" in self.__config.keys():
+            self.__pool_block = bool(self.__config["request_pool_block"])
+
+        #: (:obj:`bool`) compress request bodies with gzip
+        self.__compression = False
+        #: (:obj:`list` <:obj:`str`>) url patterns of endpoints accepting
+        #:    compressed request bodies or None for all endpoints
+        self.__compression_endpoints = None
+        #: (:obj:`int`) minimal size in bytes of compressed request bodies
+        self.__compression_min_size = 1024
+        #: (:obj:`int`) gzip compression level
+        self.__compression_level = 6
+
+        if "request_compression" in self.__config.keys():
+            self.__compression = bool(self.__config["request_compression"])
+
+        if "request_compression_endpoints" in self.__config.keys() \
+           and self.__config["request_compression_endpoints"] is not None:
+            try:
+                self.__compression_endpoints = [
+                    str(ep) for ep in
+                    self.__config["request_compression_endpoints"]]
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_compression_min_size" in self.__config.keys():
+            try:
+                self.__compression_min_size = int(
+                    self.__config["request_compression_min_size"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_compression_level" in self.__config.keys():
+            try:
+                self.__compression_level = int(
+                    self.__config["request_compression_level"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:obj:`set` <:obj:`str`>) endpoint patterns which rejected
+        #:    compressed request bodies
+        self.__uncompressed = set()
+
+        #: (:obj:`float`) default connect timeout in s
+        self.__connect_timeout = None
+        #: (:obj:`float`) default read timeout in s
+        self.__read_timeout = None
+        #: (:obj:`list` <(:obj:`str`, (:obj:`float`, :obj:`float`))>)
+        #:    url patterns with their connect and read timeouts
+        self.__timeouts = []
+
+        if "request_connect_timeout" in self.__config.keys():
+            try:
+                self.__connect_timeout = float(
+                    self.__config["request_connect_timeout"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_read_timeout" in self.__config.keys():
+            try:
+                self.__read_timeout = float(
+                    self.__config["request_read_timeout"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_timeouts" in self.__config.keys() \
+           and self.__config["request_timeouts"]:
+            try:
+                for ep, tms in self.__config["request_timeouts"].items():
+                    if isinstance(tms, (list, tuple)):
+                        tms = (float(tms[0]), float(tms[1]))
+                    else:
+                        tms = (float(tms), float(tms))
+                    self.__timeouts.append((str(ep), tms))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:obj:`bool`) send a second GET request when the first one
+        #:    is slower than the latency percentile
+        self.__hedging = False
+        #: (:obj:`float`) latency percentile of hedged GET requests
+        self.__hedging_percentile = 95.0
+        #: (:obj:`int`) minimal number of measured latencies for hedging
+        self.__hedging_min_samples = 20
+
+        if "request_hedging" in self.__config.keys():
+            self.__hedging = bool(self.__config["request_hedging"])
+
+        if "request_hedging_percentile" in self.__config.keys():
+            try:
+                self.__hedging_percentile = min(100.0, max(0.0, float(
+                    self.__config["request_hedging_percentile"])))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "request_hedging_min_samples" in self.__config.keys():
+            try:
+                self.__hedging_min_samples = max(1, int(
+                    self.__config["request_hedging_min_samples"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:class:`collections.deque` <:obj:`float`>)
+        #:    latencies of the last GET requests
+        self.__latencies = collections.deque(maxlen=200)
+        #: (:obj:`dict` <:obj:`str`, :obj:`int`>) request counters
+        self.__metrics = {"requests": 0, "timeouts": 0,
+                          "hedged": 0, "hedge_wins": 0}
+        #: (:class:`threading.Lock`) metrics lock
+        self.__metrics_lock = threading.Lock()
+        #: (:class:`concurrent.futures.ThreadPoolExecutor`)
+        #:    executor of hedged requests
+        self.__executor = None
+
+        #: (:class:`requests.Session`) http session shared by all threads
+        self.__session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.__pool_connections,
+            pool_maxsize=self.__pool_maxsize,
+            pool_block=self.__pool_block)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+        if self.__hedging:
+            self.__executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2 * self.__pool_maxsize)
+
+        #: (:class:`scingestor.retryPolicy.RetryPolicy`) retry policy
+        self.__retrypolicy = retrypolicy or RetryPolicy(self.__config)
+
+        #: (:class:`scingestor.concurrencyLimiter.ConcurrencyLimiter`)
+        #:    adaptive limiter of in-flight requests
+        self.__limiter = None
+        if "adaptive_concurrency" in self.__config.keys() \
+           and self.__config["adaptive_concurrency"]:
+            self.__limiter = ConcurrencyLimiter(self.__config)
+
+        #: (:class:`scingestor.circuitBreaker.CircuitBreaker`)
+        #:    circuit breaker of unavailable SciCat
+        self.__breaker = None
+        if "circuit_breaker" in self.__config.keys() \
+           and self.__config["circuit_breaker"]:
+            self.__breaker = CircuitBreaker(self.__config)
+
+        #: (:obj:`str`) limiter key of requests, e.g. beamtime id
+        self.__key = None
+        #: (:obj:`list` <:class:`scingestor.tokenProvider.TokenProvider`>)
+        #:    token providers which renew tokens rejected with 401
+        self.__tokenproviders = []
+
+        get_logger().debug(
+            'SciCatClient: pool connections: %s, pool maxsize: %s' % (
+                self.__pool_connections, self.__pool_maxsize))
+
+    def request(self, method, url, headers=None, token=None, params=None,
+                idempotent=None, **kwargs):
+        """ performs http request
+
+        :param method: http method, i.e. GET, POST, PATCH or DELETE
+        :type method: :obj:`str`
+        :param url: request url
+        :type url: :obj:`str`
+        :param headers: request headers
+        :type headers: :obj:`dict` <:obj:`str`, :obj:`str`>
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :param params: request query parameters
+        :type params: :obj:`dict` <:obj:`str`, `any`>
+        :param idempotent: the request can be repeated without side effects,
+                           e.g. a POST with the pid set by the client.
+                           If None only POST requests are not idempotent
+        :type idempotent: :obj:`bool`
+        :param kwargs: other request parameters, e.g. data or json
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        if idempotent is None:
+            idempotent = method != "POST"
+        response = self.__request(
+            method, url, headers, token, params, idempotent, **kwargs)
+        if response.status_code == 401 and token is not None:
+            newtoken = self.__renew(token)
+            if newtoken:
+                get_logger().info(
+                    'SciCatClient: Retry with a new token: %s %s'
+                    % (method, url))
+                response.close()
+                response = self.__request(
+                    method, url, headers, newtoken, params, idempotent,
+                    **kwargs)
+        return response
+
+    def __renew(self, token):
+        """ provides a new token instead of the rejected one
+
+        :param token: rejected ingestor token
+        :type token: :obj:`str`
+        :returns: new ingestor token or None if no provider issued the token
+        :rtype: :obj:`str`
+        """
+        for provider in list(self.__tokenproviders):
+            try:
+                newtoken = provider.renew(token)
+            except Exception as e:
+                get_logger().warning(
+                    'SciCatClient: Token renewal failed: %s' % str(e))
+                return None
+            if newtoken is not None:
+                return newtoken
+        return None
+
+    def add_token_provider(self, provider):
+        """ adds the token provider which renews tokens rejected with 401
+
+        :param provider: token provider
+        :type provider: :class:`scingestor.tokenProvider.TokenProvider`
+        """
+        if provider not in self.__tokenproviders:
+            self.__tokenproviders.append(provider)
+
+    def __request(self, method, url, headers, token, params, idempotent,
+                  **kwargs):
+        """ performs http request with retries
+
+        :param method: http method, i.e. GET, POST, PATCH or DELETE
+        :type method: :obj:`str`
+        :param url: request url
+        :type url: :obj:`str`
+        :param headers: request headers
+        :type headers: :obj:`dict` <:obj:`str`, :obj:`str`>
+        :param token: ingestor token
+        :type token: :obj:`str`
+        :param params: request query parameters
+        :type params: :obj:`dict` <:obj:`str`, `any`>
+        :param idempotent: the request can be repeated without side effects
+        :type idempotent: :obj:`bool`
+        :param kwargs: other request parameters, e.g. data or json
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        # headers are copied so the caller dictionary is never mutated
+        hds = dict(headers or {})
+        if token is not None:
+            hds["Authorization"] = "Bearer {}".format(token)
+            params = dict(params or {})
+            params["access_token"] = token
+        if "timeout" not in kwargs:
+            timeout = self.__timeout(url)
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+        endpoint = self.__compression_endpoint(url)
+        if endpoint is not None:
+            hds.setdefault("Accept-Encoding", "gzip, deflate")
+            body = kwargs.get("data")
+            if body is None and kwargs.get("json") is not None:
+                body = json.dumps(kwargs["json"])
+                hds.setdefault("Content-Type", "application/json")
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            if isinstance(body, bytes) \
+               and len(body) >= self.__compression_min_size:
+                zkwargs = dict(kwargs)
+                zkwargs.pop("json", None)
+                zkwargs["data"] = gzip.compress(
+                    body, compresslevel=self.__compression_level)
+                zhds = dict(hds)
+                zhds["Content-Encoding"] = "gzip"
+                response = self.__retrypolicy.execute(
+                    lambda: self.__send(
+                        method, url, headers=zhds, params=params,
+                        **zkwargs),
+                    "%s %s" % (method, url), idempotent)
+                if response.status_code != 415:
+                    return response
+                # the endpoint does not accept compressed bodies
+                self.__uncompressed.add(endpoint)
+                get_logger().info(
+                    'SciCatClient: Request compression disabled for %s'
+                    % (endpoint or url))
+        if method == "GET" and self.__executor is not None:
+            return self.__retrypolicy.execute(
+                lambda: self.__hedged(
+                    method, url, headers=hds, params=params, **kwargs),
+                "%s %s" % (method, url), idempotent)
+        return self.__retrypolicy.execute(
+            lambda: self.__send(
+                method, url, headers=hds, params=params, **kwargs),
+            "%s %s" % (method, url), idempotent)
+
+    def __timeout(self, url):
+        """ provides connect and read timeouts of the endpoint
+
+        :param url: request url
+        :type url: :obj:`str`
+        :returns: connect and read timeouts or None without timeouts
+        :rtype: (:obj:`float`, :obj:`float`)
+        """
+        for ep, tms in self.__timeouts:
+            if re.search(ep, url):
+                return tms
+        if self.__connect_timeout is None and self.__read_timeout is None:
+            return None
+        return (self.__connect_timeout, self.__read_timeout)
+
+    def hedging_delay(self):
+        """ provides the latency percentile after which
+            a hedged GET request is sent
+
+        :returns: delay in s or None if there are too few latencies
+        :rtype: :obj:`float`
+        """
+        with self.__metrics_lock:
+            latencies = sorted(self.__latencies)
+        if len(latencies) < self.__hedging_min_samples:
+            return None
+        index = int(round(
+            self.__hedging_percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[index]
+
+    def __hedged(self, method, url, **kwargs):
+        """ sends an idempotent request and, if it is slower than
+            the latency percentile, its hedged copy. The hedged request
+            takes its own slot of the concurrency limiter so it is sent
+            only if a slot is free
+
+        :param method: http method, i.e. GET
+        :type method: :obj:`str`
+        :param url: request url
+        :type url: :obj:`str`
+        :param kwargs: request parameters
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: the first successful response
+        :rtype: :class:`requests.Response`
+        """
+        delay = self.hedging_delay()
+        if delay is None:
+            return self.__send(method, url, **kwargs)
+        first = self.__executor.submit(self.__send, method, url, **kwargs)
+        done, _ = concurrent.futures.wait([first], timeout=delay)
+        if done:
+            return first.result()
+        if self.__limiter is not None and \
+           self.__limiter.inflight() >= self.__limiter.limit():
+            return first.result()
+        get_logger().debug(
+            'SciCatClient: Hedged request after %.3f s: %s %s'
+            % (delay, method, url))
+        second = self.__executor.submit(self.__send, method, url, **kwargs)
+        with self.__metrics_lock:
+            self.__metrics["hedged"] += 1
+        futures = [first, second]
+        done, _ = concurrent.futures.wait(
+            futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None:
+            # the other request may still succeed
+            other = second if winner is first else first
+            if other.exception() is None:
+                winner = other
+        other = second if winner is first else first
+        other.add_done_callback(self.__discard)
+        if winner is second and winner.exception() is None:
+            with self.__metrics_lock:
+                self.__metrics["hedge_wins"] += 1
+        return winner.result()
+
+    def __discard(self, future):
+        """ closes the response of the request which lost the race
+
+        :param future: request future
+        :type future: :class:`concurrent.futures.Future`
+        """
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def metrics(self):
+        """ provides counters of sent, timed out and hedged requests
+
+        :returns: request counters
+        :rtype: :obj:`dict` <:obj:`str`, :obj:`int`>
+        """
+        with self.__metrics_lock:
+            return dict(self.__metrics)
+
+    def __compression_endpoint(self, url):
+        """ provides the endpoint pattern for compressed request bodies
+
+        :param url: request url
+        :type url: :obj:`str`
+        :returns: endpoint pattern, empty string for all endpoints
+                  or None if the body is not compressed
+        :rtype: :obj:`str`
+        """
+        if not self.__compression:
+            return None
+        endpoint = ""
+        if self.__compression_endpoints is not None:
+            endpoint = None
+            for ep in self.__compression_endpoints:
+                if re.search(ep, url):
+                    endpoint = ep
+                    break
+        if endpoint is None or endpoint in self.__uncompressed:
+            return None
+        return endpoint
+
+    def __send(self, method, url, **kwargs):
+        """ sends one http request through the circuit breaker
+            within the concurrency limit
+
+        :param method: http method, i.e. GET, POST, PATCH or DELETE
+        :type method: :obj:`str`
+        :param url: request url
+        :type url: :obj:`str`
+        :param kwargs: request parameters
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        if hasattr(kwargs.get("data"), "seek"):
+            # file bodies are sent from the start on each try
+            kwargs["data"].seek(0)
+        if self.__breaker is not None and not self.__breaker.allow():
+            raise CircuitOpenError(
+                "SciCat circuit breaker is open: %s %s" % (method, url))
+        start = None
+        if self.__limiter is not None:
+            start = self.__limiter.acquire(self.__key)
+        with self.__metrics_lock:
+            self.__metrics["requests"] += 1
+        sent = time.time()
+        try:
+            response = self.__session.request(method, url, **kwargs)
+        except Exception as e:
+            if isinstance(e, requests.exceptions.Timeout):
+                with self.__metrics_lock:
+                    self.__metrics["timeouts"] += 1
+            if self.__limiter is not None:
+                self.__limiter.release(
+                    start, self.__key,
+                    timeout=isinstance(e, requests.exceptions.Timeout))
+            if self.__breaker is not None:
+                self.__breaker.record(error=True)
+            raise
+        if method == "GET" and response.ok:
+            with self.__metrics_lock:
+                self.__latencies.append(time.time() - sent)
+        if self.__limiter is not None:
+            self.__limiter.release(start, self.__key, response.status_code)
+        if self.__breaker is not None:
+            self.__breaker.record(response.status_code)
+        return response
+
+    def keyed(self, key):
+        """ provides the client sharing connections and limits
+            which counts its requests in the given limiter share
+
+        :param key: limiter key of requests, e.g. beamtime id
+        :type key: :obj:`str`
+        :returns: keyed SciCat client
+        :rtype: :class:`SciCatClient`
+        """
+        client = copy.copy(self)
+        client.__key = key
+        return client
+
+    def limiter(self):
+        """ provides concurrency limiter of the client
+
+        :returns: concurrency limiter or None if it is disabled
+        :rtype: :class:`scingestor.concurrencyLimiter.ConcurrencyLimiter`
+        """
+        return self.__limiter
+
+    def breaker(self):
+        """ provides circuit breaker of the client
+
+        :returns: circuit breaker or None if it is disabled
+        :rtype: :class:`scingestor.circuitBreaker.CircuitBreaker`
+        """
+        return self.__breaker
+
+    def retry_policy(self):
+        """ provides retry policy of the client
+
+        :returns: retry policy
+        :rtype: :class:`scingestor.retryPolicy.RetryPolicy`
+        """
+        return self.__retrypolicy
+
+    def get(self, url, **kwargs):
+        """ performs http GET request
+
+        :param url: request url
+        :type url: :obj:`str`
+        :param kwargs: request parameters
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """ performs http POST request
+
+        :param url: request url
+        :type url: :obj:`str`
+        :param kwargs: request parameters
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        """ performs http PATCH request
+
+        :param url: request url
+        :type url: :obj:`str`
+        :param kwargs: request parameters
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        """ performs http DELETE request
+
+        :param url: request url
+        :type url: :obj:`str`
+        :param kwargs: request parameters
+        :type kwargs: :obj:`dict` <:obj:`str`, `any`>
+        :returns: request response
+        :rtype: :class:`requests.Response`
+        """
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        """ closes pooled connections
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+        self.__session.close()
+
+
+#: (:obj:`list` <:obj:`str`>) configuration variables of the client
+CLIENT_CONFIG_KEYS = [
+    "request_pool_connections",
+    "request_pool_maxsize",
+    "request_pool_block",
+    "request_compression",
+    "request_compression_endpoints",
+    "request_compression_min_size",
+    "request_compression_level",
+    "request_connect_timeout",
+    "request_read_timeout",
+    "request_timeouts",
+    "request_hedging",
+    "request_hedging_percentile",
+    "request_hedging_min_samples",
+] + RETRY_CONFIG_KEYS + LIMITER_CONFIG_KEYS + BREAKER_CONFIG_KEYS
+
+#: (:obj:`dict` <:obj:`str`, :class:`SciCatClient`>) shared clients
+_clients = {}
+#: (:class:`threading.Lock`) shared clients lock
+_clients_lock = threading.Lock()
+
+
+def get_scicat_client(configuration=None):
+    """ provides a process-wide SciCat client for the given configuration
+
+    :param configuration: dictionary with the ingestor configuration
+    :type configuration: :obj:`dict` <:obj:`str`, `any`>
+    :returns: shared SciCat client
+    :rtype: :class:`SciCatClient`
+    """
+    config = configuration or {}
+    key = repr([(ky, config.get(ky)) for ky in CLIENT_CONFIG_KEYS])
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = SciCatClient(config)
+        return _clients[key]
@@ -0,0 +1,303 @@
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#
+import json
+import time
+import collections
+import threading
+import requests
+
+from .scicatClient import get_scicat_client
+from .logger import get_logger
+
+
+class TokenProvider:
+
+    """ Ingestor token provider with expiry-aware caching
+    """
+
+    #: (:obj:`list` <:obj:`int`>) login response codes to retry
+    retry_status_codes = [502, 503, 504]
+
+    def __init__(self, tokenurl, username, password,
+                 headers=None, configuration=None):
+        """ constructor
+
+        :param tokenurl: scicat users login url
+        :type tokenurl: :obj:`str`
+        :param username: ingestor username
+        :type username: :obj:`str`
+        :param password: ingestor credential
+        :type password: :obj:`str`
+        :param headers: request headers
+        :type headers: :obj:`dict` <:obj:`str`, :obj:`str`>
+        :param configuration: dictionary with the ingestor configuration
+        :type configuration: :obj:`dict` <:obj:`str`, `any`>
+        """
+        #: (:obj:`dict` <:obj:`str`, `any`>) ingestor configuration
+        self.__config = configuration or {}
+        #: (:obj:`str`) token url
+        self.__tokenurl = tokenurl
+        #: (:obj:`str`) username
+        self.__username = username
+        #: (:obj:`str`) ingestor credential
+        self.__incd = password
+        #: (:obj:`dict` <:obj:`str`, :obj:`str`>) request headers
+        self.__headers = dict(headers or {})
+
+        #: (:obj:`float`) token time-to-live in s overriding the server one
+        self.__ttl = None
+        #: (:obj:`float`) time in s before expiry to refresh the token
+        self.__margin = 60.0
+        #: (:obj:`bool`) refresh the token in background
+        self.__background = True
+        #: (:obj:`int`) maximal number of login tries
+        self.__tries = 3
+        #: (:obj:`float`) first login retry delay in s
+        self.__delay = 1.0
+
+        if "token_ttl" in self.__config.keys():
+            try:
+                self.__ttl = float(self.__config["token_ttl"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "token_refresh_margin" in self.__config.keys():
+            try:
+                self.__margin = float(self.__config["token_refresh_margin"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "token_background_refresh" in self.__config.keys():
+            self.__background = bool(
+                self.__config["token_background_refresh"])
+
+        if "login_tries_number" in self.__config.keys():
+            try:
+                self.__tries = max(
+                    1, int(self.__config["login_tries_number"]))
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        if "login_retry_delay" in self.__config.keys():
+            try:
+                self.__delay = float(self.__config["login_retry_delay"])
+            except Exception as e:
+                get_logger().warning('%s' % (str(e)))
+
+        #: (:obj:`str`) cached token
+        self.__token = ""
+        #: (:obj:`float`) time until the cached token can be used
+        self.__valid_until = 0
+        #: (:obj:`float`) time of the cached token expiry
+        self.__expires = 0
+        #: (:class:`threading.Lock`) token lock
+        self.__lock = threading.Lock()
+        #: (:class:`threading.Timer`) background refresh timer
+        self.__timer = None
+        #: (:class:`collections.deque` <:obj:`str`>) last issued tokens
+        self.__issued = collections.deque(maxlen=8)
+
+        #: (:class:`scingestor.scicatClient.SciCatClient`) SciCat client
+        self.__client = get_scicat_client(self.__config)
+        self.__client.add_token_provider(self)
+
+    def get_token(self):
+        """ provides ingestor token, from the cache if it is still valid
+
+        :returns: ingestor token
+        :rtype: :obj:`str`
+        """
+        with self.__lock:
+            if self.__token and time.time() < self.__valid_until:
+                return self.__token
+            return self._refresh()
+
+    def invalidate(self, token=None):
+        """ removes the given or any token from the cache
+
+        :param token: token to invalidate
+        :type token: :obj:`str`
+        """
+        with self.__lock:
+            if token is None or token == self.__token:
+                self.__token = ""
+                self.__valid_until = 0
+                self.__expires = 0
+
+    def renew(self, token):
+        """ logs in again if the issued token was rejected
+
+        :param token: rejected token
+        :type token: :obj:`str`
+        :returns: new token, the token issued after the rejected one
+                  or None if the rejected token was not issued by the provider
+        :rtype: :obj:`str`
+        """
+        with self.__lock:
+            if token not in self.__issued:
+                return None
+            if token != self.__issued[-1]:
+                # another thread has already logged in again
+                return self.__issued[-1]
+            self.__token = ""
+            self.__valid_until = 0
+            self.__expires = 0
+            get_logger().debug('TokenProvider: Token rejected, login again')
+            return self._refresh()
+
+    def stop(self):
+        """ stops background refreshing
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+
+    def _refresh(self):
+        """ logs in and updates the cached token, called with the lock
+
+        :returns: ingestor token
+        :rtype: :obj:`str`
+        """
+        start = time.time()
+        response = self._login()
+        token = response["id"]
+        if token in self.__issued:
+            self.__issued.remove(token)
+        self.__issued.append(token)
+        ttl = self.__ttl
+        if ttl is None:
+            ttl = response.get("expires_in", response.get("ttl", None))
+        try:
+            ttl = float(ttl or 0)
+        except Exception:
+            ttl = 0
+        if ttl > 0:
+            margin = min(self.__margin, ttl / 4.)
+            self.__token = token
+            self.__expires = start + ttl
+            self.__valid_until = self.__expires - margin
+            self._schedule(self.__expires - 2 * margin - time.time())
+        else:
+            # the token expiry is unknown so it cannot be cached
+            self.__token = ""
+            self.__valid_until = 0
+            self.__expires = 0
+        return token
+
+    def _login(self):
+        """ logs in with retries for transient errors
+
+        :returns: login response
+        :rtype: :obj:`dict` <:obj:`str`, `any`>
+        """
+        error = None
+        for counter in range(self.__tries):
+            if counter:
+                time.sleep(self.__delay * (2 ** (counter - 1)))
+                get_logger().debug(
+                    'TokenProvider: Retry login: %s' % self.__tokenurl)
+            try:
+                response = self.__client.post(
+                    self.__tokenurl, headers=self.__headers,
+                    json={"username": self.__username,
+                          "password": self.__incd},
+                    idempotent=True)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                error = e
+                continue
+            if response.ok:
+                return json.loads(response.content)
+            error = Exception("%s" % response.text)
+            if response.status_code not in self.retry_status_codes:
+                break
+        raise error
+
+    def _schedule(self, delay):
+        """ schedules background token refresh, called with the lock
+
+        :param delay: delay in s
+        :type delay: :obj:`float`
+        """
+        if not self.__background:
+            return
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.__timer = threading.Timer(max(delay, 0), self._background)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def _background(self):
+        """ refreshes the token in background
+        """
+        with self.__lock:
+            self.__timer = None
+            try:
+                self._refresh()
+                get_logger().debug('TokenProvider: Token refreshed')
+            except Exception as e:
+                get_logger().warning(
+                    'TokenProvider: Token refresh failed: %s' % str(e))
+                remaining = self.__valid_until - time.time()
+                if remaining > 0:
+                    self._schedule(min(self.__delay, remaining / 2.))
+
+
+#: (:obj:`list` <:obj:`str`>) configuration variables of the provider
+TOKEN_CONFIG_KEYS = [
+    "token_ttl",
+    "token_refresh_margin",
+    "token_background_refresh",
+    "login_tries_number",
+    "login_retry_delay",
+]
+
+#: (:obj:`dict` <:obj:`str`, :class:`TokenProvider`>) shared providers
+_providers = {}
+#: (:class:`threading.Lock`) shared providers lock
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(tokenurl, username, password,
+                       headers=None, configuration=None):
+    """ provides a process-wide token provider for the given credentials
+
+    :param tokenurl: scicat users login url
+    :type tokenurl: :obj:`str`
+    :param username: ingestor username
+    :type username: :obj:`str`
+    :param password: ingestor credential
+    :type password: :obj:`str`
+    :param headers: request headers
+    :type headers: :obj:`dict` <:obj:`str`, :obj:`str`>
+    :param configuration: dictionary with the ingestor configuration
+    :type configuration: :obj:`dict` <:obj:`str`, `any`>
+    :returns: shared token provider
+    :rtype: :class:`TokenProvider`
+    """
+    config = configuration or {}
+    key = repr([tokenurl, username, password, sorted((headers or {}).items())]
+               + [(ky, config.get(ky)) for ky in TOKEN_CONFIG_KEYS])
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = TokenProvider(
+                tokenurl, username, password, headers, config)
+        return _providers[key]
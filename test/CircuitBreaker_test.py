@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import threading
+import time
+
+from scingestor import circuitBreaker
+from scingestor import scicatClient
+from scingestor.logger import init_logger, get_logger
+
+try:
+    from .SciCatTestServer import SciCatTestServer, SciCatMockHandler
+except Exception:
+    from SciCatTestServer import SciCatTestServer, SciCatMockHandler
+
+
+# test fixture
+class CircuitBreakerTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        self.url = 'http://localhost:8881'
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json'}
+        if get_logger() is None:
+            init_logger("CircuitBreakerTest", "error")
+
+    def starthttpserver(self):
+        self.__server = SciCatTestServer(('', 8881), SciCatMockHandler)
+
+        self.__thread = threading.Thread(None, self.__server.run)
+        self.__thread.start()
+
+    def stophttpserver(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+        self.__server = None
+
+    def test_open(self):
+        breaker = circuitBreaker.CircuitBreaker(
+            {"circuit_breaker_failures_number": 3,
+             "circuit_breaker_reset_time": 60})
+        self.assertTrue(breaker.closed())
+        breaker.record(503)
+        breaker.record(error=True)
+        # client errors do not mean unavailable server
+        breaker.record(404)
+        breaker.record(500)
+        breaker.record(502)
+        self.assertTrue(breaker.closed())
+        breaker.record(504)
+        self.assertFalse(breaker.closed())
+        self.assertFalse(breaker.allow())
+
+    def test_probe(self):
+        breaker = circuitBreaker.CircuitBreaker(
+            {"circuit_breaker_failures_number": 1,
+             "circuit_breaker_reset_time": 0.1})
+        breaker.record(503)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.15)
+        # a single probe request
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(error=True)
+        self.assertFalse(breaker.closed())
+        self.assertFalse(breaker.allow())
+        time.sleep(0.15)
+        self.assertTrue(breaker.allow())
+        breaker.record(200)
+        self.assertTrue(breaker.closed())
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_client(self):
+        self.starthttpserver()
+        try:
+            client = scicatClient.SciCatClient(
+                {"circuit_breaker": True,
+                 "circuit_breaker_failures_number": 2,
+                 "circuit_breaker_reset_time": 60})
+            self.__server.error_requests = [1, 2, 3]
+            self.__server.error_status = 503
+            url = self.url + "/Datasets/99001234%2Fmyscan_00001"
+            for _ in range(2):
+                res = client.get(url, headers=self.headers, token="12345")
+                self.assertEqual(res.status_code, 503)
+            self.assertFalse(client.breaker().closed())
+            with self.assertRaises(circuitBreaker.CircuitOpenError):
+                client.get(url, headers=self.headers, token="12345")
+            self.assertEqual(self.__server.counter, 2)
+
+            self.assertEqual(
+                scicatClient.SciCatClient({}).breaker(), None)
+        finally:
+            self.stophttpserver()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import threading
+import time
+
+from scingestor import concurrencyLimiter
+from scingestor import scicatClient
+from scingestor.logger import init_logger, get_logger
+
+try:
+    from .SciCatTestServer import SciCatTestServer, SciCatMockHandler
+except Exception:
+    from SciCatTestServer import SciCatTestServer, SciCatMockHandler
+
+
+# test fixture
+class ConcurrencyLimiterTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        self.url = 'http://localhost:8881'
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json'}
+        if get_logger() is None:
+            init_logger("ConcurrencyLimiterTest", "error")
+
+    def starthttpserver(self):
+        self.__server = SciCatTestServer(('', 8881), SciCatMockHandler)
+
+        self.__thread = threading.Thread(None, self.__server.run)
+        self.__thread.start()
+
+    def stophttpserver(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+        self.__server = None
+
+    def acquired(self, limiter, key=None):
+        """ acquires the slot in a thread and checks if it does not wait
+        """
+        event = threading.Event()
+        starts = []
+
+        def acquire():
+            starts.append(limiter.acquire(key))
+            event.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        done = event.wait(0.2)
+        return done, thread, starts
+
+    def test_increase(self):
+        limiter = concurrencyLimiter.ConcurrencyLimiter(
+            {"adaptive_concurrency_initial": 2,
+             "adaptive_concurrency_max": 4})
+        self.assertEqual(limiter.limit(), 2)
+        for _ in range(3):
+            limiter.release(limiter.acquire(), status=200)
+        self.assertEqual(limiter.limit(), 3)
+        for _ in range(20):
+            limiter.release(limiter.acquire(), status=201)
+        self.assertEqual(limiter.limit(), 4)
+        self.assertEqual(limiter.inflight(), 0)
+
+    def test_decrease(self):
+        limiter = concurrencyLimiter.ConcurrencyLimiter(
+            {"adaptive_concurrency_initial": 16,
+             "adaptive_concurrency_min": 1})
+        start1 = limiter.acquire()
+        start2 = limiter.acquire()
+        time.sleep(0.01)
+        limiter.release(start1, status=503)
+        self.assertEqual(limiter.limit(), 8)
+        # the request started before the decrease
+        limiter.release(start2, status=500)
+        self.assertEqual(limiter.limit(), 8)
+        time.sleep(0.01)
+        limiter.release(limiter.acquire(), status=429)
+        self.assertEqual(limiter.limit(), 4)
+        time.sleep(0.01)
+        limiter.release(limiter.acquire(), timeout=True)
+        self.assertEqual(limiter.limit(), 2)
+        time.sleep(0.01)
+        # client and other server errors do not mean overload
+        for status in [404, 500, 502]:
+            limit = limiter.limit()
+            limiter.release(limiter.acquire(), status=status)
+            self.assertTrue(limiter.limit() >= limit)
+        time.sleep(0.01)
+        # slow responses, e.g. large uploads, do not mean overload
+        limit = limiter.limit()
+        limiter.release(limiter.acquire() - 10, status=200)
+        self.assertTrue(limiter.limit() >= limit)
+        self.assertEqual(limiter.inflight(), 0)
+
+    def test_blocking(self):
+        limiter = concurrencyLimiter.ConcurrencyLimiter(
+            {"adaptive_concurrency_initial": 1,
+             "adaptive_concurrency_max": 1})
+        start = limiter.acquire()
+        done, thread, starts = self.acquired(limiter)
+        self.assertFalse(done)
+        self.assertEqual(limiter.inflight(), 1)
+        limiter.release(start, status=200)
+        thread.join()
+        self.assertEqual(len(starts), 1)
+        self.assertEqual(limiter.inflight(), 1)
+        limiter.release(starts[0], status=200)
+        self.assertEqual(limiter.inflight(), 0)
+
+    def test_beamtime_share(self):
+        limiter = concurrencyLimiter.ConcurrencyLimiter(
+            {"adaptive_concurrency_initial": 4,
+             "adaptive_concurrency_max": 4,
+             "adaptive_concurrency_beamtime_share": 0.5})
+        starts = [limiter.acquire("99001234"), limiter.acquire("99001234")]
+        done, thread, tstarts = self.acquired(limiter, "99001234")
+        self.assertFalse(done)
+        self.assertEqual(limiter.inflight("99001234"), 2)
+        # other beamtimes are not blocked
+        starts.append(limiter.acquire("99005678"))
+        self.assertEqual(limiter.inflight("99005678"), 1)
+        self.assertEqual(limiter.inflight(), 3)
+        limiter.release(starts[0], "99001234", 200)
+        thread.join()
+        self.assertEqual(limiter.inflight("99001234"), 2)
+        limiter.release(starts[1], "99001234", 200)
+        limiter.release(tstarts[0], "99001234", 200)
+        limiter.release(starts[2], "99005678", 200)
+        self.assertEqual(limiter.inflight(), 0)
+        self.assertEqual(limiter.inflight("99001234"), 0)
+
+    def test_client(self):
+        self.starthttpserver()
+        try:
+            client = scicatClient.SciCatClient(
+                {"adaptive_concurrency": True,
+                 "adaptive_concurrency_initial": 8})
+            self.assertEqual(client.limiter().limit(), 8)
+            keyed = client.keyed("99001234")
+            self.assertTrue(keyed.limiter() is client.limiter())
+            self.__server.error_requests = [1]
+            self.__server.error_status = 503
+            res = keyed.get(
+                self.url + "/Datasets/99001234%2Fmyscan_00001",
+                headers=self.headers, token="12345")
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(client.limiter().limit(), 4)
+            self.assertEqual(client.limiter().inflight("99001234"), 0)
+            self.assertEqual(client.limiter().inflight(), 0)
+
+            self.assertEqual(
+                scicatClient.SciCatClient({}).limiter(), None)
+        finally:
+            self.stophttpserver()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,1323 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+
+from scingestor.datasetIngestor import DatasetIngestor
+from scingestor.ingestionPipeline import IngestionPipeline
+from scingestor.remoteStateCache import get_remote_state_cache
+from scingestor.logger import init_logger, get_logger
+
+try:
+    from .SciCatTestServer import SciCatTestServer, SciCatMockHandler
+except Exception:
+    from SciCatTestServer import SciCatTestServer, SciCatMockHandler
+
+
+# test fixture
+class DatasetIngestorTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        self.url = 'http://localhost:8881'
+        self.token = "12342345"
+        self.meta = {
+            "beamtimeId": "99001234",
+            "proposalId": "99991173",
+            "beamline": "p00",
+            "ownerGroup": "99001234-dmgt",
+            "accessGroups": ["99001234-clbt", "99001234-dmgt"],
+        }
+        if get_logger() is None:
+            init_logger("DatasetIngestorTest", "error")
+
+    def setUp(self):
+        self.__dir = tempfile.mkdtemp()
+        self.starthttpserver()
+
+    def starthttpserver(self):
+        self.__server = SciCatTestServer(('', 8881), SciCatMockHandler)
+
+        self.__thread = threading.Thread(None, self.__server.run)
+        self.__thread.start()
+
+    def stophttpserver(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+        self.__server = None
+
+    def tearDown(self):
+        self.stophttpserver()
+        shutil.rmtree(self.__dir)
+
+    def writejson(self, name, value):
+        filename = os.path.join(self.__dir, name)
+        with open(filename, "w") as fl:
+            fl.write(json.dumps(value))
+        return filename
+
+    def createscan(self, scan, ndbs=1, nads=1, name=None):
+        """ creates scan metadata files with ndbs datablocks
+            and nads attachments
+        """
+        pid = "99001234/%s" % scan
+        self.writejson("%s.scan.json" % scan, {
+            "pid": pid,
+            "type": "raw",
+            "proposalId": "99991173.99001234",
+            "datasetName": scan,
+            "scientificMetadata": {"name": name or scan},
+        })
+        dbs = [self.writejson("%s_%s.db.json" % (scan, i), {
+            "datasetId": pid,
+            "size": 1,
+            "dataFileList": [{"path": "%s_%05d.nxs" % (scan, i), "size": 1}],
+        }) for i in range(ndbs)]
+        ads = [self.writejson("%s_%s.ad.json" % (scan, i), {
+            "thumbnail": "data:image/png;base64,%s" % i,
+            "caption": "",
+        }) for i in range(nads)]
+        self.writejson("%s.origdatablock.json" % scan, dbs)
+        self.writejson("%s.attachment.json" % scan, ads)
+        return pid
+
+    def createingestor(self, config=None):
+        cfg = {"scicat_url": self.url}
+        cfg.update(config or {})
+        bfile = self.writejson("beamtime-metadata-99001234.json", self.meta)
+        return DatasetIngestor(
+            cfg, self.__dir,
+            os.path.join(self.__dir, "scicat-datasets-99001234.lst"),
+            os.path.join(self.__dir, "scicat-ingested-datasets-99001234.lst"),
+            dict(self.meta), bfile)
+
+    def ingested(self):
+        with open(os.path.join(
+                self.__dir, "scicat-ingested-datasets-99001234.lst")) as fl:
+            return [line.split() for line in fl.read().splitlines()]
+
+    def cachedingestor(self, config=None):
+        cfg = {"remote_state_cache": True}
+        cfg.update(config or {})
+        ingestor = self.createingestor(cfg)
+        cfg["scicat_url"] = self.url
+        get_remote_state_cache(cfg).invalidate()
+        return ingestor
+
+    def test_concurrent_subrequests(self):
+        ingestor = self.createingestor({"max_request_workers": 4})
+        pid = self.createscan("myscan_00001", ndbs=6, nads=3)
+        ingestor.ingest("myscan_00001", self.token)
+
+        self.assertEqual(len(self.__server.datasets), 1)
+        self.assertEqual(len(self.__server.origdatablocks), 6)
+        self.assertEqual(len(self.__server.attachments), 3)
+        paths = sorted(json.loads(db)["dataFileList"][0]["path"]
+                       for db in self.__server.origdatablocks)
+        self.assertEqual(
+            paths, ["myscan_00001_%05d.nxs" % i for i in range(6)])
+        for apid, _ in self.__server.attachments:
+            self.assertEqual(apid, pid)
+        lst = self.ingested()
+        self.assertEqual(len(lst), 1)
+        self.assertEqual(lst[0][0], "myscan_00001")
+        self.assertTrue(float(lst[0][2]) > 0)
+        self.assertTrue(float(lst[0][3]) > 0)
+
+    def test_concurrent_subrequests_error(self):
+        ingestor = self.createingestor({"max_request_workers": 4})
+        self.createscan("myscan_00002", ndbs=4, nads=1)
+        # request 1: dataset check, 2: dataset post, 3-6: datablock posts
+        self.__server.error_requests = [4]
+        ingestor.ingest("myscan_00002", self.token)
+
+        self.assertEqual(len(self.__server.datasets), 1)
+        self.assertEqual(len(self.__server.origdatablocks), 3)
+        self.assertEqual(len(self.__server.attachments), 1)
+        lst = self.ingested()
+        self.assertEqual(lst[0][2], "-1")
+        self.assertTrue(float(lst[0][3]) > 0)
+
+    def test_concurrent_deletes(self):
+        ingestor = self.createingestor({"max_request_workers": 3})
+        pid = self.createscan("myscan_00003", ndbs=5, nads=4)
+        ingestor.ingest("myscan_00003", self.token)
+        self.assertEqual(len(self.__server.origdatablocks), 5)
+        self.assertEqual(len(self.__server.attachments), 4)
+
+        self.assertEqual(len(self.__server.id_origdatablock), 5)
+        counter = self.__server.counter
+
+        ingestor._delete_origdatablocks(pid, self.token)
+        self.assertEqual(len(self.__server.id_origdatablock), 0)
+        # 1 GET and 5 DELETE requests
+        self.assertEqual(self.__server.counter, counter + 6)
+        ingestor._delete_attachments(pid, self.token)
+        # 1 GET and 4 DELETE requests
+        self.assertEqual(self.__server.counter, counter + 11)
+
+    def test_dataset_check_client_error(self):
+        ingestor = self.createingestor(
+            {"request_retry_tries_number": 5,
+             "request_retry_backoff_factor": 0.01})
+        self.__server.error_requests = [1, 2, 3]
+        self.__server.error_status = 403
+        with self.assertRaises(Exception):
+            ingestor._check_dataset("99001234/myscan_00001", self.token)
+        # client errors are not retried
+        self.assertEqual(self.__server.counter, 1)
+        self.__server.error_status = 503
+        self.assertEqual(
+            ingestor._check_dataset("99001234/myscan_00001", self.token),
+            (False, None))
+        self.assertEqual(self.__server.counter, 4)
+
+    def test_state_cache_own_writes(self):
+        self.__server.dataset_filters = True
+        ingestor = self.cachedingestor()
+        scans = ["myscan_%05d" % i for i in range(1, 4)]
+        for scan in scans:
+            self.createscan(scan)
+            ingestor.ingest(scan, self.token)
+        # 1 list query and dataset, datablock and attachment posts
+        self.assertEqual(self.__server.counter, 10)
+        self.assertEqual(len(self.__server.dataset_queries), 1)
+        self.assertEqual(len(self.__server.datasets), 3)
+
+        for scan in scans:
+            self.createscan(scan, name="new_%s" % scan)
+            ingestor.ingest(scan, self.token)
+        # dataset revalidations and patches, datablock and attachment posts
+        self.assertEqual(self.__server.counter, 22)
+        for scan in scans:
+            ds = json.loads(self.__server.pid_dataset["99001234/%s" % scan])
+            self.assertEqual(ds["scientificMetadata"]["name"],
+                             "new_%s" % scan)
+
+        pid = "99001234/%s" % scans[0]
+        self.assertEqual(len(self.__server.id_origdatablock), 6)
+        ingestor._delete_origdatablocks(pid, self.token)
+        # only 2 deletes of the cached datablocks
+        self.assertEqual(self.__server.counter, 24)
+        self.assertEqual(len(self.__server.id_origdatablock), 4)
+        ingestor._delete_origdatablocks(pid, self.token)
+        self.assertEqual(self.__server.counter, 24)
+
+    def test_state_cache_eviction(self):
+        self.__server.dataset_filters = True
+        ingestor = self.cachedingestor({"remote_state_cache_max_size": 1})
+        scans = ["myscan_%05d" % i for i in range(1, 4)]
+        for scan in scans:
+            self.createscan(scan)
+            ingestor.ingest(scan, self.token)
+        self.assertEqual(len(self.__server.dataset_queries), 1)
+        # only pids and modification times are listed
+        self.assertEqual(
+            self.__server.dataset_queries[0]["fields"],
+            ["pid", "updatedAt"])
+        cache = get_remote_state_cache(
+            {"scicat_url": self.url, "remote_state_cache": True,
+             "remote_state_cache_max_size": 1})
+        # evicted datasets are not reported as missing
+        for scan in scans:
+            self.assertTrue(cache.exists("99001234/%s" % scan))
+        self.assertFalse(cache.exists("99001234/myscan_00004"))
+        counter = self.__server.counter
+        self.createscan(scans[0], name="new_name")
+        ingestor.ingest(scans[0], self.token)
+        # dataset GET and patch, datablock and attachment posts
+        self.assertEqual(self.__server.counter, counter + 4)
+        self.assertEqual(len(self.__server.pid_dataset), 3)
+        ds = json.loads(self.__server.pid_dataset["99001234/%s" % scans[0]])
+        self.assertEqual(ds["scientificMetadata"]["name"], "new_name")
+
+    def test_state_cache_prefetch(self):
+        self.__server.dataset_filters = True
+        ingestor = self.createingestor()
+        scans = ["myscan_%05d" % i for i in range(1, 6)]
+        for scan in scans:
+            self.createscan(scan)
+            ingestor.ingest(scan, self.token)
+        counter = self.__server.counter
+
+        ingestor = self.cachedingestor({"remote_state_cache_page_size": 2})
+        for scan in scans:
+            ingestor.ingest(scan, self.token)
+        # 3 list queries, dataset revalidations and attachment posts
+        # of unchanged datasets
+        self.assertEqual(self.__server.counter, counter + 13)
+        self.assertEqual(
+            [(qr["limit"], qr["skip"])
+             for qr in self.__server.dataset_queries],
+            [(2, 0), (2, 2), (2, 4)])
+        self.assertEqual(len(self.__server.datasets), 5)
+
+    def test_state_cache_sweep(self):
+        self.__server.dataset_filters = True
+        self.__server.updated_times = True
+        ingestor = self.createingestor()
+        scans = ["myscan_%05d" % i for i in range(1, 4)]
+        for scan in scans:
+            self.createscan(scan)
+            ingestor.ingest(scan, self.token)
+
+        ingestor = self.cachedingestor()
+        gets = []
+        for _ in range(3):
+            ngets = self.__server.dataset_gets
+            for scan in scans:
+                ingestor.ingest(scan, self.token)
+            gets.append(self.__server.dataset_gets - ngets)
+        # only the first sweep fetches the listed datasets
+        self.assertEqual(gets, [3, 0, 0])
+        self.assertEqual(len(self.__server.dataset_queries), 1)
+
+        # a dataset modified by someone else is fetched again
+        pid = "99001234/%s" % scans[1]
+        ds = json.loads(self.__server.pid_dataset[pid])
+        self.__server.set_updated_time(ds)
+        self.__server.pid_dataset[pid] = json.dumps(ds)
+        ingestor._prefetch_datasets("99001234/", self.token)
+        ngets = self.__server.dataset_gets
+        for scan in scans:
+            ingestor.ingest(scan, self.token)
+        self.assertEqual(self.__server.dataset_gets - ngets, 1)
+        self.assertEqual(len(self.__server.datasets), 3)
+
+    def test_state_cache_etag(self):
+        self.__server.dataset_etags = True
+        ingestor = self.createingestor()
+        self.createscan("myscan_00001")
+        ingestor.ingest("myscan_00001", self.token)
+        counter = self.__server.counter
+
+        ingestor = self.cachedingestor({"remote_state_cache_ttl": 0})
+        ingestor.ingest("myscan_00001", self.token)
+        # failed list query, dataset GET and attachment post
+        self.assertEqual(self.__server.counter, counter + 3)
+        self.assertEqual(self.__server.not_modified, 0)
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(self.__server.counter, counter + 6)
+        self.assertEqual(self.__server.not_modified, 1)
+        self.assertEqual(len(self.__server.datasets), 1)
+
+    def test_pid_version_query(self):
+        self.__server.dataset_filters = True
+        ingestor = self.createingestor(
+            {"dataset_update_strategy": "create", "pid_version_query": True})
+        self.createscan("myscan_00001")
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(self.__server.counter, 4)
+        for i in range(2, 6):
+            self.createscan("myscan_00001", name="name_%s" % i)
+            ingestor.ingest("myscan_00001", self.token)
+            # dataset check and find, version query, dataset post,
+            # datablock and attachment posts and a probe of the version
+            # found by the first query without results
+            self.assertEqual(self.__server.counter, 5 + (i - 1) * 6)
+            self.assertEqual(len(self.__server.dataset_queries), i - 1)
+        self.assertEqual(
+            sorted(self.__server.pid_dataset.keys()),
+            ["99001234/myscan_00001"] +
+            ["99001234/myscan_00001/%s" % i for i in range(2, 6)])
+        ds = json.loads(
+            self.__server.pid_dataset["99001234/myscan_00001/5"])
+        self.assertEqual(ds["scientificMetadata"]["name"], "name_5")
+
+    def test_pid_version_query_fallback(self):
+        ingestor = self.createingestor(
+            {"dataset_update_strategy": "create", "pid_version_query": True})
+        self.createscan("myscan_00001")
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(self.__server.counter, 4)
+        for i in range(2, 6):
+            self.createscan("myscan_00001", name="name_%s" % i)
+            ingestor.ingest("myscan_00001", self.token)
+            # dataset check and find, failed version query, one probe
+            # after the last posted version, dataset post,
+            # datablock and attachment posts
+            self.assertEqual(self.__server.counter, 4 + (i - 1) * 7)
+        self.assertEqual(
+            sorted(self.__server.pid_dataset.keys()),
+            ["99001234/myscan_00001"] +
+            ["99001234/myscan_00001/%s" % i for i in range(2, 6)])
+
+    def test_attachment_digests(self):
+        ingestor = self.cachedingestor()
+        pid = self.createscan("myscan_00001", nads=3)
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(len(self.__server.id_attachment), 3)
+        tads = [os.path.join(self.__dir, "myscan_00001_%s.ad.json" % i)
+                for i in range(3)]
+        self.writejson("myscan_00001_2.ad.json", {
+            "thumbnail": "data:image/png;base64,new",
+            "caption": "",
+        })
+        counter = self.__server.counter
+        ingestor._update_attachments(tads, pid, self.token)
+        # a post of the changed attachment and a delete of the old one
+        self.assertEqual(self.__server.counter, counter + 2)
+        self.assertEqual(len(self.__server.attachments), 4)
+        self.assertEqual(
+            json.loads(self.__server.attachments[-1][1])["thumbnail"],
+            "data:image/png;base64,new")
+
+        ingestor._update_attachments(tads, pid, self.token)
+        self.assertEqual(self.__server.counter, counter + 2)
+
+        # cold cache
+        get_remote_state_cache(
+            {"scicat_url": self.url, "remote_state_cache": True}
+        ).invalidate()
+        ingestor._update_attachments(tads, pid, self.token)
+        # a GET of attachments and a repeated delete
+        # since the mock server keeps deleted attachments
+        self.assertEqual(self.__server.counter, counter + 4)
+        ingestor._update_attachments(tads, pid, self.token)
+        self.assertEqual(self.__server.counter, counter + 4)
+        self.assertEqual(len(self.__server.attachments), 4)
+
+    def test_bulk_delete(self):
+        self.__server.bulk_deletes = True
+        ingestor = self.createingestor({"bulk_delete": True})
+        pid = self.createscan("myscan_00001", ndbs=5, nads=3)
+        ingestor.ingest("myscan_00001", self.token)
+        self.createscan("myscan_00002", ndbs=2, nads=1)
+        ingestor.ingest("myscan_00002", self.token)
+        self.assertEqual(len(self.__server.id_origdatablock), 7)
+        self.assertEqual(len(self.__server.id_attachment), 4)
+        counter = self.__server.counter
+
+        statuses = ingestor._delete_origdatablocks(pid, self.token)
+        # a GET of datablocks and one bulk delete
+        self.assertEqual(self.__server.counter, counter + 2)
+        self.assertEqual(len(statuses), 5)
+        self.assertTrue(all(statuses.values()))
+        self.assertEqual(len(self.__server.id_origdatablock), 2)
+
+        statuses = ingestor._delete_attachments(pid, self.token)
+        self.assertEqual(self.__server.counter, counter + 4)
+        self.assertEqual(len(statuses), 3)
+        self.assertTrue(all(statuses.values()))
+        self.assertEqual(len(self.__server.id_attachment), 1)
+
+        statuses = ingestor._delete_origdatablocks(pid, self.token)
+        self.assertEqual(self.__server.counter, counter + 5)
+        self.assertEqual(statuses, {})
+
+    def test_bulk_delete_unsupported(self):
+        ingestor = self.createingestor(
+            {"bulk_delete": True, "max_request_workers": 3})
+        pid = self.createscan("myscan_00001", ndbs=5, nads=1)
+        ingestor.ingest("myscan_00001", self.token)
+        self.createscan("myscan_00002", ndbs=4, nads=1)
+        ingestor.ingest("myscan_00002", self.token)
+        counter = self.__server.counter
+
+        self.__server.error_requests = [counter + 4]
+        statuses = ingestor._delete_origdatablocks(pid, self.token)
+        # a GET, a failed bulk delete and parallel deletes
+        self.assertEqual(self.__server.counter, counter + 7)
+        self.assertEqual(len(statuses), 5)
+        self.assertEqual(sorted(statuses.values()), [False] + [True] * 4)
+        self.assertEqual(len(self.__server.id_origdatablock), 5)
+
+        counter = self.__server.counter
+        statuses = ingestor._delete_origdatablocks(
+            "99001234/myscan_00002", self.token)
+        # the bulk delete is not tried any more
+        self.assertEqual(self.__server.counter, counter + 5)
+        self.assertEqual(list(statuses.values()), [True] * 4)
+        self.assertEqual(len(self.__server.id_origdatablock), 1)
+
+    def test_circuit_breaker_spool(self):
+        config = {"circuit_breaker": True,
+                  "circuit_breaker_failures_number": 1,
+                  "circuit_breaker_reset_time": 0.1,
+                  "spool_drain_rate": 0}
+        ingestor = self.createingestor(config)
+        for i in range(1, 4):
+            self.createscan("myscan_%05d" % i)
+        with open(os.path.join(
+                self.__dir, "scicat-datasets-99001234.lst"), "w") as fl:
+            fl.write("myscan_00001\nmyscan_00002\nmyscan_00003\n")
+        spoolfile = os.path.join(
+            self.__dir, "scicat-ingested-datasets-99001234.lst.spool")
+
+        self.__server.error_requests = [1]
+        self.__server.error_status = 503
+        for i in range(1, 4):
+            ingestor.ingest("myscan_%05d" % i, self.token)
+        # requests are not attempted after the first failure
+        self.assertEqual(self.__server.counter, 1)
+        self.assertEqual(
+            ingestor.spooled_datasets(), ["myscan_00002", "myscan_00003"])
+        self.assertEqual([sc[0] for sc in self.ingested()],
+                         ["myscan_00001"])
+        self.assertTrue(os.path.isfile(spoolfile))
+
+        # the spool survives the ingestor restart
+        ingestor = self.createingestor(config)
+        self.assertEqual(
+            ingestor.spooled_datasets(), ["myscan_00002", "myscan_00003"])
+        ingestor.check_list()
+        self.assertTrue("myscan_00002" not in ingestor.waiting_datasets())
+        self.assertTrue("myscan_00003" not in ingestor.waiting_datasets())
+
+        # the spool is not drained before the reset time
+        ingestor.drain_spool(self.token)
+        self.assertEqual(self.__server.counter, 1)
+        self.assertEqual(len(ingestor.spooled_datasets()), 2)
+
+        time.sleep(0.15)
+        ingestor.drain_spool(self.token)
+        self.assertEqual(ingestor.spooled_datasets(), [])
+        self.assertFalse(os.path.isfile(spoolfile))
+        self.assertEqual(
+            list(self.__server.pid_dataset.keys()),
+            ["99001234/myscan_00002", "99001234/myscan_00003"])
+        ingested = self.ingested()
+        self.assertEqual([sc[0] for sc in ingested],
+                         ["myscan_00001", "myscan_00002", "myscan_00003"])
+        for sc in ingested[1:]:
+            self.assertTrue(float(sc[1]) > 0)
+            self.assertTrue(float(sc[2]) > 0)
+
+    def test_request_compression(self):
+        self.__server.compressed_bodies = True
+        ingestor = self.createingestor(
+            {"request_compression": True,
+             "request_compression_min_size": 10})
+        pid = self.createscan("myscan_00001", ndbs=2, nads=1)
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertTrue(pid in self.__server.pid_dataset)
+        self.assertEqual(len(self.__server.id_origdatablock), 2)
+        self.assertEqual(len(self.__server.id_attachment), 1)
+        self.assertEqual(
+            sorted(set(req[:2] for req in self.__server.compressed_requests
+                       if "Attachments" not in req[1])),
+            [("POST", "/Datasets"), ("POST", "/OrigDatablocks")])
+        self.assertEqual(
+            [float(tm) > 0 for tm in self.ingested()[0][1:]],
+            [True, True, True])
+
+    def test_streaming_upload(self):
+        ingestor = self.cachedingestor({"streaming_upload_min_size": 0})
+        pid = self.createscan("myscan_00001", ndbs=2, nads=1)
+        dbfile = os.path.join(self.__dir, "myscan_00001_0.db.json")
+        with open(dbfile) as fl:
+            dbcontent = fl.read()
+        mtime = os.path.getmtime(dbfile)
+        # datasetId after the file list with other formatting
+        odbfile = os.path.join(self.__dir, "myscan_00001_1.db.json")
+        with open(odbfile, "w") as fl:
+            fl.write('{\n "dataFileList": [{"path": "a.nxs", "size": 1}],'
+                     '\n "size": 1,\n "datasetId" : "99001234/other"\n}')
+        adfile = os.path.join(self.__dir, "myscan_00001_0.ad.json")
+        ingestor.ingest("myscan_00001", self.token)
+
+        # unchanged files are not rewritten
+        with open(dbfile) as fl:
+            self.assertEqual(fl.read(), dbcontent)
+        self.assertEqual(os.path.getmtime(dbfile), mtime)
+        with open(odbfile) as fl:
+            self.assertEqual(
+                fl.read(),
+                '{\n "dataFileList": [{"path": "a.nxs", "size": 1}],'
+                '\n "size": 1,\n "datasetId" : "99001234/myscan_00001"\n}')
+        with open(adfile) as fl:
+            attachment = json.loads(fl.read())
+        self.assertEqual(attachment["datasetId"], pid)
+        self.assertEqual(attachment["thumbnail"], "data:image/png;base64,0")
+
+        odbs = [json.loads(odb) for odb in self.__server.origdatablocks]
+        self.assertEqual([odb["datasetId"] for odb in odbs], [pid, pid])
+        self.assertEqual(
+            [odb["dataFileList"][0]["path"] for odb in odbs],
+            ["myscan_00001_00000.nxs", "a.nxs"])
+        self.assertEqual(
+            [json.loads(ad[1]) for ad in self.__server.attachments],
+            [attachment])
+        self.assertEqual(
+            [float(tm) > 0 for tm in self.ingested()[0][1:]],
+            [True, True, True])
+        # the cached thumbnail digest matches the in-memory one
+        self.assertEqual(
+            list(get_remote_state_cache(
+                {"scicat_url": self.url, "remote_state_cache": True,
+                 "streaming_upload_min_size": 0}).digests(
+                     pid, "attachments").values()),
+            [ingestor._thumbnail_digest(attachment)])
+
+    def test_patch_minimal_diff(self):
+        ingestor = self.createingestor({"patch_minimal_diff": True})
+        pid = self.createscan("myscan_00001")
+        ingestor.ingest("myscan_00001", self.token)
+        self.createscan("myscan_00001", name="new_name")
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(len(self.__server.datasets), 2)
+        self.assertEqual(
+            self.__server.partial_patches,
+            [{"scientificMetadata": {"name": "new_name"}}])
+        ds = json.loads(self.__server.pid_dataset[pid])
+        self.assertEqual(ds["pid"], pid)
+        self.assertEqual(ds["datasetName"], "myscan_00001")
+        self.assertEqual(ds["scientificMetadata"], {"name": "new_name"})
+
+    def test_patch_metadata_merge(self):
+        self.__server.metadata_merge = True
+        ingestor = self.createingestor(
+            {"patch_minimal_diff": True, "patch_metadata_merge": True})
+        pid = self.createscan("myscan_00001")
+        scan = {
+            "pid": pid, "type": "raw",
+            "proposalId": "99991173.99001234",
+            "datasetName": "myscan_00001",
+            "scientificMetadata": {
+                "name": "myscan_00001", "old": 1,
+                "data": {"values": list(range(1000))}},
+        }
+        self.writejson("myscan_00001.scan.json", scan)
+        ingestor.ingest("myscan_00001", self.token)
+        scan["datasetName"] = "new_scan"
+        scan["scientificMetadata"]["name"] = "new_name"
+        scan["scientificMetadata"].pop("old")
+        self.writejson("myscan_00001.scan.json", scan)
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(
+            self.__server.partial_patches,
+            [{"datasetName": "new_scan",
+              "scientificMetadata": {"name": "new_name", "old": None}}])
+        ds = json.loads(self.__server.pid_dataset[pid])
+        self.assertEqual(ds, scan)
+
+    def test_metadata_digests(self):
+        ingestor = self.createingestor({"metadata_digests": True})
+        calls = []
+        metadataEqual = ingestor._metadataEqual
+
+        def counted(*args, **kwargs):
+            calls.append(args)
+            return metadataEqual(*args, **kwargs)
+
+        ingestor._metadataEqual = counted
+        digestfile = os.path.join(
+            self.__dir, "scicat-ingested-datasets-99001234.lst.digests")
+        pid = self.createscan("myscan_00001")
+        ingestor.ingest("myscan_00001", self.token)
+        with open(digestfile) as fl:
+            lines = [line.split() for line in fl.read().splitlines()]
+        self.assertEqual([line[0] for line in lines], [pid])
+
+        # fields without checks added by the server
+        ds = json.loads(self.__server.pid_dataset[pid])
+        ds["createdAt"] = "2022-05-14T12:00:00.000Z"
+        self.__server.pid_dataset[pid] = json.dumps(ds)
+        self.createscan("myscan_00001")
+        counter = self.__server.counter
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(calls, [])
+        self.assertEqual(len(self.__server.datasets), 1)
+        # the dataset check and find and the attachment post
+        self.assertEqual(self.__server.counter, counter + 3)
+
+        # a dataset removed on the server is created again
+        self.__server.pid_dataset.pop(pid)
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertTrue(pid in self.__server.pid_dataset)
+        self.assertEqual(len(self.__server.datasets), 2)
+
+        self.createscan("myscan_00001", name="new_name")
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertTrue(len(calls) > 0)
+        self.assertEqual(len(self.__server.datasets), 3)
+        with open(digestfile) as fl:
+            lines = [line.split() for line in fl.read().splitlines()]
+        self.assertEqual([line[0] for line in lines], [pid, pid])
+        self.assertNotEqual(lines[0][1], lines[1][1])
+
+        mdct = {"pid": pid, "createdAt": "a",
+                "scientificMetadata": {"name": "a", "skip": {"a": 1}}}
+        digest = ingestor._metadata_digest(
+            mdct, ["createdAt", "scientificMetadata.skip.a"])
+        self.assertEqual(
+            mdct["scientificMetadata"], {"name": "a", "skip": {"a": 1}})
+        self.assertEqual(
+            digest,
+            ingestor._metadata_digest(
+                {"scientificMetadata": {"skip": {}, "name": "a"},
+                 "pid": pid}))
+        self.assertTrue(ingestor._metadata_equal(
+            mdct, {"pid": pid, "createdAt": "b",
+                   "scientificMetadata": {"name": "a", "skip": {"a": 2}}},
+            ["createdAt", "scientificMetadata.skip.a"]))
+
+    def test_optimistic_create(self):
+        self.__server.dataset_conflicts = True
+        ingestor = self.createingestor({"optimistic_create": ["patch"]})
+        checks = []
+        check_dataset = ingestor._check_dataset
+
+        def counted(*args, **kwargs):
+            checks.append(args[0])
+            return check_dataset(*args, **kwargs)
+
+        ingestor._check_dataset = counted
+        pid = self.createscan("myscan_00001")
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(checks, [])
+        self.assertTrue(pid in self.__server.pid_dataset)
+        self.assertEqual(
+            ingestor.optimistic_metrics(),
+            {"posts": 1, "created": 1, "conflicts": 0})
+
+        self.createscan("myscan_00001", name="new_name")
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(checks, [pid])
+        self.assertEqual(len(self.__server.datasets), 2)
+        ds = json.loads(self.__server.pid_dataset[pid])
+        self.assertEqual(ds["scientificMetadata"], {"name": "new_name"})
+        self.assertEqual(
+            ingestor.optimistic_metrics(),
+            {"posts": 2, "created": 1, "conflicts": 1})
+        self.assertEqual(
+            [float(tm) > 0 for tm in self.ingested()[0][1:]],
+            [True, True, True])
+
+        # re-ingestion checks if the dataset exists first
+        self.createscan("myscan_00001", name="other_name")
+        ingestor.reingest("myscan_00001:1", self.token, notmp=True)
+        self.assertEqual(checks, [pid, pid])
+        self.assertEqual(ingestor.optimistic_metrics()["posts"], 2)
+        ds = json.loads(self.__server.pid_dataset[pid])
+        self.assertEqual(ds["scientificMetadata"], {"name": "other_name"})
+        ingestor.log_metrics()
+
+        # other strategies check if datasets exist first
+        ingestor = self.createingestor(
+            {"optimistic_create": ["patch"],
+             "dataset_update_strategy": "create"})
+        self.createscan("myscan_00002")
+        ingestor.ingest("myscan_00002", self.token)
+        self.assertEqual(
+            ingestor.optimistic_metrics(),
+            {"posts": 0, "created": 0, "conflicts": 0})
+
+    def test_batch_existence_lookup(self):
+        scans = ["myscan_%05d" % i for i in range(1, 4)]
+        counters = []
+        for config in [{}, {"batch_existence_lookup": True,
+                            "batch_existence_lookup_size": 2}]:
+            self.__server.reset()
+            self.__server.dataset_filters = True
+            idsfile = os.path.join(
+                self.__dir, "scicat-ingested-datasets-99001234.lst")
+            if os.path.isfile(idsfile):
+                os.remove(idsfile)
+            pids = [self.createscan(scan) for scan in scans]
+            # the first dataset exists with other metadata
+            self.__server.pid_dataset[pids[0]] = json.dumps(
+                {"pid": pids[0], "type": "raw", "datasetName": "old"})
+            with open(os.path.join(
+                    self.__dir, "scicat-datasets-99001234.lst"), "w") as fl:
+                fl.write("\n".join(scans + ["__command__ stop"]) + "\n")
+            ingestor = self.createingestor(config)
+            ingestor.check_list()
+            ingestor.lookup_waiting_datasets(self.token)
+            for scan in ingestor.waiting_datasets():
+                if not scan.startswith("__command__ "):
+                    ingestor.ingest(scan, self.token)
+            ingestor.clear_waiting_datasets()
+            counters.append(self.__server.counter)
+            self.assertEqual(sorted(self.__server.pid_dataset), pids)
+            self.assertEqual(
+                json.loads(self.__server.pid_dataset[pids[0]])["datasetName"],
+                scans[0])
+            self.assertEqual([sc[0] for sc in self.ingested()], scans)
+
+        self.assertEqual(
+            self.__server.dataset_queries,
+            [{"where": {"pid": {"inq": pids[:2]}}, "limit": 2},
+             {"where": {"pid": {"inq": pids[2:]}}, "limit": 1}])
+        # three existence and one dataset requests replaced by two queries
+        self.assertEqual(counters[1], counters[0] - 2)
+
+    def test_payload_validation(self):
+        ingestor = self.createingestor({"payload_validation": True})
+        quarantinefile = os.path.join(
+            self.__dir, "scicat-ingested-datasets-99001234.lst.quarantine")
+        dbfile = os.path.join(self.__dir, "myscan_00002_0.db.json")
+        for i in range(1, 3):
+            self.createscan("myscan_%05d" % i)
+        self.writejson("myscan_00002_0.db.json", {
+            "datasetId": "99001234/myscan_00002",
+            "dataFileList": [{"path": "myscan_00002_00000.nxs"}]})
+        with open(os.path.join(
+                self.__dir, "scicat-datasets-99001234.lst"), "w") as fl:
+            fl.write("myscan_00001\nmyscan_00002\n")
+        ingestor.check_list()
+        for scan in ingestor.waiting_datasets():
+            ingestor.ingest(scan, self.token)
+        ingestor.clear_waiting_datasets()
+        # the invalid scan is not posted
+        self.assertEqual(self.__server.counter, 4)
+        self.assertEqual(
+            list(self.__server.pid_dataset), ["99001234/myscan_00001"])
+        self.assertEqual(
+            ingestor.quarantined_datasets(), ["myscan_00002"])
+        with open(quarantinefile) as fl:
+            self.assertEqual(
+                json.loads(fl.read()),
+                {"scan": "myscan_00002", "file": dbfile,
+                 "errors": ["origdatablock.dataFileList[0]: "
+                            "missing required size"]})
+        self.assertEqual([sc[0] for sc in self.ingested()],
+                         ["myscan_00001"])
+
+        # quarantined scans are not retried
+        ingestor.check_list()
+        self.assertEqual(ingestor.waiting_datasets(), [])
+
+        # until they are removed from the quarantine
+        self.createscan("myscan_00002")
+        os.remove(quarantinefile)
+        ingestor.check_list()
+        self.assertEqual(ingestor.waiting_datasets(), ["myscan_00002"])
+        ingestor.ingest("myscan_00002", self.token)
+        self.assertEqual(ingestor.quarantined_datasets(), [])
+        self.assertTrue("99001234/myscan_00002" in self.__server.pid_dataset)
+
+    def test_origdatablock_chunks(self):
+        ingestor = self.createingestor({"origdatablock_chunk_files": 4})
+        chunkfile = os.path.join(
+            self.__dir, "scicat-ingested-datasets-99001234.lst.chunks")
+        pid = "99001234/myscan_00001"
+        files = [{"path": "myscan_00001_%05d.nxs" % i, "size": i}
+                 for i in range(10)]
+        dbfile = self.writejson("myscan_00001_0.db.json", {
+            "datasetId": pid, "size": 45, "dataFileList": files})
+
+        # the second chunk fails
+        self.__server.error_requests = [2]
+        self.__server.error_status = 400
+        self.assertEqual(
+            ingestor._ingest_origdatablock_metadata(
+                dbfile, pid, self.token), "")
+        odbs = [json.loads(odb) for odb in self.__server.origdatablocks]
+        self.assertEqual(
+            [odb["dataFileList"] for odb in odbs], [files[:4], files[8:]])
+        self.assertEqual([odb["size"] for odb in odbs], [6, 17])
+        with open(chunkfile) as fl:
+            self.assertEqual(
+                [line.split()[0] for line in fl.read().splitlines()],
+                [pid, pid])
+
+        # only the failed chunk is posted again
+        self.assertEqual(
+            ingestor._ingest_origdatablock_metadata(
+                dbfile, pid, self.token), pid)
+        odbs = [json.loads(odb) for odb in self.__server.origdatablocks]
+        self.assertEqual(
+            [odb["dataFileList"] for odb in odbs],
+            [files[:4], files[8:], files[4:8]])
+        self.assertEqual(odbs[2]["size"], 22)
+        self.assertEqual(odbs[2]["datasetId"], pid)
+        self.assertTrue(not os.path.exists(chunkfile))
+
+        ingestor = self.createingestor({"origdatablock_chunk_size": 150})
+        blocks = ingestor._chunks({"dataFileList": files})
+        self.assertEqual(
+            [len(block["dataFileList"]) for block in blocks], [3, 3, 3, 1])
+        self.assertTrue(all(
+            len(json.dumps(block["dataFileList"])) <= 150
+            for block in blocks))
+        self.assertEqual(
+            ingestor._chunks({"dataFileList": files[:2]}),
+            [{"dataFileList": files[:2]}])
+
+        # files without sizes are counted once in the first chunk
+        nfiles = [dict(entry) for entry in files]
+        for entry in nfiles[::3]:
+            entry.pop("size")
+        blocks = ingestor._chunks({"size": 100, "dataFileList": nfiles})
+        self.assertEqual(
+            [block["size"] for block in blocks], [3 + 73, 9, 15, 0])
+        self.assertEqual(sum(block["size"] for block in blocks), 100)
+
+    def test_reingest_coalescing(self):
+        entries = ["myscan_00001:1", "__command__ stop", "myscan_00002",
+                   "myscan_00001:2", "myscan_00002:3", "myscan_00001:2"]
+        posted = []
+        for config in [{}, {"reingest_coalescing": True}]:
+            self.__server.reset()
+            idsfile = os.path.join(
+                self.__dir, "scicat-ingested-datasets-99001234.lst")
+            if os.path.isfile(idsfile):
+                os.remove(idsfile)
+            self.createscan("myscan_00001")
+            self.createscan("myscan_00002")
+            with open(os.path.join(
+                    self.__dir, "scicat-datasets-99001234.lst"), "w") as fl:
+                fl.write("\n".join(entries) + "\n")
+            ingestor = self.createingestor(config)
+            ingestor.check_list()
+            for scan in ingestor.waiting_datasets():
+                if not scan.startswith("__command__ "):
+                    ingestor.reingest(scan, self.token, notmp=True)
+            ingestor.clear_waiting_datasets()
+            posted.append(len(self.__server.origdatablocks))
+            ingested = self.ingested()
+            self.assertEqual(
+                sorted(sc[0] for sc in ingested),
+                sorted(sc for sc in entries if not sc.startswith("__")))
+            ingestor.check_list()
+            self.assertEqual(
+                ingestor.waiting_datasets(), ["__command__ stop"])
+
+        # entries are coalesced with the last entry of the same scan
+        # before the next command
+        self.assertEqual(
+            [sc[0] for sc in ingested],
+            ["myscan_00001:1", "myscan_00002", "myscan_00002:3",
+             "myscan_00001:2", "myscan_00001:2"])
+        self.assertEqual(len(set(tuple(sc[1:]) for sc in ingested[3:])), 1)
+        # plain scan entries are not coalesced
+        self.assertEqual(posted, [5, 4])
+
+    def test_incremental_origdatablocks(self):
+        posted = []
+        for config in [{}, {"incremental_origdatablocks": True}]:
+            self.__server.reset()
+            idsfile = os.path.join(
+                self.__dir, "scicat-ingested-datasets-99001234.lst")
+            if os.path.isfile(idsfile):
+                os.remove(idsfile)
+            ingestor = self.createingestor(config)
+            pid = self.createscan("myscan_00001", ndbs=3, nads=0)
+            ingestor.ingest("myscan_00001", self.token)
+            self.assertEqual(len(self.__server.id_origdatablock), 3)
+            first = dict((json.loads(odb)["dataFileList"][0]["path"], iid)
+                         for iid, odb in
+                         self.__server.id_origdatablock.items())
+
+            # one file grows, one vanishes and one new file lands
+            self.createscan("myscan_00001", ndbs=4, nads=0)
+            self.writejson("myscan_00001_1.db.json", {
+                "datasetId": pid, "size": 5,
+                "dataFileList": [{"path": "myscan_00001_00001.nxs",
+                                  "size": 5}]})
+            self.writejson("myscan_00001.origdatablock.json", [
+                os.path.join(self.__dir, "myscan_00001_%s.db.json" % i)
+                for i in [0, 1, 3]])
+            nposted = len(self.__server.origdatablocks)
+            ingestor.reingest("myscan_00001:1", self.token, notmp=True)
+            posted.append(len(self.__server.origdatablocks) - nposted)
+
+            files = dict((entry["path"], entry["size"])
+                         for odb in self.__server.id_origdatablock.values()
+                         for entry in json.loads(odb)["dataFileList"])
+            self.assertEqual(files, {"myscan_00001_00000.nxs": 1,
+                                     "myscan_00001_00001.nxs": 5,
+                                     "myscan_00001_00003.nxs": 1})
+            last = dict((json.loads(odb)["dataFileList"][0]["path"], iid)
+                        for iid, odb in
+                        self.__server.id_origdatablock.items())
+            self.assertEqual(
+                first["myscan_00001_00000.nxs"] ==
+                last["myscan_00001_00000.nxs"],
+                bool(config))
+            self.assertEqual(self.ingested()[-1][0], "myscan_00001:1")
+            self.assertTrue(float(self.ingested()[-1][2]) > 0)
+
+        # only the changed and new files are posted again
+        self.assertEqual(posted, [3, 2])
+
+    def test_incremental_origdatablocks_split(self):
+        ingestor = self.createingestor({"incremental_origdatablocks": True})
+        pid = self.createscan("myscan_00001", ndbs=0, nads=0)
+        entries = [{"path": "myscan_00001_%05d.nxs" % i, "size": 1}
+                   for i in range(5)]
+        self.writejson("myscan_00001.origdatablock.json", [
+            self.writejson("myscan_00001_0.db.json", {
+                "datasetId": pid, "size": 5, "dataFileList": entries})])
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(len(self.__server.id_origdatablock), 1)
+        iid = list(self.__server.id_origdatablock.keys())[0]
+
+        # one file grows and one vanishes
+        entries[1] = {"path": "myscan_00001_00001.nxs", "size": 3}
+        entries.pop(3)
+        self.writejson("myscan_00001_0.db.json", {
+            "datasetId": pid, "size": 6, "dataFileList": entries})
+        nposted = len(self.__server.origdatablocks)
+        ingestor.reingest("myscan_00001:1", self.token, notmp=True)
+
+        # the block is trimmed to its unchanged files in place
+        self.assertEqual(len(self.__server.origdatablock_patches), 1)
+        odb = json.loads(self.__server.id_origdatablock[iid])
+        self.assertEqual(
+            [entry["path"] for entry in odb["dataFileList"]],
+            ["myscan_00001_%05d.nxs" % i for i in [0, 2, 4]])
+        self.assertEqual(odb["size"], 3)
+        # only the changed file is posted
+        self.assertEqual(len(self.__server.origdatablocks) - nposted, 1)
+        last = json.loads(self.__server.origdatablocks[-1])
+        self.assertEqual(last["dataFileList"],
+                         [{"path": "myscan_00001_00001.nxs", "size": 3}])
+        self.assertEqual(len(self.__server.id_origdatablock), 2)
+
+    def test_incremental_origdatablocks_times(self):
+        self.__server.normalized_times = True
+        ingestor = self.createingestor({"incremental_origdatablocks": True})
+        pid = self.createscan("myscan_00001", ndbs=0, nads=0)
+        dbs = []
+        for i in range(2):
+            dbs.append(self.writejson("myscan_00001_%s.db.json" % i, {
+                "datasetId": pid, "size": 1,
+                "dataFileList": [{
+                    "path": "myscan_00001_%05d.nxs" % i, "size": 1,
+                    "time": "2024-05-01T12:34:5%s.123456+0200" % i}]}))
+        self.writejson("myscan_00001.origdatablock.json", dbs)
+        ingestor.ingest("myscan_00001", self.token)
+        self.assertEqual(len(self.__server.id_origdatablock), 2)
+        odb = json.loads(list(self.__server.id_origdatablock.values())[0])
+        self.assertEqual(odb["dataFileList"][0]["time"],
+                         "2024-05-01T12:34:50.123456+0200")
+
+        # one file grows
+        self.writejson("myscan_00001_1.db.json", {
+            "datasetId": pid, "size": 2,
+            "dataFileList": [{
+                "path": "myscan_00001_00001.nxs", "size": 2,
+                "time": "2024-05-01T12:35:00.654321+0200"}]})
+        nposted = len(self.__server.origdatablocks)
+        ingestor.reingest("myscan_00001:1", self.token, notmp=True)
+        # the unchanged file matches its normalised time on the server
+        self.assertEqual(len(self.__server.origdatablocks) - nposted, 1)
+        files = dict((entry["path"], entry["size"])
+                     for odb in self.__server.id_origdatablock.values()
+                     for entry in json.loads(odb)["dataFileList"])
+        self.assertEqual(files, {"myscan_00001_00000.nxs": 1,
+                                 "myscan_00001_00001.nxs": 2})
+
+    def test_attachment_lane(self):
+        ingestor = self.createingestor(
+            {"attachment_lane": True, "attachment_lane_tries_number": 2,
+             "retry_failed_attachment_ingestion": True})
+        released = threading.Event()
+        ingest_attachment = ingestor._ingest_attachment_metadata
+
+        def blocked(*args, **kwargs):
+            released.wait(10)
+            return ingest_attachment(*args, **kwargs)
+
+        ingestor._ingest_attachment_metadata = blocked
+        pid = self.createscan("myscan_00001", ndbs=2, nads=1)
+        ingestor.ingest("myscan_00001", self.token)
+        # the scan is marked before its attachments are ingested
+        self.assertTrue(pid in self.__server.pid_dataset)
+        self.assertEqual(len(self.__server.id_origdatablock), 2)
+        self.assertEqual(self.__server.attachments, [])
+        ingested = self.ingested()
+        self.assertEqual(len(ingested), 1)
+        self.assertEqual(ingested[0][3], "0")
+        # the scan is not ingested again while the lane is pending
+        with open(os.path.join(
+                self.__dir, "scicat-datasets-99001234.lst"), "w") as fl:
+            fl.write("myscan_00001\n")
+        ingestor.check_list()
+        self.assertEqual(ingestor.waiting_datasets(), [])
+
+        # the first attachment post fails and is retried
+        self.__server.error_requests = [self.__server.counter + 1]
+        self.__server.error_status = 400
+        released.set()
+        ingestor.wait_for_attachments()
+        self.assertEqual(
+            [ad[0] for ad in self.__server.attachments], [pid])
+        ingested = self.ingested()
+        self.assertEqual(len(ingested), 2)
+        self.assertEqual(ingested[1][:3], ingested[0][:3])
+        self.assertTrue(float(ingested[1][3]) > 0)
+        ingestor.check_list()
+        self.assertEqual(ingestor.waiting_datasets(), [])
+
+    def test_progressive_ingestion(self):
+        ingestor = self.createingestor({
+            "progressive_ingestion": True,
+            "ingest_dataset_attachment": False,
+            "file_dataset_metadata_generator":
+            "cp {scanpath}/meta/{scanname}.json "
+            "{metapath}/{scanname}{scanpostfix}"})
+        scan = "myscan_00001"
+        pid = "99001234/%s" % scan
+        sdir = os.path.join(self.__dir, scan)
+        os.mkdir(sdir)
+        os.mkdir(os.path.join(self.__dir, "meta"))
+
+        def write(name, text):
+            with open(os.path.join(sdir, name), "w") as fl:
+                fl.write(text)
+
+        self.writejson("meta/%s.json" % scan, {
+            "pid": pid, "type": "raw",
+            "proposalId": "99991173.99001234",
+            "datasetName": scan,
+            "scientificMetadata": {"status": "running"}})
+        # no master file yet
+        write("frame_00000.dat", "0")
+        self.assertEqual(ingestor.progress(scan, self.token), 0)
+        self.assertEqual(self.__server.datasets, [])
+
+        # the dataset is registered when the master file appears
+        with open(os.path.join(self.__dir, "%s.fio" % scan), "w") as fl:
+            fl.write("!")
+        self.assertEqual(ingestor.progress(scan, self.token), 2)
+        self.assertEqual(ingestor.progressive_scans(), [scan])
+        self.assertTrue(pid in self.__server.pid_dataset)
+        write("frame_00001.dat", "1")
+        write("frame_00002.dat", "2")
+        self.assertEqual(ingestor.progress(scan, self.token), 2)
+        self.assertEqual(ingestor.progress(scan, self.token), 0)
+        self.assertEqual(len(self.__server.id_origdatablock), 2)
+
+        # the last frame grows and one more frame lands
+        time.sleep(0.01)
+        write("frame_00002.dat", "22")
+        write("frame_00003.dat", "3")
+        self.writejson("meta/%s.json" % scan, {
+            "pid": pid, "type": "raw",
+            "proposalId": "99991173.99001234",
+            "datasetName": scan,
+            "scientificMetadata": {"status": "finished"}})
+        ingestor.ingest(scan, self.token)
+
+        self.assertEqual(ingestor.progressive_scans(), [])
+        self.assertEqual(
+            json.loads(self.__server.pid_dataset[pid])[
+                "scientificMetadata"], {"status": "finished"})
+        odbs = [json.loads(odb)
+                for odb in self.__server.id_origdatablock.values()]
+        # the first block is kept, the outdated one keeps its unchanged
+        # file and only the changed and new files are posted
+        self.assertEqual(len(odbs), 3)
+        self.assertEqual(len(self.__server.origdatablock_patches), 1)
+        paths = sorted(entry["path"] for odb in odbs
+                       for entry in odb["dataFileList"])
+        self.assertEqual(
+            paths, ["%s.fio" % scan] +
+            ["%s/frame_%05d.dat" % (scan, i) for i in range(4)])
+        sizes = dict((entry["path"], entry["size"]) for odb in odbs
+                     for entry in odb["dataFileList"])
+        self.assertEqual(sizes["%s/frame_00002.dat" % scan], 2)
+        last = json.loads(self.__server.origdatablocks[-1])
+        self.assertEqual(
+            sorted(entry["path"] for entry in last["dataFileList"]),
+            ["%s/frame_%05d.dat" % (scan, i) for i in range(2, 4)])
+        ingested = self.ingested()
+        self.assertEqual(len(ingested), 1)
+        self.assertTrue(float(ingested[0][2]) > 0)
+
+    def test_progressive_ingestion_unchanged(self):
+        ingestor = self.createingestor({
+            "progressive_ingestion": True,
+            "ingest_dataset_attachment": False,
+            "file_dataset_metadata_generator":
+            "cp {scanpath}/meta/{scanname}.json "
+            "{metapath}/{scanname}{scanpostfix}"})
+        scan = "myscan_00001"
+        pid = "99001234/%s" % scan
+        sdir = os.path.join(self.__dir, scan)
+        os.mkdir(sdir)
+        os.mkdir(os.path.join(self.__dir, "meta"))
+
+        def write(name, text):
+            with open(os.path.join(sdir, name), "w") as fl:
+                fl.write(text)
+
+        self.writejson("meta/%s.json" % scan, {
+            "pid": pid, "type": "raw",
+            "proposalId": "99991173.99001234",
+            "datasetName": scan,
+            "scientificMetadata": {"name": scan}})
+        with open(os.path.join(self.__dir, "%s.fio" % scan), "w") as fl:
+            fl.write("!")
+        # the frame is partially written
+        write("frame_00000.dat", "0")
+        self.assertEqual(ingestor.progress(scan, self.token), 2)
+
+        # the frame is completed and one more frame lands
+        # while the metadata of the scan does not change
+        time.sleep(0.01)
+        write("frame_00000.dat", "00000")
+        write("frame_00001.dat", "1")
+        ingestor.ingest(scan, self.token)
+
+        self.assertEqual(ingestor.progressive_scans(), [])
+        self.assertEqual(list(self.__server.pid_dataset.keys()), [pid])
+        sizes = dict((entry["path"], entry["size"])
+                     for odb in self.__server.id_origdatablock.values()
+                     for entry in json.loads(odb)["dataFileList"])
+        self.assertEqual(sizes, {
+            "%s.fio" % scan: 1,
+            "%s/frame_00000.dat" % scan: 5,
+            "%s/frame_00001.dat" % scan: 1})
+        ingested = self.ingested()
+        self.assertEqual(len(ingested), 1)
+        self.assertTrue(float(ingested[0][1]) > 0)
+        self.assertTrue(float(ingested[0][2]) > 0)
+
+    def test_progressive_ingestion_create(self):
+        ingestor = self.createingestor({
+            "progressive_ingestion": True,
+            "dataset_update_strategy": "create",
+            "ingest_dataset_attachment": False,
+            "file_dataset_metadata_generator":
+            "cp {scanpath}/meta/{scanname}.json "
+            "{metapath}/{scanname}{scanpostfix}"})
+        scan = "myscan_00001"
+        pid = "99001234/%s" % scan
+        sdir = os.path.join(self.__dir, scan)
+        os.mkdir(sdir)
+        os.mkdir(os.path.join(self.__dir, "meta"))
+        with open(os.path.join(sdir, "frame_00000.dat"), "w") as fl:
+            fl.write("0")
+        with open(os.path.join(self.__dir, "%s.fio" % scan), "w") as fl:
+            fl.write("!")
+        self.writejson("meta/%s.json" % scan, {
+            "pid": pid, "type": "raw",
+            "proposalId": "99991173.99001234",
+            "datasetName": scan,
+            "scientificMetadata": {"status": "running"}})
+        self.assertEqual(ingestor.progress(scan, self.token), 2)
+
+        self.writejson("meta/%s.json" % scan, {
+            "pid": pid, "type": "raw",
+            "proposalId": "99991173.99001234",
+            "datasetName": scan,
+            "scientificMetadata": {"status": "finished"}})
+        ingestor.ingest(scan, self.token)
+
+        # the dataset is patched in place and keeps its origdatablocks
+        self.assertEqual(list(self.__server.pid_dataset.keys()), [pid])
+        self.assertEqual(
+            json.loads(self.__server.pid_dataset[pid])[
+                "scientificMetadata"], {"status": "finished"})
+        self.assertEqual(len(self.__server.id_origdatablock), 1)
+        self.assertEqual(
+            set(json.loads(odb)["datasetId"]
+                for odb in self.__server.id_origdatablock.values()),
+            set([pid]))
+
+    def test_pipeline_stages(self):
+        ingestor = self.createingestor({"metadata_digests": True})
+        scans = ["myscan_%05d" % i for i in range(1, 5)]
+        pids = [self.createscan(scan, ndbs=2, nads=1) for scan in scans]
+        pipeline = IngestionPipeline(
+            [("generate",
+              lambda scan: (scan, ingestor.generate_payloads(scan)), 1),
+             ("upload",
+              lambda item: ingestor.ingest_payloads(
+                  item[0], item[1], self.token), 2)])
+        for scan in scans:
+            pipeline.put(scan)
+        pipeline.close()
+
+        self.assertEqual(sorted(self.__server.pid_dataset.keys()), pids)
+        self.assertEqual(len(self.__server.id_origdatablock), 8)
+        self.assertEqual(len(self.__server.attachments), 4)
+        ingested = self.ingested()
+        self.assertEqual(sorted(line[0] for line in ingested), scans)
+        for line in ingested:
+            self.assertTrue(float(line[1]) > 0)
+            self.assertTrue(float(line[2]) > 0)
+        # digests recorded by concurrent upload workers
+        with open(os.path.join(
+                self.__dir,
+                "scicat-ingested-datasets-99001234.lst.digests")) as fl:
+            lines = [line.split(" ") for line in fl.read().splitlines()]
+        self.assertEqual(sorted(line[0] for line in lines), pids)
+        self.assertTrue(all(len(line) == 2 for line in lines))
+
+    def test_inprocess_generators(self):
+        cfdir = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "config")
+        scan = "mymeta2_00011"
+        shutil.copy(os.path.join(cfdir, "%s.fio" % scan), self.__dir)
+        os.mkdir(os.path.join(self.__dir, scan))
+        with open(os.path.join(self.__dir, scan, "frame.dat"), "w") as fl:
+            fl.write("1234")
+        payloads = []
+        for inprocess in [False, True]:
+            self.__server.reset()
+            for postfix in [".scan.json", ".origdatablock.json",
+                            ".attachment.json"]:
+                if os.path.isfile(os.path.join(self.__dir, scan + postfix)):
+                    os.remove(os.path.join(self.__dir, scan + postfix))
+            bfile = os.path.join(
+                self.__dir, "beamtime-metadata-99001234.json")
+            shutil.copy(os.path.join(
+                cfdir, "beamtime-metadata-99001234.json"), bfile)
+            ingestor = DatasetIngestor(
+                {"scicat_url": self.url,
+                 "inprocess_metadata_generators": inprocess,
+                 "ingest_dataset_attachment": False},
+                self.__dir,
+                os.path.join(self.__dir, "scicat-datasets-99001234.lst"),
+                os.path.join(
+                    self.__dir, "scicat-ingested-datasets-99001234.lst"),
+                dict(self.meta), bfile)
+            ingestor.ingest(scan, self.token)
+            metrics = ingestor.generator_metrics()
+            self.assertEqual(metrics["inprocess"], 2 if inprocess else 0)
+            self.assertEqual(metrics["shell"], 0 if inprocess else 2)
+            self.assertEqual(len(self.__server.datasets), 1)
+            self.assertEqual(len(self.__server.origdatablocks), 1)
+            dataset = json.loads(self.__server.datasets[0])
+            odb = json.loads(self.__server.origdatablocks[0])
+            for item in [dataset, odb]:
+                for key in ["creationTime", "endTime", "updatedAt"]:
+                    item.pop(key, None)
+            payloads.append((dataset, odb))
+        # both backends provide the same payloads
+        self.assertEqual(payloads[0], payloads[1])
+        self.assertEqual(payloads[1][0]["pid"], "99001234/%s" % scan)
+        self.assertEqual(
+            sorted(entry["path"] for entry in payloads[1][1]["dataFileList"]),
+            ["%s.fio" % scan, "%s/frame.dat" % scan])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import threading
+import time
+
+from scingestor import ingestionPipeline
+from scingestor.logger import init_logger, get_logger
+
+
+# test fixture
+class IngestionPipelineTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        if get_logger() is None:
+            init_logger("IngestionPipelineTest", "error")
+
+    def test_stages(self):
+        results = []
+
+        def double(item):
+            if item % 3:
+                return item * 2
+
+        def fail(item):
+            if item == 8:
+                raise Exception("Wrong item %s" % item)
+            return item
+
+        pipeline = ingestionPipeline.IngestionPipeline(
+            [("double", double, 1), ("fail", fail, 2),
+             ("record", results.append, 1)])
+        for item in range(7):
+            pipeline.put(item)
+        pipeline.join()
+        # items dropped by stages or failed are not recorded
+        self.assertEqual(sorted(results), [2, 4, 10])
+        pipeline.put(7)
+        pipeline.close()
+        self.assertEqual(sorted(results), [2, 4, 10, 14])
+
+    def test_order_with_one_worker(self):
+        results = []
+        pipeline = ingestionPipeline.IngestionPipeline(
+            [("generate", lambda item: item, 1),
+             ("upload", results.append, 1)], queue_size=2)
+        for item in range(20):
+            pipeline.put(item)
+        pipeline.close()
+        self.assertEqual(results, list(range(20)))
+
+    def test_overlap(self):
+        def generate(item):
+            time.sleep(0.1)
+            return item
+
+        def upload(item):
+            time.sleep(0.1)
+
+        pipeline = ingestionPipeline.IngestionPipeline(
+            [("generate", generate, 1), ("upload", upload, 1)])
+        start = time.time()
+        for item in range(5):
+            pipeline.put(item)
+        pipeline.join()
+        # generation of the next scan runs during the previous upload
+        self.assertTrue(time.time() - start < 0.9)
+        pipeline.close()
+
+    def test_backpressure(self):
+        released = threading.Event()
+        generated = []
+
+        def generate(item):
+            generated.append(item)
+            return item
+
+        pipeline = ingestionPipeline.IngestionPipeline(
+            [("generate", generate, 1),
+             ("upload", lambda item: released.wait(10), 1)],
+            queue_size=1)
+        putter = threading.Thread(
+            target=lambda: [pipeline.put(item) for item in range(10)])
+        putter.start()
+        time.sleep(0.3)
+        # one item in upload, one waiting for it, one generated and
+        # blocked, and one waiting for generation
+        self.assertTrue(putter.is_alive())
+        self.assertEqual(generated, [0, 1, 2])
+        released.set()
+        putter.join()
+        pipeline.close()
+        self.assertEqual(generated, list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
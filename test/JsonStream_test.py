@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from scingestor import jsonStream
+
+
+# test fixture
+class JsonStreamTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+
+    def setUp(self):
+        self.__dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__dir)
+
+    def test_top_level_values(self):
+        doc = json.dumps({
+            "dataFileList": [
+                {"path": "scan_00001.nxs", "datasetId": "nested"},
+                {"path": 'a "quoted" \\ path {[', "size": 1}],
+            "meta": {"datasetId": {"a": ["datasetId"]}},
+            "datasetId": "99001234/scan_00001",
+            "size": 2}, indent=1).encode()
+        values, start = jsonStream.top_level_values(
+            b"  " + doc, ["datasetId", "dataFileList", "thumbnail"])
+        self.assertEqual(start, 2)
+        self.assertEqual(sorted(values.keys()), ["dataFileList", "datasetId"])
+        self.assertEqual(
+            jsonStream.string_at(b"  " + doc, values["datasetId"])[0],
+            "99001234/scan_00001")
+        self.assertFalse(
+            jsonStream.empty_at(b"  " + doc, values["dataFileList"]))
+        self.assertEqual(
+            jsonStream.string_at(b"  " + doc, values["dataFileList"]),
+            (None, values["dataFileList"]))
+
+        for value, empty in [([], True), ({}, True), (None, True),
+                             ("", True), ([1], False), ("a", False)]:
+            doc = json.dumps({"dataFileList": value}).encode()
+            values, _ = jsonStream.top_level_values(doc, ["dataFileList"])
+            self.assertEqual(
+                jsonStream.empty_at(doc, values["dataFileList"]), empty)
+
+        with self.assertRaises(ValueError):
+            jsonStream.top_level_values(b'[{"datasetId": "a"}]', ["a"])
+
+    def test_replace_span(self):
+        filename = os.path.join(self.__dir, "scan.origdatablock.json")
+        content = b'{"datasetId": "old", "dataFileList": []}'
+        with open(filename, "wb") as fl:
+            fl.write(content)
+        os.chmod(filename, 0o640)
+        values, _ = jsonStream.top_level_values(content, ["datasetId"])
+        _, end = jsonStream.string_at(content, values["datasetId"])
+        jsonStream.replace_span(
+            filename, values["datasetId"], end, b'"10.3204/new"')
+        with open(filename, "rb") as fl:
+            self.assertEqual(
+                fl.read(),
+                b'{"datasetId": "10.3204/new", "dataFileList": []}')
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+        self.assertFalse(os.path.exists(filename + ".tmp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
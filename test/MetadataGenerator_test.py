@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+
+from scingestor.metadataGenerator import MetadataGenerator
+from scingestor.logger import init_logger, get_logger
+
+
+# test fixture
+class MetadataGeneratorTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        self.cfdir = os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), "config")
+        if get_logger() is None:
+            init_logger("MetadataGeneratorTest", "error")
+
+    def setUp(self):
+        self.__dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__dir)
+
+    def createscan(self, scan, nfiles=3):
+        sdir = os.path.join(self.__dir, scan)
+        os.mkdir(sdir)
+        for i in range(nfiles):
+            with open(os.path.join(sdir, "%s_%05d.dat" % (scan, i)),
+                      "w") as fl:
+                fl.write("%s" % i * (i + 1))
+        return sdir
+
+    def test_arguments(self):
+        generator = MetadataGenerator(True)
+        self.assertEqual(
+            generator.arguments(
+                "nxsfileinfo origdatablock  -s *.pyc,*~  -r 'raw dir' "
+                " -p 99001234/myscan_00001 /tmp/myscan_00001 "),
+            ["origdatablock", "-s", "*.pyc,*~", "-r", "raw dir",
+             "-p", "99001234/myscan_00001", "/tmp/myscan_00001"])
+        self.assertEqual(
+            generator.arguments(
+                "/usr/bin/nxsfileinfo metadata -o out.json in.fio"),
+            ["metadata", "-o", "out.json", "in.fio"])
+        for command in [
+                "nxsfileinfo metadata in.fio | cat > out.json",
+                "nxsfileinfo metadata -o $HOME/out.json in.fio",
+                "nxsfileinfo metadata in.fio; rm in.fio",
+                "nxsfileinfo field in.nxs",
+                "nxsfileinfo metadata -o 'out.json in.fio",
+                "mygenerator metadata -o out.json in.fio",
+                "nxsfileinfo"]:
+            self.assertEqual(generator.arguments(command), None)
+
+    def test_origdatablock(self):
+        sdir = self.createscan("myscan_00001")
+        command = "nxsfileinfo origdatablock " \
+            " -s *.pyc,*.origdatablock.json,*~ " \
+            " -r 'raw' -p 99001234/myscan_00001 " \
+            " -w 99001234-dmgt -c 99001234-clbt %s " % sdir
+        generator = MetadataGenerator(True)
+        inprocess = json.loads(generator.run(command, capture=True))
+        self.assertEqual(generator.metrics(), {"inprocess": 1, "shell": 0})
+
+        shell = MetadataGenerator()
+        self.assertEqual(
+            json.loads(shell.run(command, capture=True)), inprocess)
+        self.assertEqual(shell.metrics(), {"inprocess": 0, "shell": 1})
+        self.assertEqual(
+            sorted(entry["path"] for entry in inprocess["dataFileList"]),
+            ["raw/myscan_00001/myscan_00001_%05d.dat" % i for i in range(3)])
+
+        output = os.path.join(self.__dir, "myscan_00001.origdatablock.json")
+        self.assertEqual(
+            generator.run("%s -o %s" % (command, output)), None)
+        with open(output) as fl:
+            self.assertEqual(json.loads(fl.read()), inprocess)
+        self.assertEqual(generator.metrics(), {"inprocess": 2, "shell": 0})
+
+    def test_metadata(self):
+        fio = os.path.join(self.__dir, "mymeta2_00011.fio")
+        shutil.copy(os.path.join(self.cfdir, "mymeta2_00011.fio"), fio)
+        btfile = os.path.join(self.cfdir, "beamtime-metadata-99001234.json")
+        command = "nxsfileinfo metadata -k4 -o {output} " \
+            " --id-format '{{beamtimeId}}' -z '' -e '' " \
+            " -b %s -p 99001234/mymeta2_00011 %s" % (btfile, fio)
+        outputs = []
+        for inprocess in [True, False]:
+            output = os.path.join(self.__dir, "%s.scan.json" % inprocess)
+            generator = MetadataGenerator(inprocess)
+            generator.run(command.format(output=output))
+            self.assertEqual(
+                generator.metrics()["inprocess"], int(inprocess))
+            with open(output) as fl:
+                outputs.append(json.loads(fl.read()))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0]["pid"], "99001234/mymeta2_00011")
+
+    def test_shell_fallback(self):
+        sdir = self.createscan("myscan_00001")
+        generator = MetadataGenerator(True)
+        result = generator.run(
+            "nxsfileinfo origdatablock -p 99001234/myscan_00001 %s | cat"
+            % sdir, capture=True)
+        self.assertEqual(len(json.loads(result)["dataFileList"]), 3)
+        self.assertEqual(generator.metrics(), {"inprocess": 0, "shell": 1})
+
+        # failed in-process commands are reported by the shell command
+        with self.assertRaises(subprocess.CalledProcessError):
+            generator.run(
+                "nxsfileinfo metadata -o %s %s" % (
+                    os.path.join(self.__dir, "out.json"),
+                    os.path.join(self.__dir, "missing.nxs")))
+        self.assertEqual(generator.metrics(), {"inprocess": 0, "shell": 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
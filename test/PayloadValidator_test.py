@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+
+from scingestor import payloadValidator
+from scingestor.logger import init_logger, get_logger
+
+
+# test fixture
+class PayloadValidatorTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        if get_logger() is None:
+            init_logger("PayloadValidatorTest", "error")
+
+    def test_errors(self):
+        validator = payloadValidator.PayloadValidator()
+        self.assertEqual(
+            validator.errors("dataset", {
+                "pid": "99001234/myscan_00001", "type": "raw",
+                "keywords": ["a"], "size": 2, "isPublished": False,
+                "scientificMetadata": {"a": [1, None]}}),
+            [])
+        self.assertEqual(
+            validator.errors("dataset", {
+                "type": "processed", "keywords": ["a", 1],
+                "numberOfFiles": True, "size": -1}),
+            ["dataset: missing required pid",
+             "dataset.type: 'processed' is not one of ['raw', 'derived']",
+             "dataset.keywords[1]: string expected, got int",
+             "dataset.size: -1 is less than 0",
+             "dataset.numberOfFiles: integer expected, got bool"])
+        self.assertEqual(
+            validator.errors("origdatablock", {
+                "datasetId": "99001234/myscan_00001", "size": 1,
+                "dataFileList": [{"path": "a.nxs", "size": 1},
+                                 {"path": "", "size": "1"}, "b.nxs"]}),
+            ["origdatablock.dataFileList[1].path: '' is shorter than 1",
+             "origdatablock.dataFileList[1].size: "
+             "number expected, got str",
+             "origdatablock.dataFileList[2]: object expected, got str"])
+        self.assertEqual(
+            validator.errors("attachment", []),
+            ["attachment: object expected, got list"])
+        self.assertEqual(validator.errors("sample", {}), [])
+
+    def test_configured_schemas(self):
+        config = {"payload_validation_schemas": {
+            "attachment": {"type": "object",
+                           "required": ["thumbnail", "caption"]}}}
+        validator = payloadValidator.get_payload_validator(config)
+        self.assertTrue(
+            validator is payloadValidator.get_payload_validator(dict(config)))
+        self.assertTrue(
+            validator is not payloadValidator.get_payload_validator({}))
+        self.assertEqual(
+            validator.errors("attachment", {"thumbnail": 1}),
+            ["attachment: missing required caption"])
+        self.assertEqual(
+            validator.errors("dataset", {"type": "raw"}),
+            ["dataset: missing required pid"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import threading
+import time
+import requests
+
+from scingestor import retryPolicy
+from scingestor import scicatClient
+from scingestor.logger import init_logger, get_logger
+
+try:
+    from .SciCatTestServer import SciCatTestServer, SciCatMockHandler
+except Exception:
+    from SciCatTestServer import SciCatTestServer, SciCatMockHandler
+
+
+# test fixture
+class RetryPolicyTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        self.url = 'http://localhost:8881'
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json'}
+        if get_logger() is None:
+            init_logger("RetryPolicyTest", "error")
+
+    def setUp(self):
+        self.starthttpserver()
+
+    def starthttpserver(self):
+        self.__server = SciCatTestServer(('', 8881), SciCatMockHandler)
+
+        self.__thread = threading.Thread(None, self.__server.run)
+        self.__thread.start()
+
+    def stophttpserver(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+        self.__server = None
+
+    def tearDown(self):
+        self.stophttpserver()
+
+    def get(self, policy):
+        client = scicatClient.SciCatClient({}, policy)
+        return client.get(
+            self.url + "/Datasets/99001234%2Fmyscan_00001",
+            headers=self.headers, token="12345")
+
+    def test_delay(self):
+        policy = retryPolicy.RetryPolicy(
+            {"request_retry_backoff_factor": 0.5,
+             "request_retry_backoff_max": 3,
+             "request_retry_jitter": False})
+        self.assertEqual(
+            [policy.delay(i) for i in range(1, 6)], [0.5, 1, 2, 3, 3])
+
+        policy = retryPolicy.RetryPolicy(
+            {"request_retry_backoff_factor": 1})
+        for _ in range(20):
+            delay = policy.delay(2)
+            self.assertTrue(1 <= delay <= 2)
+
+    def test_retryable(self):
+        policy = retryPolicy.RetryPolicy(
+            {"request_retry_status_codes": [500, 404, 503]})
+        res = requests.Response()
+        for code, status in [(500, True), (503, True), (504, False),
+                             (404, False), (400, False), (200, False)]:
+            res.status_code = code
+            self.assertEqual(policy.retryable(res), status)
+        self.assertTrue(policy.retryable(
+            error=requests.exceptions.ConnectionError()))
+        self.assertTrue(policy.retryable(
+            error=requests.exceptions.ReadTimeout()))
+        self.assertFalse(policy.retryable(error=ValueError()))
+
+    def test_default_no_retry(self):
+        self.__server.error_requests = [1]
+        self.__server.error_status = 503
+        res = self.get(retryPolicy.RetryPolicy({}))
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(self.__server.counter, 1)
+
+    def test_retry_status(self):
+        self.__server.error_requests = [1, 2]
+        self.__server.error_status = 502
+        res = self.get(retryPolicy.RetryPolicy(
+            {"request_retry_tries_number": 5,
+             "request_retry_backoff_factor": 0.01}))
+        self.assertTrue(res.ok)
+        self.assertEqual(self.__server.counter, 3)
+
+    def test_no_retry_client_error(self):
+        self.__server.error_requests = [1, 2]
+        for status in [400, 404, 500]:
+            self.__server.counter = 0
+            self.__server.error_status = status
+            res = self.get(retryPolicy.RetryPolicy(
+                {"request_retry_tries_number": 5,
+                 "request_retry_backoff_factor": 0.01,
+                 "request_retry_status_codes": [404, 502, 503, 504]}))
+            self.assertEqual(res.status_code, status)
+            self.assertEqual(self.__server.counter, 1)
+
+    def test_tries_number(self):
+        self.__server.error_requests = [1, 2, 3, 4]
+        self.__server.error_status = 504
+        res = self.get(retryPolicy.RetryPolicy(
+            {"request_retry_tries_number": 3,
+             "request_retry_backoff_factor": 0.01}))
+        self.assertEqual(res.status_code, 504)
+        self.assertEqual(self.__server.counter, 3)
+
+    def test_connection_error(self):
+        policy = retryPolicy.RetryPolicy(
+            {"request_retry_tries_number": 3,
+             "request_retry_backoff_factor": 0.01})
+        calls = []
+
+        def func():
+            calls.append(1)
+            raise requests.exceptions.ConnectionError("Connection reset")
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            policy.execute(func)
+        self.assertEqual(len(calls), 3)
+
+        calls = []
+
+        def func2():
+            calls.append(1)
+            raise ValueError("Wrong value")
+
+        with self.assertRaises(ValueError):
+            policy.execute(func2)
+        self.assertEqual(len(calls), 1)
+
+    def test_not_idempotent(self):
+        policy = retryPolicy.RetryPolicy(
+            {"request_retry_tries_number": 3,
+             "request_retry_backoff_factor": 0.01})
+        res = requests.Response()
+        res.status_code = 503
+        self.assertFalse(policy.retryable(res, idempotent=False))
+        self.assertFalse(policy.retryable(
+            error=requests.exceptions.ReadTimeout(), idempotent=False))
+        self.assertFalse(policy.retryable(
+            error=requests.exceptions.ConnectionError("Connection reset"),
+            idempotent=False))
+        self.assertTrue(policy.retryable(
+            error=requests.exceptions.ConnectTimeout(), idempotent=False))
+
+        self.__server.error_requests = [1, 2]
+        self.__server.error_status = 503
+        client = scicatClient.SciCatClient({}, policy)
+        res = client.post(
+            self.url + "/OrigDatablocks", headers=self.headers,
+            token="12345", data="{}")
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(self.__server.counter, 1)
+        res = client.post(
+            self.url + "/OrigDatablocks", headers=self.headers,
+            token="12345", data="{}", idempotent=True)
+        self.assertNotEqual(res.status_code, 503)
+        self.assertEqual(self.__server.counter, 3)
+
+        calls = []
+
+        def func():
+            calls.append(1)
+            raise requests.exceptions.ConnectionError(
+                "Connection refused")
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client = scicatClient.SciCatClient({}, policy)
+            client.post("http://localhost:8882/OrigDatablocks", data="{}")
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            policy.execute(func, idempotent=False)
+        self.assertEqual(len(calls), 1)
+
+    def test_deadline(self):
+        self.__server.error_requests = list(range(1, 20))
+        self.__server.error_status = 503
+        start = time.time()
+        res = self.get(retryPolicy.RetryPolicy(
+            {"request_retry_tries_number": 20,
+             "request_retry_backoff_factor": 0.1,
+             "request_retry_jitter": False,
+             "request_retry_deadline": 0.5}))
+        self.assertEqual(res.status_code, 503)
+        self.assertTrue(time.time() - start < 0.5)
+        # delays 0.1, 0.2 and 0.4 exceeds the deadline
+        self.assertEqual(self.__server.counter, 3)
+
+    def test_budget(self):
+        self.__server.error_requests = list(range(1, 20))
+        self.__server.error_status = 503
+        policy = retryPolicy.RetryPolicy(
+            {"request_retry_tries_number": 4,
+             "request_retry_backoff_factor": 0.01,
+             "request_retry_budget_max": 2,
+             "request_retry_budget_ratio": 0})
+        res = self.get(policy)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(self.__server.counter, 3)
+        res = self.get(policy)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(self.__server.counter, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import threading
+import json
+import tempfile
+import time
+import socketserver
+
+from scingestor import scicatClient
+from scingestor.logger import init_logger, get_logger
+
+try:
+    from .SciCatTestServer import SciCatTestServer, SciCatMockHandler
+except Exception:
+    from SciCatTestServer import SciCatTestServer, SciCatMockHandler
+
+
+class ThreadingSciCatTestServer(
+        socketserver.ThreadingMixIn, SciCatTestServer):
+    daemon_threads = True
+
+
+# test fixture
+class SciCatClientTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        self.url = 'http://localhost:8881'
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json'}
+        if get_logger() is None:
+            init_logger("SciCatClientTest", "error")
+
+    def setUp(self):
+        self.starthttpserver()
+
+    def starthttpserver(self):
+        self.__server = SciCatTestServer(('', 8881), SciCatMockHandler)
+
+        self.__thread = threading.Thread(None, self.__server.run)
+        self.__thread.start()
+
+    def stophttpserver(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+        self.__server = None
+
+    def tearDown(self):
+        self.stophttpserver()
+
+    def test_shared_client(self):
+        cl1 = scicatClient.get_scicat_client({})
+        cl2 = scicatClient.get_scicat_client(
+            {"scicat_url": "http://localhost:8881"})
+        cl3 = scicatClient.get_scicat_client(
+            {"request_pool_maxsize": 3})
+        cl4 = scicatClient.get_scicat_client(
+            {"request_pool_maxsize": 3, "request_pool_connections": 2})
+        self.assertTrue(isinstance(cl1, scicatClient.SciCatClient))
+        self.assertTrue(cl1 is cl2)
+        self.assertTrue(cl1 is not cl3)
+        self.assertTrue(cl3 is not cl4)
+        self.assertTrue(
+            cl3 is scicatClient.get_scicat_client(
+                {"request_pool_maxsize": 3}))
+
+    def test_headers_not_mutated(self):
+        client = scicatClient.get_scicat_client({})
+        headers = dict(self.headers)
+        res = client.post(
+            self.url + "/Users/login", headers=headers,
+            json={"username": "ingestor", "password": "12342345"})
+        self.assertTrue(res.ok)
+        token = json.loads(res.content)["id"]
+
+        dataset = {"pid": "99001234/myscan_00001", "type": "raw"}
+        res = client.post(
+            self.url + "/Datasets", headers=headers, token=token,
+            data=json.dumps(dataset))
+        self.assertTrue(res.ok)
+        self.assertEqual(headers, self.headers)
+        res = client.get(
+            self.url + "/Datasets/99001234%2Fmyscan_00001",
+            headers=headers, token=token)
+        self.assertTrue(res.ok)
+        self.assertEqual(json.loads(res.content), dataset)
+        self.assertEqual(headers, self.headers)
+        self.assertEqual(len(self.__server.datasets), 1)
+        self.assertEqual(len(self.__server.userslogin), 1)
+
+    def test_empty_token(self):
+        client = scicatClient.get_scicat_client({})
+        res = client.get(
+            self.url + "/Datasets/99001234%2Fmyscan_00001",
+            headers=self.headers, token="")
+        self.assertFalse(res.ok)
+        self.assertEqual(
+            json.loads(res.content), {"Error": "Empty access_token"})
+
+    def test_concurrent_requests(self):
+        client = scicatClient.get_scicat_client(
+            {"request_pool_maxsize": 4, "request_pool_block": True})
+        results = []
+
+        def ingest(i):
+            res = client.post(
+                self.url + "/OrigDatablocks", headers=self.headers,
+                token="12345",
+                data=json.dumps({"datasetId": "99001234/scan_%s" % i}))
+            results.append(res.ok)
+
+        threads = [threading.Thread(target=ingest, args=(i,))
+                   for i in range(8)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(results, [True] * 8)
+        self.assertEqual(len(self.__server.origdatablocks), 8)
+
+    def dataset(self, i, size=1000):
+        return {"pid": "99001234/myscan_%05d" % i, "type": "raw",
+                "scientificMetadata": {"data": list(range(size))}}
+
+    def test_compression(self):
+        self.__server.compressed_bodies = True
+        client = scicatClient.SciCatClient(
+            {"request_compression": True})
+        data = json.dumps(self.dataset(1))
+        res = client.post(
+            self.url + "/Datasets", headers=self.headers, token="12345",
+            data=data)
+        self.assertTrue(res.ok)
+        # small bodies are not compressed
+        res = client.post(
+            self.url + "/Datasets", headers=self.headers, token="12345",
+            data=json.dumps(self.dataset(2, 2)))
+        self.assertTrue(res.ok)
+        self.assertEqual(len(self.__server.compressed_requests), 1)
+        method, path, length = self.__server.compressed_requests[0]
+        self.assertEqual((method, path), ("POST", "/Datasets"))
+        self.assertTrue(length < len(data) / 2)
+        self.assertEqual(
+            self.__server.datasets,
+            [data.encode(), json.dumps(self.dataset(2, 2)).encode()])
+        self.assertEqual(
+            json.loads(self.__server.pid_dataset["99001234/myscan_00001"]),
+            self.dataset(1))
+
+    def test_compression_endpoints(self):
+        self.__server.compressed_bodies = True
+        client = scicatClient.SciCatClient(
+            {"request_compression": True,
+             "request_compression_endpoints": ["/OrigDatablocks$"],
+             "request_compression_min_size": 10})
+        res = client.post(
+            self.url + "/Datasets", headers=self.headers, token="12345",
+            data=json.dumps(self.dataset(1)))
+        self.assertTrue(res.ok)
+        datablock = {"datasetId": "99001234/myscan_00001",
+                     "dataFileList": [{"path": "myscan_00001.nxs"}]}
+        res = client.post(
+            self.url + "/OrigDatablocks", headers=self.headers,
+            token="12345", json=datablock)
+        self.assertTrue(res.ok)
+        self.assertEqual(
+            [req[:2] for req in self.__server.compressed_requests],
+            [("POST", "/OrigDatablocks")])
+        self.assertEqual(
+            self.__server.origdatablocks, [json.dumps(datablock).encode()])
+
+    def test_compression_unsupported(self):
+        client = scicatClient.SciCatClient(
+            {"request_compression": True})
+        for i in range(1, 3):
+            res = client.post(
+                self.url + "/Datasets", headers=self.headers,
+                token="12345", data=json.dumps(self.dataset(i)))
+            self.assertTrue(res.ok)
+        # compression is disabled after the first rejected request
+        self.assertEqual(self.__server.counter, 3)
+        self.assertEqual(len(self.__server.datasets), 2)
+        self.assertEqual(self.__server.compressed_requests, [])
+
+    def test_file_body_retry(self):
+        client = scicatClient.SciCatClient(
+            {"request_retry_tries_number": 2,
+             "request_retry_backoff_factor": 0.01})
+        self.__server.error_requests = [1]
+        self.__server.error_status = 503
+        data = json.dumps(self.dataset(1)).encode()
+        with tempfile.TemporaryFile() as fl:
+            fl.write(data)
+            # the dataset pid is set by the client
+            res = client.post(
+                self.url + "/Datasets", headers=self.headers,
+                token="12345", data=fl, idempotent=True)
+        self.assertTrue(res.ok)
+        self.assertEqual(self.__server.counter, 2)
+        self.assertEqual(self.__server.datasets, [data])
+
+    def test_timeouts(self):
+        client = scicatClient.SciCatClient(
+            {"request_timeouts": {"/Datasets/": [1, 0.3]},
+             "request_retry_tries_number": 2,
+             "request_retry_backoff_factor": 0.01})
+        res = client.post(
+            self.url + "/Datasets", headers=self.headers, token="12345",
+            data=json.dumps(self.dataset(1, 2)))
+        self.assertTrue(res.ok)
+        # the first GET stalls and is retried after the read timeout
+        self.__server.get_delays = {2: 0.5}
+        res = client.get(
+            self.url + "/Datasets/99001234%2Fmyscan_00001",
+            headers=self.headers, token="12345")
+        self.assertTrue(res.ok)
+        self.assertEqual(json.loads(res.content), self.dataset(1, 2))
+        self.assertEqual(
+            client.metrics(),
+            {"requests": 3, "timeouts": 1, "hedged": 0, "hedge_wins": 0})
+
+    def test_hedged_requests(self):
+        self.stophttpserver()
+        self.__server = ThreadingSciCatTestServer(
+            ('', 8881), SciCatMockHandler)
+        self.__thread = threading.Thread(None, self.__server.run)
+        self.__thread.start()
+        client = scicatClient.SciCatClient(
+            {"request_hedging": True,
+             "request_hedging_percentile": 50,
+             "request_hedging_min_samples": 3})
+        url = self.url + "/Datasets/99001234%2Fmyscan_00001"
+        for i in range(3):
+            self.assertTrue(client.hedging_delay() is None)
+            res = client.get(url, headers=self.headers, token="12345")
+            self.assertTrue(res.ok)
+        self.assertTrue(client.hedging_delay() < 1.0)
+        self.__server.get_delays = {4: 2.0}
+        start = time.time()
+        res = client.get(url, headers=self.headers, token="12345")
+        self.assertTrue(res.ok)
+        self.assertTrue(time.time() - start < 1.0)
+        self.assertEqual(
+            client.metrics(),
+            {"requests": 5, "timeouts": 0, "hedged": 1, "hedge_wins": 1})
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,7 +25,13 @@
 from http.server import BaseHTTPRequestHandler, HTTPServer
 import json
 import uuid
+import gzip
+import re
+import hashlib
+import datetime
+import urllib.parse
 import requests
+import time
 
 
 class SciCatMockHandler(BaseHTTPRequestHandler):
@@ -53,6 +59,36 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
         self.send_header('Content-type', 'text/html')
         self.end_headers()
 
+    def read_body(self, length):
+        """ reads request body and decompresses gzip bodies
+
+        :returns: request body or None if the encoding is not supported
+        :rtype: :obj:`bytes`
+        """
+        in_data = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if not self.server.compressed_bodies:
+                return None
+            in_data = gzip.decompress(in_data)
+            self.server.compressed_requests.append(
+                (self.command, self.path.split("?")[0], length))
+        return in_data
+
+    def normalize_times(self, odb):
+        """ converts file times to UTC with milliseconds as SciCat does
+
+        :param odb: origdatablock
+        :type odb: :obj:`dict` <:obj:`str`, `any`>
+        """
+        for entry in odb.get("dataFileList") or []:
+            if entry.get("time"):
+                tm = datetime.datetime.strptime(
+                    entry["time"], "%Y-%m-%dT%H:%M:%S.%f%z").astimezone(
+                        datetime.timezone.utc)
+                entry["time"] = "%s.%03dZ" % (
+                    tm.strftime("%Y-%m-%dT%H:%M:%S"),
+                    tm.microsecond // 1000)
+
     def do_PATCH(self):
         """ implementation of action for http PATCH requests
         """
@@ -64,14 +100,19 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
             #      "Internal Error %s" % self.server.counter})
             # message = json.dumps(
             #     {"Error": "Internal Error for %s" % self.path})
-            resp = 500
+            resp = self.server.error_status
             self.set_json_header(resp)
             self.wfile.write(bytes(message, "utf8"))
             return
 
         length = int(self.headers.get('Content-Length'))
         contenttype = self.headers.get('Content-Type')
-        in_data = self.rfile.read(length)
+        in_data = self.read_body(length)
+        if in_data is None:
+            message = json.dumps({"Error": "Unsupported Media Type"})
+            self.set_json_header(415)
+            self.wfile.write(bytes(message, "utf8"))
+            return
 
         message = ""
 
@@ -88,10 +129,25 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
                 if not spath[-1]:
                     raise Exception("Empty access_token")
                 dt = json.loads(in_data)
+                if "pid" not in dt:
+                    # partial patch of the dataset from the url
+                    pid = urllib.parse.unquote(
+                        self.path.split("?")[0].split("/")[2])
+                    self.server.partial_patches.append(json.loads(in_data))
+                    odt = json.loads(self.server.pid_dataset[pid])
+                    sm = dt.get("scientificMetadata")
+                    if self.server.metadata_merge and isinstance(sm, dict):
+                        osm = odt.get("scientificMetadata") or {}
+                        osm.update(sm)
+                        dt["scientificMetadata"] = dict(
+                            (k, v) for k, v in osm.items() if v is not None)
+                    odt.update(dt)
+                    dt = odt
                 # print("Datasets: %s" % dt)
                 print("Datasets: %s" % dt["pid"])
                 npid = dt["pid"]
                 dt["pid"] = npid
+                self.server.set_updated_time(dt)
                 self.server.pid_dataset[npid] = json.dumps(dt)
                 message = "{}"
                 resp = 200
@@ -100,6 +156,25 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
                 resp = 400
             self.set_json_header(resp)
 
+        elif self.path.lower().startswith(
+                '/origdatablocks/') and \
+                contenttype == 'application/json':
+            self.server.origdatablock_patches.append(in_data)
+            try:
+                if "?access_token=" not in self.path.lower():
+                    raise Exception("Missing access_token")
+                iid = urllib.parse.unquote(
+                    self.path.split("?")[0].split("/")[2])
+                dt = json.loads(self.server.id_origdatablock[iid])
+                dt.update(json.loads(in_data))
+                self.server.id_origdatablock[iid] = json.dumps(dt)
+                message = json.dumps(dt)
+                resp = 200
+            except Exception as e:
+                message = json.dumps({"Error": str(e)})
+                resp = 400
+            self.set_json_header(resp)
+
         else:
             self.set_json_header()
             self.server.others.append(in_data)
@@ -119,7 +194,7 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
             #      "Internal Error %s" % self.server.counter})
             # message = json.dumps(
             #     {"Error": "Internal Error for %s" % self.path})
-            resp = 500
+            resp = self.server.error_status
             self.set_json_header(resp)
             self.wfile.write(bytes(message, "utf8"))
             return
@@ -128,7 +203,12 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
         # print(self.path)
         length = int(self.headers.get('Content-Length'))
         contenttype = self.headers.get('Content-Type')
-        in_data = self.rfile.read(length)
+        in_data = self.read_body(length)
+        if in_data is None:
+            message = json.dumps({"Error": "Unsupported Media Type"})
+            self.set_json_header(415)
+            self.wfile.write(bytes(message, "utf8"))
+            return
 
         message = ""
 
@@ -143,9 +223,11 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
                     raise Exception("Empty username")
                 if not dt["password"]:
                     raise Exception("Empty password")
-                message = json.dumps(
-                    {"id": "H3BxDGwgvnGbp5ZlhdksDKdIpljtEm8"
-                     "yilq1B7s7CygIaxbQRAMmZBgJ6JW2GjnX"})
+                dtoken = {"id": "H3BxDGwgvnGbp5ZlhdksDKdIpljtEm8"
+                          "yilq1B7s7CygIaxbQRAMmZBgJ6JW2GjnX"}
+                if self.server.login_ttl:
+                    dtoken["ttl"] = self.server.login_ttl
+                message = json.dumps(dtoken)
                 resp = 200
             except Exception as e:
                 message = json.dumps({"Error": str(e)})
@@ -161,15 +243,22 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
             try:
                 if not spath[-1]:
                     raise Exception("Empty access_token")
-                self.server.datasets.append(in_data)
                 dt = json.loads(in_data)
-                # print("Datasets: %s" % dt)
-                print("Datasets: %s" % dt["pid"])
                 npid = self.server.pidprefix + dt["pid"]
-                dt["pid"] = npid
-                self.server.pid_dataset[npid] = json.dumps(dt)
-                message = "{}"
-                resp = 200
+                if self.server.dataset_conflicts and \
+                   npid in self.server.pid_dataset:
+                    message = json.dumps(
+                        {"Error": "Dataset %s already exists" % npid})
+                    resp = 409
+                else:
+                    self.server.datasets.append(in_data)
+                    # print("Datasets: %s" % dt)
+                    print("Datasets: %s" % dt["pid"])
+                    dt["pid"] = npid
+                    self.server.set_updated_time(dt)
+                    self.server.pid_dataset[npid] = json.dumps(dt)
+                    message = "{}"
+                    resp = 200
             except Exception as e:
                 message = json.dumps({"Error": str(e)})
                 resp = 400
@@ -197,7 +286,7 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
                             self.server.id_attachment[npid] = json.dumps(dt)
                             # print("IDA POST %s" % self.server.id_attachment)
                             resp = 200
-                            message = "{}"
+                            message = json.dumps(dt)
                         except Exception as e:
                             message = json.dumps({"Error": str(e)})
                             resp = 400
@@ -218,7 +307,7 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
                 npid = str(uuid.uuid4())
                 dt["id"] = npid
                 self.server.id_origdatablock[npid] = json.dumps(dt)
-                message = "{}"
+                message = json.dumps(dt)
                 resp = 200
             except Exception as e:
                 message = json.dumps({"Error": str(e)})
@@ -236,6 +325,8 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
         """
 
         self.server.counter += 1
+        if self.server.counter in self.server.get_delays:
+            time.sleep(self.server.get_delays[self.server.counter])
         if self.server.counter in self.server.error_requests:
             # message = json.dumps(
             #     {"Error":
@@ -243,7 +334,7 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
             message = json.dumps({"Error": "Internal Error"})
             # message = json.dumps(
             #     {"Error": "Internal Error for %s" % self.path})
-            resp = 500
+            resp = self.server.error_status
             self.set_html_header(resp)
             self.wfile.write(bytes(message, "utf8"))
             return
@@ -257,15 +348,45 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
         else:
             spath = [path]
         dspath = spath[0].split("/")
+        etag = None
         try:
             if not spath[-1]:
                 raise Exception("Empty access_token")
 
-            if len(dspath) > 2 and dspath[1].lower() == "datasets":
+            if len(dspath) == 2 and \
+               dspath[1].lower().startswith("datasets?filter=") and \
+               self.server.dataset_filters:
+                query = urllib.parse.parse_qs(dspath[1].split("?", 1)[1])
+                flt = json.loads(query["filter"][0])
+                self.server.dataset_queries.append(flt)
+                if "inq" in flt["where"]["pid"]:
+                    inq = flt["where"]["pid"]["inq"]
+                    dss = [json.loads(ds) for pid, ds
+                           in sorted(self.server.pid_dataset.items())
+                           if pid in inq]
+                else:
+                    like = flt["where"]["pid"]["like"]
+                    dss = [json.loads(ds) for pid, ds
+                           in sorted(self.server.pid_dataset.items())
+                           if re.match(like, pid)]
+                if flt.get("fields"):
+                    dss = [dict((ky, ds[ky]) for ky in flt["fields"]
+                                if ky in ds) for ds in dss]
+                skip = flt.get("skip", 0)
+                if flt.get("limit"):
+                    dss = dss[skip:skip + flt["limit"]]
+                else:
+                    dss = dss[skip:]
+                message = json.dumps(dss)
+            elif len(dspath) > 2 and dspath[1].lower() == "datasets":
                 pid = dspath[2].replace("%2F", "/")
                 if len(dspath) == 3:
+                    self.server.dataset_gets += 1
                     if pid in self.server.pid_dataset:
                         message = self.server.pid_dataset[pid]
+                        if self.server.dataset_etags:
+                            etag = '"%s"' % hashlib.md5(
+                                message.encode()).hexdigest()
                     else:
                         message = ""
                 elif (len(dspath) == 4 and
@@ -275,6 +396,8 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
                         jodb = json.loads(odb)
                         if "datasetId" in jodb.keys() and \
                            jodb["datasetId"] == pid:
+                            if self.server.normalized_times:
+                                self.normalize_times(jodb)
                             odbs.append(jodb)
                     message = json.dumps(odbs)
                 elif (len(dspath) == 4 and
@@ -315,7 +438,17 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
         except Exception as e:
             message = json.dumps({"Error": str(e)})
             resp = 400
-        self.set_html_header(resp)
+        if etag:
+            if self.headers.get('If-None-Match') == etag:
+                self.server.not_modified += 1
+                resp = 304
+                message = ""
+            self.send_response(resp)
+            self.send_header('Content-type', 'text/html')
+            self.send_header('ETag', etag)
+            self.end_headers()
+        else:
+            self.set_html_header(resp)
         self.wfile.write(bytes(message, "utf8"))
 
     def do_DELETE(self):
@@ -329,7 +462,7 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
             message = json.dumps({"Error": "Internal Error"})
             # message = json.dumps(
             #     {"Error": "Internal Error for %s" % self.path})
-            resp = 500
+            resp = self.server.error_status
             self.set_html_header(resp)
             self.wfile.write(bytes(message, "utf8"))
             return
@@ -354,6 +487,21 @@ class SciCatMockHandler(BaseHTTPRequestHandler):
                     if pid in self.server.pid_dataset.keys():
                         self.server.pid_dataset.pop(pid)
                         print("Datasets: delete %s" % pid)
+                elif len(dspath) == 4 and dspath[3].lower() in [
+                        "origdatablocks", "attachments"]:
+                    if not self.server.bulk_deletes:
+                        self.set_html_header(404)
+                        self.wfile.write(bytes(json.dumps(
+                            {"Error": "Not Found"}), "utf8"))
+                        return
+                    if dspath[3].lower() == "origdatablocks":
+                        items = self.server.id_origdatablock
+                    else:
+                        items = self.server.id_attachment
+                    for iid, dt in list(items.items()):
+                        if json.loads(dt).get("datasetId") == pid:
+                            items.pop(iid)
+                    print("Datasets %s: delete %s" % (dspath[3], pid))
                 elif len(dspath) == 4 and dspath[3].lower() == "attachments":
                     aid = dspath[4].replace("%2F", "/")
                     # print("IDA DELETE %s" % self.server.id_attachment)
@@ -414,8 +562,44 @@ class SciCatTestServer(HTTPServer):
         self.counter = 0
         #: (:obj:`int`) request ids with error
         self.error_requests = []
+        #: (:obj:`int`) response status of requests with error
+        self.error_status = 500
         #: (:obj:`str`) pid prefix
         self.pidprefix = ""
+        #: (:obj:`float`) token time-to-live returned by login
+        self.login_ttl = None
+        #: (:obj:`bool`) support dataset filter queries
+        self.dataset_filters = False
+        #: (:obj:`list`<:obj:`dict`>) dataset filter queries
+        self.dataset_queries = []
+        #: (:obj:`bool`) send dataset etags
+        self.dataset_etags = False
+        #: (:obj:`int`) number of not modified responses
+        self.not_modified = 0
+        #: (:obj:`bool`) support deletes of all dataset items
+        self.bulk_deletes = False
+        #: (:obj:`bool`) support gzip request bodies
+        self.compressed_bodies = False
+        #: (:obj:`bool`) merge patched scientificMetadata
+        self.metadata_merge = False
+        #: (:obj:`bool`) reject posts of existing datasets
+        self.dataset_conflicts = False
+        #: (:obj:`dict`<:obj:`int`, :obj:`float`>)
+        #:    delays in s of GET request ids
+        self.get_delays = {}
+        #: (:obj:`list`<:obj:`dict`>) patches without dataset pid
+        self.partial_patches = []
+        #: (:obj:`list`<:obj:`tuple`>) method, path and size
+        #:    of compressed requests
+        self.compressed_requests = []
+        #: (:obj:`bool`) return file times in UTC with milliseconds
+        self.normalized_times = False
+        #: (:obj:`bool`) set modification times of datasets
+        self.updated_times = False
+        #: (:obj:`int`) number of dataset GET requests
+        self.dataset_gets = 0
+        #: (:obj:`list`<:obj:`str`>) origdatablock patches
+        self.origdatablock_patches = []
         # self.pidprefix = "10.3204/"
 
     def reset(self):
@@ -430,6 +614,33 @@ class SciCatTestServer(HTTPServer):
         self.id_attachment = {}
         self.counter = 0
         self.error_requests = []
+        self.error_status = 500
+        self.login_ttl = None
+        self.dataset_filters = False
+        self.dataset_queries = []
+        self.dataset_etags = False
+        self.not_modified = 0
+        self.bulk_deletes = False
+        self.compressed_bodies = False
+        self.compressed_requests = []
+        self.metadata_merge = False
+        self.dataset_conflicts = False
+        self.get_delays = {}
+        self.partial_patches = []
+        self.normalized_times = False
+        self.updated_times = False
+        self.dataset_gets = 0
+        self.origdatablock_patches = []
+
+    def set_updated_time(self, dataset):
+        """ sets the modification time of the posted or patched dataset
+
+        :param dataset: dataset
+        :type dataset: :obj:`dict` <:obj:`str`, `any`>
+        """
+        if self.updated_times:
+            dataset["updatedAt"] = datetime.datetime.now(
+                datetime.timezone.utc).isoformat()
 
     def run(self):
         try:
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#   This file is part of scingestor - Scientific Catalog Dataset Ingestor
+#
+#    Copyright (C) 2021-2021 DESY, Jan Kotanski <jkotan@mail.desy.de>
+#
+#    nexdatas is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    nexdatas is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with scingestor.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     Jan Kotanski <jan.kotanski@desy.de>
+#
+
+import unittest
+import threading
+import time
+
+from scingestor import tokenProvider
+from scingestor import scicatClient
+from scingestor.logger import init_logger, get_logger
+
+try:
+    from .SciCatTestServer import SciCatTestServer, SciCatMockHandler
+except Exception:
+    from SciCatTestServer import SciCatTestServer, SciCatMockHandler
+
+
+# test fixture
+class TokenProviderTest(unittest.TestCase):
+
+    # constructor
+    # \param methodName name of the test method
+    def __init__(self, methodName):
+        unittest.TestCase.__init__(self, methodName)
+
+        self.maxDiff = None
+        self.url = 'http://localhost:8881/Users/login'
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json'}
+        self.token = "H3BxDGwgvnGbp5ZlhdksDKdIpljtEm8" \
+            "yilq1B7s7CygIaxbQRAMmZBgJ6JW2GjnX"
+        if get_logger() is None:
+            init_logger("TokenProviderTest", "error")
+
+    def setUp(self):
+        self.starthttpserver()
+
+    def starthttpserver(self):
+        self.__server = SciCatTestServer(('', 8881), SciCatMockHandler)
+
+        self.__thread = threading.Thread(None, self.__server.run)
+        self.__thread.start()
+
+    def stophttpserver(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+        self.__server = None
+
+    def tearDown(self):
+        self.stophttpserver()
+
+    def test_shared_provider(self):
+        tp1 = tokenProvider.get_token_provider(
+            self.url, "ingestor", "12342345", self.headers, {})
+        tp2 = tokenProvider.get_token_provider(
+            self.url, "ingestor", "12342345", dict(self.headers),
+            {"scicat_url": "http://localhost:8881"})
+        tp3 = tokenProvider.get_token_provider(
+            self.url, "ingestor2", "12342345", self.headers, {})
+        self.assertTrue(isinstance(tp1, tokenProvider.TokenProvider))
+        self.assertTrue(tp1 is tp2)
+        self.assertTrue(tp1 is not tp3)
+
+    def test_no_ttl(self):
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers)
+        self.assertEqual(tp.get_token(), self.token)
+        self.assertEqual(tp.get_token(), self.token)
+        self.assertEqual(len(self.__server.userslogin), 2)
+
+    def test_ttl_cache(self):
+        self.__server.login_ttl = 3600
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers)
+        try:
+            for _ in range(5):
+                self.assertEqual(tp.get_token(), self.token)
+            self.assertEqual(len(self.__server.userslogin), 1)
+            tp.invalidate()
+            self.assertEqual(tp.get_token(), self.token)
+            self.assertEqual(len(self.__server.userslogin), 2)
+        finally:
+            tp.stop()
+
+    def test_config_ttl(self):
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers,
+            {"token_ttl": 3600, "token_background_refresh": False})
+        for _ in range(3):
+            self.assertEqual(tp.get_token(), self.token)
+        self.assertEqual(len(self.__server.userslogin), 1)
+
+    def test_background_refresh(self):
+        self.__server.login_ttl = 0.8
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers,
+            {"token_refresh_margin": 0.2})
+        try:
+            self.assertEqual(tp.get_token(), self.token)
+            self.assertEqual(len(self.__server.userslogin), 1)
+            time.sleep(0.7)
+            self.assertTrue(len(self.__server.userslogin) > 1)
+            logins = len(self.__server.userslogin)
+            self.assertEqual(tp.get_token(), self.token)
+            self.assertEqual(len(self.__server.userslogin), logins)
+        finally:
+            tp.stop()
+
+    def test_login_retry(self):
+        self.__server.error_requests = [1, 2]
+        self.__server.error_status = 503
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers,
+            {"login_retry_delay": 0.01})
+        self.assertEqual(tp.get_token(), self.token)
+        self.assertEqual(self.__server.counter, 3)
+
+    def test_login_no_retry(self):
+        self.__server.error_requests = [1, 2]
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers,
+            {"login_retry_delay": 0.01})
+        with self.assertRaises(Exception) as ctx:
+            tp.get_token()
+        self.assertEqual(str(ctx.exception), '{"Error": "Internal Error"}')
+        self.assertEqual(self.__server.counter, 1)
+
+    def test_login_tries_number(self):
+        self.__server.error_requests = [1, 2, 3]
+        self.__server.error_status = 502
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers,
+            {"login_retry_delay": 0.01, "login_tries_number": 2})
+        with self.assertRaises(Exception):
+            tp.get_token()
+        self.assertEqual(self.__server.counter, 2)
+
+    def test_renew_rejected_token(self):
+        self.__server.login_ttl = 3600
+        tp = tokenProvider.TokenProvider(
+            self.url, "ingestor", "12342345", self.headers,
+            {"token_background_refresh": False})
+        token = tp.get_token()
+        self.assertEqual(len(self.__server.userslogin), 1)
+        self.__server.error_requests = [2]
+        self.__server.error_status = 401
+        response = scicatClient.get_scicat_client(
+            {"token_background_refresh": False}).get(
+                "http://localhost:8881/Datasets/99001234%2F1234",
+                token=token)
+        self.assertTrue(response.ok)
+        self.assertEqual(len(self.__server.userslogin), 2)
+        self.assertEqual(self.__server.counter, 4)
+        self.assertEqual(tp.renew("unknown"), None)
+        self.assertEqual(len(self.__server.userslogin), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,6 +29,16 @@ import DatasetWatcher_test
 import DatasetIngest_test
 import ModelIngest_test
 import DatasetWatcherFIO_test
+import SciCatClient_test
+import TokenProvider_test
+import DatasetIngestor_test
+import RetryPolicy_test
+import ConcurrencyLimiter_test
+import CircuitBreaker_test
+import JsonStream_test
+import PayloadValidator_test
+import IngestionPipeline_test
+import MetadataGenerator_test
 
 try:
     __import__("h5py")
@@ -82,6 +92,36 @@ def main():
     basicsuite.addTests(
         unittest.defaultTestLoader.loadTestsFromModule(
             DatasetWatcherFIO_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            SciCatClient_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            TokenProvider_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            DatasetIngestor_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            RetryPolicy_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            ConcurrencyLimiter_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            CircuitBreaker_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            JsonStream_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            PayloadValidator_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            IngestionPipeline_test))
+    basicsuite.addTests(
+        unittest.defaultTestLoader.loadTestsFromModule(
+            MetadataGenerator_test))
 
     # test runner
     runner = unittest.TextTestRunner()